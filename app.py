@@ -1,387 +1,48 @@
 import pandas as pd
-import tiktoken
 import os
 import streamlit as st
 import re
-import openai
-import io
-import time
-import json
-from datadog import initialize, api
-from ddtrace import patch_all,tracer
-import requests
+from export import mime_types, output_formats
+from jobqueue import QueuedJob
+from profiling import RunProfiler, null_profiler
+from transco import (
+    JobJournal, MappingJob, configure, default_chart, get_chart_registry, get_job_queue, journal_dir,
+    max_attempts_per_account, model, output_dir, read_accounts, split_line
+)
 
 
-# Initialisation du tracer
-def initialize_datadog():
-    """Initialize Datadog configuration"""
-    options = {
-        'api_key': st.secrets["DATADOG_API_KEY"]["DATADOG_API_KEY"],
-        'api_host': 'https://api.datadoghq.eu',
-        'dd_site': 'datadoghq.eu',
-        'disable_trace_agent': True
-    }
-    
-    try:
-        initialize(**options)
-        return True
-    except Exception as e:
-        st.warning(f"Erreur d'initialisation Datadog: {str(e)}")
-        return False
-class DatadogMetrics:
-    def __init__(self):
-        self.initialized = initialize_datadog()
-    
-    def send_metric(self, metric_name, value, tags=None):
-        if not self.initialized:
-            return
-            
-        try:
-            # Envoi direct à l'API Datadog
-            metrics = [{
-                'metric': metric_name,
-                'points': [[int(time.time()), value]],
-                'tags': tags or []
-            }]
-            api.Metric.send(metrics)
-        except Exception as e:
-            st.warning(f"Erreur d'envoi de métrique: {str(e)}")
-
-
-metrics = DatadogMetrics()
-# Set the OpenAI model name (ensure the model is supported by your OpenAI subscription)
-model = "gpt-4o-2024-11-20"
-
-# Retrieve the OpenAI API key from Streamlit secrets
-openai.api_key = st.secrets["API_key"]["openai_api_key"]
+# Pass the Streamlit secrets to the mapping engine (clients are created on first use)
+configure(
+    openai_key=st.secrets["API_key"]["openai_api_key"],
+    datadog_key=st.secrets["DATADOG_API_KEY"]["DATADOG_API_KEY"]
+)
 
 # Define paths to data files relative to the current script’s directory
 base_dir = os.path.dirname(__file__) 
-coa_file_path = os.path.join(base_dir, 'data', 'COA_simplifié_TC2.xlsx')
 template_file_path = os.path.join(base_dir, 'data', 'Template_TranscoGPT.xlsx')
 
 # Load the Excel template to be provided as a downloadable file
 template = open(template_file_path, "rb").read()
 
-# Load the COA (Chart of Accounts) file into a DataFrame
-coa = pd.read_excel(coa_file_path)
-
-def clean_text(text):
-    """
-    Normalize the account type textual values into a standardized format.
-    - Convert non-string values to string.
-    - Convert the text to lowercase.
-    - If the text starts with 'b', classify as 'BS'.
-    - If the text starts with 'p', classify as 'P&L'.
-    """
-    if not isinstance(text, str):
-        text = str(text)
-    text_cleaned = text.lower()
-    if text_cleaned.startswith('b'):
-        text_cleaned = 'BS'
-    elif text_cleaned.startswith('p'):
-        text_cleaned = 'P&L'
-    return text_cleaned
-
-# Apply the normalization function to the 'BS / P&L' column
-coa['BS / P&L'] = coa['BS / P&L'].apply(clean_text)
-
-# Split the COA into two separate lists: one for BS accounts and one for P&L accounts
-coa_bs = coa[coa['BS / P&L'] == 'BS']
-coa_pl = coa[coa['BS / P&L'] == 'P&L']
-
-# Free memory from the initial COA DataFrame as we now have separate filtered lists
-del coa
-
-# Convert COA rows for BS and P&L into readable strings for the GPT prompt
-coa_bs = coa_bs.apply(lambda row: f"{row['GL account']} - {row['Account Name']} - {row['BS / P&L']}", axis=1).tolist()
-coa_pl = coa_pl.apply(lambda row: f"{row['GL account']} - {row['Account Name']} - {row['BS / P&L']}", axis=1).tolist()
-
-def estimate_prompt_cost(base_prompt, lines, model, acc_type, max_tokens=16000):
-    """
-    Estimate the overall cost of processing a set of lines through the GPT model based on the token count.
-    - base_prompt: The common introductory prompt text.
-    - lines: The accounts data lines to process.
-    - model: The GPT model name.
-    - acc_type: The type of accounts being processed ('BS' or 'P&L').
-    - max_tokens: The maximum number of tokens allowed per prompt block.
-    
-    The function:
-    1. Iteratively prepares prompts with a limited number of accounts.
-    2. Calculates the total tokens for all these prompt blocks.
-    3. Estimates the cost based on a predefined rate per 1000 tokens.
-    """
-    encoding = tiktoken.encoding_for_model(model)
-    remaining_lines = lines
-    total_tokens = 0
-    while remaining_lines:
-        prompt, remaining_lines, prompt_tokens = prepare_prompt_with_limit(base_prompt, remaining_lines, model, 25, max_tokens)
-        prompt += "\n"
-        # Add relevant COA accounts list depending on the account type
-        if acc_type == 'BS':
-            prompt += "Voici les comptes BS à associer :\n" + "\n".join(coa_bs)
-        elif acc_type == 'P&L':
-            prompt += "Voici les comptes P&L à associer :\n" + "\n".join(coa_pl)
-
-        # Count tokens for the constructed prompt
-        total_tokens += len(encoding.encode(prompt))
-        total_tokens += prompt_tokens
-
-    # Define the cost per 1000 tokens (example rate)
-    cost_per_1000_tokens = 0.00250
-    total_cost = (total_tokens / 1000) * cost_per_1000_tokens
-    return total_cost
-
-def prepare_prompt_with_limit(base_prompt, lines, model, max_libelles=25, max_tokens=16000):
-    """
-    Build a prompt that includes a limited number of account lines to avoid exceeding token limits.
-    - base_prompt: The base prompt text.
-    - lines: The list of account lines to be appended.
-    - max_libelles: Maximum number of lines (accounts) to add to the prompt.
-    - max_tokens: Maximum tokens per prompt (not strictly enforced here, but good practice).
-    
-    Returns:
-        final_prompt: The constructed prompt string.
-        remaining_lines: The lines that were not included in this prompt (to be processed in subsequent calls).
-        prompt_tokens: The count of tokens for the appended lines (optional for future calculations).
-    """
-    final_prompt = base_prompt
-    remaining_lines = []
-    count = 0
-
-    for line in lines:
-        if count > max_libelles:
-            # If maximum number of lines is reached, push the rest into remaining_lines
-            remaining_lines.append(line)
-        else:
-            final_prompt += "\n" + line + "\n "
-            count += 1
-
-    # For simplicity, we do not explicitly count prompt tokens here; 
-    # if needed, token counting logic can be added.
-    prompt_tokens = 0  
-    return final_prompt, remaining_lines, prompt_tokens
-
-def process_with_gpt_in_batches(base_prompt, lines, model, type_compte, max_tokens=16000):
-    remaining_lines = lines
-    extracted_data = []
-    batch_start_time = time.time()
-    
-    while remaining_lines:
-        request_start_time = time.time()
-        prompt, remaining_lines, _ = prepare_prompt_with_limit(base_prompt, remaining_lines, model, 25, max_tokens)
-        prompt += "\n"
-
-        if type_compte == 'BS':
-            prompt += "Existing accounts in PCG :\n" + "\n".join(coa_bs)
-        elif type_compte == 'P&L':
-            prompt += "Existing accounts in PCG :\n" + "\n".join(coa_pl)
-        prompt += "\n"
-        prompt += "Please provide the corresponding COA account for all the americain accounts above\n"
-        messages = [{"role": "system", "content": "You are an assistant that provides structured JSON responses based on the schema."},
-                    {"role": "user", "content": prompt}]
-        response_format = {
-    "type": "json_schema",
-    "json_schema": {
-        "name": "account_matching_response", 
-        "schema": {
-            "type": "object",  
-            "properties": {
-                "final_answer": {  
-                    "type": "array", 
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "account_number": {"type": "string"},
-                            "label": {"type": "string"},
-                            "coa_account": {"type": "string"},
-                            "coa_label": {"type": "string"},
-                            "justification": {"type": "string"}
-                        },
-                        "required": ["account_number", "label", "coa_account", "coa_label", "justification"],
-                        "additionalProperties": False  
-                    }
-                }
-            },
-            "required": ["final_answer"],  # Seul "final_answer" est obligatoire
-            "additionalProperties": False  # Aucun autre champ non spécifié n'est autorisé
-        },
-        "strict": True  # Active un contrôle strict du schéma
-    }
-}
-
-
-        try:
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                response_format = response_format,
-                temperature=0.5,
-                max_tokens=max_tokens
-            )
-            parsed_response = json.loads(response['choices'][0]['message']['content'])
-
-                # Vérifier si "final_answer" contient une liste ou un seul objet
-            final_answer = parsed_response["final_answer"]
-            
-            if isinstance(final_answer, list):
-                # Si c'est une liste, étendre extracted_data avec ses éléments
-                extracted_data.extend(final_answer)
-            elif isinstance(final_answer, dict):
-                # Si c'est un seul objet JSON, l'ajouter directement
-                extracted_data.append(final_answer)
-            else:
-                raise ValueError("Unexpected format for 'final_answer'. Must be a list or dict.")
-            # Tracer le succès
-            duration = time.time() - request_start_time
-            tracer.send_trace(
-                name="gpt_request",
-                duration=duration,
-                tags={
-                    "model": model,
-                    "type": type_compte,
-                    "batch_size": len(final_answer) if isinstance(final_answer, list) else 1,
-                    "status": "success"
-                }
-            )
-            
-            # Envoyer aussi la métrique
-            metrics.send_metric(
-                'gpt.request.duration',
-                duration,
-                [
-                    'status:success',
-                    f'model:{model}',
-                    f'type:{type_compte}'
-                ]
-            )
-        except Exception as e:
-            duration = time.time() - request_start_time
-            # Tracer l'erreur
-            tracer.send_trace(
-                name="gpt_request",
-                duration=duration,
-                tags={
-                    "model": model,
-                    "type": type_compte,
-                    "batch_size": len(remaining_lines),
-                    "status": "error"
-                },
-                error=e
-            )
-            
-            # Envoyer la métrique d'erreur
-            metrics.send_metric(
-                'gpt.request.error',
-                duration,
-                [
-                    'status:error',
-                    f'model:{model}',
-                    f'type:{type_compte}'
-                ]
-            )
-            print(f"Error calling the API: {e}")
-
-            break
-        time.sleep(1)
-        tracer.send_trace(
-        name="process_batch",
-        duration=time.time() - batch_start_time,
-        tags={
-            "model": model,
-            "type": type_compte,
-            "total_processed": len(extracted_data)
-        }
-    )
-    return extracted_data
-
-# Base prompt template to guide GPT toward mapping a foreign account to French PCG accounts
-base_prompt = """Act as an expert in international accounting. Your objective is to establish a correspondence between each provided foreign accounting account (account number, label, and type) and an appropriate French PCG (Plan Comptable Général) account, based on a predefined list of accounts.
-The list contains either of two types of accounts:
-BS (Balance Sheet): accounts related to the balance sheet.
-P&L (Profit & Loss): accounts related to the income statement.
-For each foreign account provided, carefully analyze the following information:
-Account Number: {account_number},Label: {label}, Type: {account_type}
-Then, identify the corresponding French PCG account. Make sure to consider and fully process every account provided, without omitting any.
-"""
-def extract_from_list(response_input, acc_type):
-    """
-    Convert a JSON string or a list of dictionaries into a DataFrame. Each dictionary should contain keys:
-    ['account_number', 'label', 'coa_account', 'coa_label', 'justification'].
-
-    The returned DataFrame will have the following columns:
-    ['n° de compte', 'Libelle', 'BS ou P&L', 'Compte COA', 'Libelle COA', 'Justification']
+# Seconds between two refreshes of the progress of the running jobs
+progress_poll_interval = 2
 
-    Parameters:
-    - response_input: A list of dictionaries extracted from the GPT responses.
-    - acc_type: The account type ('BS' or 'P&L'), added as a column in the final DataFrame.
+@st.cache_resource
+def load_charts():
+    """Compile (or load the compiled artifacts of) every chart of accounts once per server process."""
+    return get_chart_registry().preload()
 
-    Returns:
-    A pandas DataFrame containing the structured mapping results.
-    """
-
-    data = []
-    for item in response_input:
-        try:
-                # Extracting data from the dictionary
-            numero = item['account_number']
-            label = item['label']
-            coa_account = item['coa_account']
-            coa_label = item['coa_label']
-            justification = item['justification']
-
-                # Append the extracted information to the data list
-            data.append([numero, label, acc_type, coa_account, coa_label, justification])
-        except AttributeError:
-            st.write("Error processing entry: ", item)
-
-    # Create the DataFrame
-    df = pd.DataFrame(
-        data,
-        columns=['n° de compte', 'Libelle', 'BS ou P&L', 'Compte COA', 'Libelle COA', 'Justification']
-    )
-
-    st.write(f"Finished processing {len(data)} {acc_type} accounts")
-    return df
-def remove_double_asterisks(df):
-    # Pour chaque colonne du DataFrame
-    for col in df.columns:
-        # Vérifier si la colonne contient des données de type object (généralement des chaînes)
-        if df[col].dtype == 'object':
-            # Remplacer toutes les occurrences de '**' par '' (une chaîne vide)
-            df[col] = df[col].str.replace('**', '', regex=False)
-    return df
-def normalize_number(num_str: str) -> str:
-    """
-    Normalize a numeric-like string by removing leading asterisks and spaces, and converting to an integer-like string if possible.
-
-    Parameters:
-    - num_str: The input string to normalize.
-
-    Returns:
-    - A normalized string representing the number, or the original string if not convertible.
-    """
-    try:
-        # Strip leading and trailing spaces and remove leading '*'
-        num_str = num_str.strip().lstrip('*').strip()
-
-        # Attempt to convert the cleaned string to a number and back to string
-        num = float(num_str)
-        return str(int(num)) if num.is_integer() else str(num)
-    except (ValueError, AttributeError):
-        # Return the original string if conversion fails
-        return num_str
 def main():
     """
     Main Streamlit application logic:
     1. Display introduction and instructions to the user.
     2. Allow the user to download a template file.
-    3. Enable the user to upload their own Excel file.
-    4. Perform data validation and process the uploaded file.
+    3. Enable the user to upload one or more Excel files.
+    4. Perform data validation and process the uploaded files.
     5. Once the 'GO' button is clicked:
-       - Process BS accounts and P&L accounts separately via GPT.
-       - Extract the results and combine them into a single DataFrame.
-       - Provide the result as a downloadable Excel file.
+       - Submit every file as a job to the background queue shared by all the users.
+       - Poll the progress of the jobs (accounts mapped, time left, cost so far).
+       - Provide each result as a downloadable file as soon as its job is finished.
     """
     # Application title and introduction
     st.title("TranscoGPT by Supervizor AI")
@@ -413,120 +74,225 @@ def main():
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
 
-    # File uploader for the user's Excel file
-    file_uploaded = st.file_uploader("Please upload an Excel file only.", type=["xlsx"])
-    if file_uploaded is not None:
+    # Follow the progress of a job running in another session
+    with st.sidebar:
+        followed_job = st.text_input("Follow a job (Job ID)")
+        if followed_job:
+            followed_job = followed_job.strip()
+            job_progress = {"total": None}
+            queued = get_job_queue().get(followed_job)
+            if queued is not None:
+                # Job of the background queue (this server): live progress, time left and cost
+                job_progress = queued.progress()
+                job_progress["finished"] = queued.finished()
+                if job_progress["status"] == "running" and job_progress["eta_seconds"] is not None:
+                    st.caption(f"About {format_duration(job_progress['eta_seconds'])} left, ${job_progress['cost']:.2f} spent.")
+            elif re.fullmatch(r"[0-9a-f]{32}", followed_job):
+                job_progress = JobJournal(journal_dir, followed_job).progress()
+            if job_progress["total"] is None:
+                st.write("Unknown job.")
+            else:
+                status = "finished" if job_progress["finished"] else "running or interrupted"
+                st.write(f"{job_progress['done']}/{job_progress['total']} accounts mapped ({status}).")
+                st.progress(min(1.0, job_progress['done'] / job_progress['total']) if job_progress['total'] else 1.0)
+
+        # Timing breakdown of the next run, for performance investigations
+        with st.expander("Profiling"):
+            profile_run = st.checkbox("Time each stage of the run")
+            profile_deep = st.checkbox("Deep capture (cProfile and tracemalloc, slower)", disabled=not profile_run)
+
+    # Target chart of accounts (the compiled charts are shared by all the sessions)
+    charts = load_charts()
+    chart_names = charts.names()
+    chart_name = st.selectbox(
+        "Target chart of accounts", chart_names,
+        index=chart_names.index(default_chart) if default_chart in chart_names else 0
+    )
 
-        df = pd.read_excel(file_uploaded)
-        df = df.drop_duplicates()
-        numero_acc_column = df.columns[0]
-        label_column = df.columns[1]
-        bs_pl_column = df.columns[2]
-        df[bs_pl_column] = df[bs_pl_column].apply(clean_text)
-        lines_bs = df[df[bs_pl_column] == 'BS']
-        lines_pl = df[df[bs_pl_column] == 'P&L']
-        del df
+    # File uploader for the user's accounts files (Excel, or CSV/Parquet for large general-ledger extracts)
+    files_uploaded = st.file_uploader(
+        "Please upload one or more Excel, CSV or Parquet files.", type=["xlsx", "csv", "parquet"],
+        accept_multiple_files=True
+    )
+    if files_uploaded:
 
-        if lines_bs.empty:
-            st.warning("No Balance Sheet accounts found.")
-            total_bs = 0
-            prompt_cost = 0
-            lines_bs = []
-        else:
-            st.info(f"Found {len(lines_bs)} Balance Sheet accounts.")
-            total_bs = len(lines_bs)
-                # Prepare BS lines for GPT processing
-            lines_bs = lines_bs.apply(lambda row: f"{row[numero_acc_column]},{row[label_column]},{row[bs_pl_column]}", axis=1).tolist()
-            prompt_cost = estimate_prompt_cost(base_prompt, lines_bs, model, 'BS', max_tokens=16000)
-        if lines_pl.empty:
-            st.warning("No Profit and Loss accounts found.")
-            total_pl = 0
-            lines_pl = []
-            prompt_cost += 0
-        else:
-            st.info(f"Found {len(lines_pl)} Profit and Loss accounts.")
-            total_pl = len(lines_pl)
-                # Prepare P&L lines for GPT processing
-            lines_pl = lines_pl.apply(lambda row: f"{row[numero_acc_column]},{row[label_column]},{row[bs_pl_column]}", axis=1).tolist()
-            prompt_cost += estimate_prompt_cost(base_prompt, lines_pl, 'gpt-4o','P&L', max_tokens=16000)
-        output = (total_bs + total_pl)*120
-        cost_per_1000_tokens_for_gen = 0.01
-        gen_cost = (output / 1000) * cost_per_1000_tokens_for_gen
-        gen_cost = gen_cost + prompt_cost
-        st.info(f"Estimated cost: ${gen_cost:.2f}")
-        
+        prepared = []
+        for file_uploaded in files_uploaded:
+            if len(files_uploaded) > 1:
+                st.subheader(file_uploaded.name)
+            prepared.append((file_uploaded.name,) + prepare_job(file_uploaded, chart_name, profile_run, profile_deep))
+
+        output_format = st.selectbox(
+            "Output format", list(output_formats), format_func=lambda extension: output_formats[extension]
+        )
         if st.button("GO"):
+            # The files run in the background job queue; this session only follows their progress
+            queued_jobs = [
+                QueuedJob(name, job, os.path.join(output_dir, f"{job.job_id}{output_format}"), profiler=profiler)
+                for name, job, profiler in prepared
+            ]
+            followed = st.session_state.setdefault('job_ids', [])
+            for queued in get_job_queue().submit(queued_jobs):
+                if queued.id in followed:
+                    followed.remove(queued.id)
+                followed.append(queued.id)
+        else:
+            # The run was not launched: stop the captures
+            for _, _, profiler in prepared:
+                if profiler.enabled:
+                    profiler.finish()
+
+    # Progress of the jobs submitted from this session, polled while one of them is running
+    job_ids = st.session_state.get('job_ids', [])
+    if job_ids:
+        queue = get_job_queue()
+        running = any(queue.get(job_id) is not None and not queue.get(job_id).finished() for job_id in job_ids)
+        st.fragment(run_every=progress_poll_interval if running else None)(show_jobs)(job_ids, running)
+
+def prepare_job(file_uploaded, chart_name, profile_run, profile_deep):
+    """
+    Read an uploaded file, resolve what is already known (journal, pre-classifier, cache)
+    and show what is left to send to GPT with its estimated cost.
 
-            if  lines_bs:
-                extracted_data_bs = process_with_gpt_in_batches(base_prompt, lines_bs, model, 'BS',max_tokens=16000)
-                processed_numbers = {item['account_number'] for item in extracted_data_bs}
-                #print(f"Processed numbers before update: {processed_numbers}")
-            # We determine the lines that have not been processed yet
-                remaining_lines_bs = [line for line in lines_bs if line.split(',')[0].strip() not in processed_numbers]
-                #print(f"the remaining lines before loop are {remaining_lines_bs}")
-                while remaining_lines_bs:
-                    time.sleep(2)
-                    # we process the remaining lines
-                    new_data = process_with_gpt_in_batches(base_prompt, remaining_lines_bs, model, 'BS', max_tokens=16000)
-                    extracted_data_bs.extend(new_data)
-                
-                    # Add accounts numbers to the processed set
-                    for item in new_data:
-                        account_number = item['account_number']
-                        if account_number not in processed_numbers:
-                            processed_numbers.add(account_number)
-                    #print(f"Processed numbers after update: {processed_numbers}")
-                    # Mise à jour des lignes restantes
-                    remaining_lines_bs = [line for line in lines_bs if line.split(',')[0].strip() not in processed_numbers]
-                    #print(f"the remaining lines inside loop are {remaining_lines_bs}")
-                df_bs = extract_from_list(extracted_data_bs, 'BS')
-            else:
-                df_bs = pd.DataFrame()
-            
-            if lines_pl:
-                extracted_data_pl = process_with_gpt_in_batches(base_prompt, lines_pl, model, 'P&L',max_tokens=16000)
-                processed_numbers = {item['account_number'] for item in extracted_data_pl}
-                #print(f"Processed numbers before update: {processed_numbers}")
-            # We determine the lines that have not been processed yet
-                remaining_lines_pl = [line for line in lines_pl if line.split(',')[0].strip() not in processed_numbers]
-                #print(f"the remaining lines before loop are {remaining_lines_pl}")
-                while remaining_lines_pl:
-                    time.sleep(2)
-                    # we process the remaining lines
-                    new_data = process_with_gpt_in_batches(base_prompt, remaining_lines_pl, model, 'P&L', max_tokens=16000)
-                    extracted_data_pl.extend(new_data)
-                
-                    # Add accounts numbers to the processed set
-                    for item in new_data:
-                        account_number = item['account_number']
-                        if account_number not in processed_numbers:
-                            processed_numbers.add(account_number)
-                    #print(f"Processed numbers after update: {processed_numbers}")
-                    # Mise à jour des lignes restantes
-                    remaining_lines_pl = [line for line in lines_pl if line.split(',')[0].strip() not in processed_numbers]
-                    #print(f"the remaining lines inside loop are {remaining_lines_pl}")
-                df_pl = extract_from_list(extracted_data_pl, 'P&L')
-            else:
-                df_pl = pd.DataFrame()
-            total_file = total_bs + total_pl
-                # Combine results and prepare for download
-            df = pd.concat([df_bs, df_pl], ignore_index=True)
-            df_size = len(df)
-            st.info(f"Successfully processed {df_size}/{total_file} accounts.")
-            df = remove_double_asterisks(df)
-            output = io.BytesIO()
-            df.to_excel(output, index=False, engine='xlsxwriter')
-            
-    
-            output.seek(0)
-            st.success("Tap to download your completed file.")
+    Returns:
+        The MappingJob of the file and its profiler.
+    """
+    profiler = RunProfiler(file_uploaded.name, deep=profile_deep) if profile_run else null_profiler
+    lines_by_type = read_accounts(file_uploaded, file_uploaded.name, profiler=profiler)
+    total_bs = len(lines_by_type['BS'])
+    total_pl = len(lines_by_type['P&L'])
+    if total_bs:
+        st.info(f"Found {total_bs} Balance Sheet accounts.")
+    else:
+        st.warning("No Balance Sheet accounts found.")
+    if total_pl:
+        st.info(f"Found {total_pl} Profit and Loss accounts.")
+    else:
+        st.warning("No Profit and Loss accounts found.")
+
+    # Resume the job if this exact file was already (partly) processed, then serve what the cache knows
+    job = MappingJob(
+        lines_by_type, file_bytes=file_uploaded.getvalue(), model=model, chart=chart_name, profiler=profiler
+    )
+    if job.count('resumed'):
+        st.info(f"Resuming job {job.job_id}: {job.count('resumed')} accounts already mapped.")
+    summary = job.preclassification_summary()
+    st.info(
+        f"Resolved locally: {summary['resolved']} accounts ({summary['hit_rate']:.0%}) — "
+        f"{summary['rule:exact']} exact name matches, {summary['rule:fuzzy']} near matches, "
+        f"{summary['rule:range']} account number rules, in {summary['seconds'] * 1000:.0f} ms."
+    )
+    st.info(f"Mapping cache: {job.count('cached')} hits, {job.count('pending') + job.duplicate_count()} misses.")
+    if job.duplicate_count():
+        st.info(
+            f"{job.count('pending') + job.duplicate_count()} accounts share {job.count('pending')} distinct labels: "
+            f"each label is sent to GPT once and its mapping is copied to the {job.duplicate_count()} duplicates."
+        )
+
+    # Only the accounts left to send to GPT are charged
+    estimate = job.estimate(max_tokens=16000)
+    st.info(
+        f"Estimated cost: ${estimate['total_cost']:.2f} "
+        f"({estimate['requests']} requests, {estimate['input_tokens']:,} input tokens "
+        f"of which {estimate['cached_input_tokens']:,} expected from the prompt cache, for ${estimate['input_cost']:.2f}, "
+        f"{estimate['output_tokens']:,} output tokens for ${estimate['output_cost']:.2f})"
+    )
+    # The capture of the calling thread is resumed by the job thread (see QueuedJob)
+    profiler.suspend()
+    return job, profiler
+
+def format_duration(seconds):
+    """Short human-readable duration (e.g. '3 min 20 s')."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes} min {seconds} s" if minutes else f"{seconds} s"
+
+def show_jobs(job_ids, polling):
+    """
+    Show the progress of the jobs followed by this session, then, for the finished ones,
+    the unresolved accounts, the download button and the run profile.
+    - polling: True when the view is refreshed periodically; a full rerun stops it once every job is finished.
+    """
+    queue = get_job_queue()
+    jobs = [queue.get(job_id) for job_id in job_ids]
+    jobs = [queued for queued in jobs if queued is not None]
+    counts = queue.counts()
+    if counts['queued']:
+        st.caption(f"{counts['running']} jobs running, {counts['queued']} waiting in the queue (all users).")
+    for queued in jobs:
+        progress = queued.progress()
+        st.markdown(f"**{progress['name']}** — Job ID: {progress['id']}")
+        status = {
+            "queued": "waiting for a worker",
+            "running": "running",
+            "done": f"finished in {format_duration(progress['elapsed_seconds'])}",
+            "failed": "failed",
+        }[progress['status']]
+        eta = f", about {format_duration(progress['eta_seconds'])} left" if progress['status'] == "running" and progress['eta_seconds'] is not None else ""
+        st.progress(
+            min(1.0, progress['done'] / progress['total']) if progress['total'] else 1.0,
+            text=(
+                f"{progress['done']}/{progress['total']} accounts mapped ({status}{eta}) — "
+                f"${progress['cost']:.2f} spent of ${progress['estimated_cost']:.2f} estimated"
+            )
+        )
+        if progress['status'] == "failed":
+            st.error(f"The job failed: {progress['error']}")
+        elif progress['status'] == "done":
+            show_finished_job(queued)
+
+    if polling and all(queued.finished() for queued in jobs):
+        # Every job is finished: rerun the whole page once to stop polling
+        st.rerun()
+
+def show_finished_job(queued):
+    """Results of a finished job: unresolved accounts, counts, download and run profile."""
+    if queued.unresolved:
+        st.warning(f"{len(queued.unresolved)} accounts could not be mapped after {max_attempts_per_account} attempts:")
+        st.dataframe(pd.DataFrame(
+            [split_line(line) for line in queued.unresolved],
+            columns=['n° de compte', 'Libelle', 'BS ou P&L']
+        ))
+    for acc_type in ('BS', 'P&L'):
+        st.write(f"Finished processing {queued.types.get(acc_type, 0)} {acc_type} accounts")
+    st.info(f"Successfully processed {queued.rows}/{queued.total} accounts.")
+    if queued.rows:
+        st.caption("Accounts per resolution path: " + ", ".join(
+            f"{source}: {count}" for source, count in queued.sources.items()
+        ))
+
+    output_format = os.path.splitext(queued.output_path)[1]
+    with open(queued.output_path, "rb") as output:
+        st.download_button(
+                label="Download processed file",
+                data=output,
+                file_name=f"transco_gpt_{os.path.splitext(queued.name)[0]}{output_format}",
+                mime=mime_types[output_format],
+                key=f"download_{queued.id}"
+            )
+
+    # Time spent in each stage of this run
+    report = queued.report
+    if report is not None:
+        with st.expander("Run profile"):
+            memory = f", peak memory {report['max_rss_mb']:.0f} MB" if report['max_rss_mb'] else ""
+            st.caption(
+                f"{report['wall_seconds']:.1f} s wall time{memory}. "
+                "Stages running in the parallel workers (API wait, JSON parsing) overlap."
+            )
+            st.dataframe(pd.DataFrame(report['stages']))
+            st.caption(", ".join(f"{name}: {value:,.0f}" for name, value in sorted(report['counters'].items())))
+            if 'cprofile' in report:
+                st.code(report['cprofile'])
+            if 'top_allocations' in report:
+                st.caption(f"Top allocations (traced peak {report['traced_peak_mb']:.0f} MB)")
+                st.dataframe(pd.DataFrame(report['top_allocations']))
             st.download_button(
-                    label="Download processed file",
-                    data=output,
-                    file_name="transco_gpt.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-            
-      
+                label="Download the profile (JSON)",
+                data=queued.profiler.to_json(),
+                file_name=f"profile_{queued.id}.json",
+                mime="application/json",
+                key=f"profile_{queued.id}"
+            )
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""
+Asynchronous "batch" execution mode through the OpenAI Batch API.
+
+The prompts built by the usual batching logic are written to a JSONL request file,
+submitted in one go, polled until the batch completes, and the answers are merged back
+with the same matching as the synchronous engine. The transport is pluggable:
+OpenAIBatchTransport talks to the Batch API, LocalBatchTransport is a file-based
+stand-in that answers the requests with a local function, to run the flow offline.
+"""
+import json
+import os
+import time
+import uuid
+
+import transco
+
+# Batch statuses after which polling stops
+terminal_statuses = {"completed", "failed", "expired", "cancelled"}
+
+
+class OpenAIBatchTransport:
+    """
+    Transport submitting the request file to the OpenAI Batch API (files + batches endpoints).
+    - api_key: OpenAI API key.
+    - base_url: API root URL.
+    - completion_window: Time window accepted by the Batch API.
+    """
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", completion_window="24h", timeout=120):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.completion_window = completion_window
+        self.timeout = timeout
+
+    def _request(self, method, path, **kwargs):
+        import requests
+
+        response = requests.request(
+            method,
+            f"{self.base_url}{path}",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=self.timeout,
+            **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def submit(self, requests_path):
+        """Upload the request file and create the batch. Returns the batch ID."""
+        with open(requests_path, "rb") as f:
+            uploaded = self._request(
+                "POST", "/files",
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(requests_path), f, "application/jsonl")}
+            ).json()
+        try:
+            batch = self._request(
+                "POST", "/batches",
+                json={
+                    "input_file_id": uploaded["id"],
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": self.completion_window
+                }
+            ).json()
+        except Exception:
+            self._delete_file(uploaded["id"])
+            raise
+        return batch["id"]
+
+    def poll(self, batch_id):
+        """Return the batch status and its request counts."""
+        batch = self._request("GET", f"/batches/{batch_id}").json()
+        counts = batch.get("request_counts") or {}
+        return {
+            "status": batch["status"],
+            "completed": counts.get("completed", 0) + counts.get("failed", 0),
+            "total": counts.get("total", 0),
+            "output_file_id": batch.get("output_file_id")
+        }
+
+    def results(self, batch_id):
+        """Yield the output records of a completed batch."""
+        output_file_id = self.poll(batch_id)["output_file_id"]
+        if not output_file_id:
+            return
+        content = self._request("GET", f"/files/{output_file_id}/content").text
+        for line in content.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+    def _delete_file(self, file_id):
+        try:
+            self._request("DELETE", f"/files/{file_id}")
+        except Exception as e:
+            print(f"Error deleting the file {file_id}: {e}")
+
+    def cleanup(self, batch_id):
+        """Delete the input, output and error files of a finished batch, stored (and billed) until then."""
+        try:
+            batch = self._request("GET", f"/batches/{batch_id}").json()
+        except Exception as e:
+            print(f"Error reading batch {batch_id} before deleting its files: {e}")
+            return
+        for key in ("input_file_id", "output_file_id", "error_file_id"):
+            if batch.get(key):
+                self._delete_file(batch[key])
+
+
+class LocalBatchTransport:
+    """
+    File-based stand-in for the Batch API, used to run the whole batch flow offline.
+    Requests are answered synchronously on submit by `responder(body) -> chat completion dict`,
+    and the output is written next to the request file in the Batch API output format.
+    - directory: Folder receiving the output files.
+    - responder: Function answering one chat completion request body.
+    """
+    def __init__(self, directory, responder):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.responder = responder
+
+    def _output_path(self, batch_id):
+        return os.path.join(self.directory, f"{batch_id}_output.jsonl")
+
+    def submit(self, requests_path):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        with open(requests_path, encoding="utf-8") as requests_file, \
+                open(self._output_path(batch_id), "w", encoding="utf-8") as output_file:
+            for line in requests_file:
+                request = json.loads(line)
+                record = {"id": f"req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None, "error": None}
+                try:
+                    record["response"] = {"status_code": 200, "body": self.responder(request["body"])}
+                except Exception as e:
+                    record["error"] = {"code": type(e).__name__, "message": str(e)}
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def poll(self, batch_id):
+        with open(self._output_path(batch_id), encoding="utf-8") as f:
+            total = sum(1 for _ in f)
+        return {"status": "completed", "completed": total, "total": total, "output_file_id": batch_id}
+
+    def results(self, batch_id):
+        with open(self._output_path(batch_id), encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def cleanup(self, batch_id):
+        if os.path.exists(self._output_path(batch_id)):
+            os.remove(self._output_path(batch_id))
+
+
+def write_batch_requests(path, base_prompt, lines_by_type, model, max_tokens=16000, chart=None):
+    """
+    Write one Batch API request per planned batch to a JSONL file.
+    - chart: Chart or chart name the accounts are mapped to (default chart when None).
+
+    Returns:
+        A dict {custom_id: (type, batch lines)} used to match the answers back.
+    """
+    batches = {}
+    with open(path, "w", encoding="utf-8") as f:
+        for type_compte, lines in lines_by_type.items():
+            if not lines:
+                continue
+            for batch_lines, _ in transco.plan_batches(base_prompt, lines, model, type_compte, max_tokens, chart=chart):
+                custom_id = f"{type_compte}-{len(batches)}"
+                batches[custom_id] = (type_compte, batch_lines)
+                request = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "messages": [
+                            {"role": "system", "content": transco.system_prompt},
+                            {"role": "user", "content": transco.build_prompt(base_prompt, batch_lines, type_compte, chart)}
+                        ],
+                        "response_format": transco.response_format,
+                        "temperature": 0.5,
+                        "max_tokens": max_tokens
+                    }
+                }
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return batches
+
+
+def map_accounts_with_batch_api(base_prompt, lines_by_type, model, transport, max_tokens=16000, max_attempts=None,
+                                on_batch_done=None, poll_interval=30, work_dir=None, on_status=None, chart=None):
+    """
+    Batch API counterpart of transco.map_accounts(), with the same arguments and return values.
+    - transport: OpenAIBatchTransport, LocalBatchTransport or any object with submit/poll/results/cleanup.
+    - poll_interval: Seconds between two status checks.
+    - work_dir: Folder receiving the request files (defaults to the journal folder).
+    - on_status: Optional callback(status dict) called at every poll.
+
+    Accounts a batch omitted or failed are sent again in a new Batch API submission,
+    up to `max_attempts` submissions. An expired or cancelled batch counts as a submission:
+    the answers it completed are kept and the rest is sent again. A failed batch raises.
+    """
+    max_attempts = max_attempts or transco.max_attempts_per_account
+    chart = transco.get_chart(chart)
+    work_dir = work_dir or transco.journal_dir
+    os.makedirs(work_dir, exist_ok=True)
+    extracted_data = {type_compte: [] for type_compte in lines_by_type}
+    pending = {type_compte: list(lines) for type_compte, lines in lines_by_type.items()}
+
+    for _ in range(max_attempts):
+        if not any(pending.values()):
+            break
+        requests_path = os.path.join(work_dir, f"batch_requests_{uuid.uuid4().hex}.jsonl")
+        batch_id = None
+        status = None
+        try:
+            batches = write_batch_requests(requests_path, base_prompt, pending, model, max_tokens, chart)
+            if not batches:
+                break
+            batch_id = transport.submit(requests_path)
+            status = transport.poll(batch_id)
+            while status["status"] not in terminal_statuses:
+                if on_status is not None:
+                    on_status(status)
+                time.sleep(poll_interval)
+                status = transport.poll(batch_id)
+            if on_status is not None:
+                on_status(status)
+            if status["status"] == "failed":
+                raise RuntimeError(f"Batch {batch_id} ended with status 'failed'")
+            if status["status"] != "completed":
+                # An expired or cancelled batch still returns (and bills) the requests it completed
+                print(
+                    f"Batch {batch_id} ended with status '{status['status']}' after {status['completed']}/{status['total']} "
+                    f"requests, resubmitting the others"
+                )
+
+            # Every line is pending again until an answer resolves it
+            pending = {type_compte: [] for type_compte in lines_by_type}
+            answered = set()
+            for record in transport.results(batch_id):
+                if record.get("custom_id") not in batches:
+                    continue
+                answered.add(record["custom_id"])
+                type_compte, batch_lines = batches[record["custom_id"]]
+                answers = []
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    try:
+                        answers = transco.parse_answer(response["body"]["choices"][0]["message"]["content"])
+                    except (KeyError, IndexError, TypeError, ValueError) as e:
+                        print(f"Invalid answer for {record['custom_id']}: {e}")
+                else:
+                    print(f"Error for {record['custom_id']}: {record.get('error')}")
+                resolved, missing = transco.match_answers(batch_lines, answers)
+                # Answers naming an account outside the COA of the type are submitted again
+                resolved, invalid = transco.validate_answers(resolved, type_compte, chart)
+                resolved_items = [item for _, item in resolved]
+                extracted_data[type_compte].extend(resolved_items)
+                if on_batch_done is not None and resolved:
+                    on_batch_done(type_compte, [batch_lines[index] for index, _ in resolved], resolved_items)
+                pending[type_compte].extend(batch_lines[index] for index in sorted(missing + [index for index, _, _ in invalid]))
+            # Requests absent from the output (failed, or not run before the batch expired) are retried as a whole
+            for custom_id, (type_compte, batch_lines) in batches.items():
+                if custom_id not in answered:
+                    pending[type_compte].extend(batch_lines)
+        finally:
+            if os.path.exists(requests_path):
+                os.remove(requests_path)
+            # The files of a batch still running are left to it
+            if batch_id is not None and status is not None and status["status"] in terminal_statuses:
+                transport.cleanup(batch_id)
+
+    return extracted_data, pending
@@ -0,0 +1,186 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+def wilson_lower_bound(successes, trials, z=2.0):
+    """Lower bound of the Wilson score interval of a proportion (0 without trials)."""
+    if not trials:
+        return 0.0
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    centre = rate + z * z / (2 * trials)
+    margin = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials))
+    return max(0.0, (centre - margin) / denominator)
+
+
+def clearly_above(missing, accounts, other_missing, other_accounts, z=2.0):
+    """True when the omission rate missing/accounts is significantly above the other one (two-proportion z-test)."""
+    if not accounts or not other_accounts:
+        return False
+    pooled = (missing + other_missing) / (accounts + other_accounts)
+    if pooled in (0.0, 1.0):
+        return False
+    error = math.sqrt(pooled * (1 - pooled) * (1 / accounts + 1 / other_accounts))
+    return (missing / accounts - other_missing / other_accounts) / error > z
+
+
+class BatchSizeController:
+    """
+    Adaptive number of accounts per GPT request, tuned from the batches actually sent.
+    Observations are grouped in windows of at least `window` batches and `min_window_accounts`
+    accounts. After each window:
+    - if the model returned too many invalid or truncated answers (failure rate), the size is
+      halved and remembered as a ceiling;
+    - if the model dropped significantly more accounts than allowed (lower confidence bound of the
+      omission rate above `max_omission_rate`), the size is halved the same way, but only when the
+      omissions depend on the batch size: the rate at this size must be clearly above the rate
+      seen at smaller sizes or, without them, clearly below the rate seen at larger sizes. A model
+      dropping the same share of accounts at any size is left alone (smaller batches would only
+      add requests and repeated prompt tokens);
+    - otherwise the size keeps moving in the same direction (hill climbing) while the throughput,
+      accounts resolved per second of request latency, improves, and turns back when it drops.
+    Growth also stays within the completion budget, using the output tokens observed per account.
+    - initial_size: Starting batch size.
+    - min_size / max_size: Bounds of the batch size.
+    - window: Number of batches per decision.
+    - min_window_accounts: Number of accounts per decision, so that a rate is measured on enough accounts.
+    - max_omission_rate: Share of accounts missing from the answers above which the size shrinks.
+    - max_failure_rate: Share of invalid or truncated answers above which the size shrinks.
+    - step: Relative change of the size at each growth or decrease decision.
+    - tolerance: Relative throughput drop considered as noise.
+    - max_output_tokens: Completion tokens available per request.
+    - on_decision: Optional callback(decision dict) called after each window.
+    """
+    def __init__(self, initial_size, min_size=5, max_size=100, window=4, max_omission_rate=0.02, max_failure_rate=0.1,
+                 step=0.25, tolerance=0.05, max_output_tokens=16000, on_decision=None, min_window_accounts=200):
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.size = min(self.max_size, max(min_size, initial_size))
+        self.window = window
+        self.min_window_accounts = min_window_accounts
+        self.max_omission_rate = max_omission_rate
+        self.max_failure_rate = max_failure_rate
+        self.step = step
+        self.tolerance = tolerance
+        self.max_output_tokens = max_output_tokens
+        self.on_decision = on_decision
+        self.lock = threading.Lock()
+        self.observations = []
+        self.previous_throughput = None
+        self.direction = 1
+        # Smallest size that lost accounts; probed again after `window` healthy windows
+        self.ceiling = None
+        self.healthy_windows = 0
+        self.tokens_per_account = None
+        self.decisions = deque(maxlen=100)
+        # size -> [accounts, missing] observed at that size, decayed at each decision so old sizes fade out
+        self.omissions_by_size = {}
+
+    def observe(self, accounts, missing, duration, completion_tokens=0, failed=False):
+        """
+        Record one completed batch.
+        - accounts: Number of accounts sent.
+        - missing: Number of accounts missing from the answer (all of them for a failed batch).
+        - duration: Seconds spent in the request, retries included.
+        - completion_tokens: Output tokens of the answer.
+        - failed: True when the answer was not valid JSON or was truncated.
+
+        Returns:
+            The decision dict when the observation closed a window, else None.
+        """
+        with self.lock:
+            self.observations.append((accounts, missing, duration, completion_tokens, failed))
+            if (len(self.observations) < self.window
+                    or sum(observation[0] for observation in self.observations) < self.min_window_accounts):
+                return None
+            decision = self._decide()
+            self.observations = []
+            self.decisions.append(decision)
+        if self.on_decision is not None:
+            self.on_decision(decision)
+        return decision
+
+    def _omissions_grow_with_size(self, size):
+        """
+        Whether the omissions observed at `size` are explained by the batch size: clearly above
+        the rate at smaller sizes when there are some, otherwise clearly below the rate at larger
+        sizes (shrinking helped) when there are some. Without any other size yet, a first
+        shrink is tried to find out (except at the minimum size, where there is nothing to try).
+        """
+        evidence = self.min_window_accounts / 2
+        accounts, missing = self.omissions_by_size[size]
+        smaller = [counts for other, counts in self.omissions_by_size.items() if other < size]
+        larger = [counts for other, counts in self.omissions_by_size.items() if other > size]
+        smaller_accounts = sum(counts[0] for counts in smaller)
+        larger_accounts = sum(counts[0] for counts in larger)
+        if smaller_accounts >= evidence:
+            return clearly_above(missing, accounts, sum(counts[1] for counts in smaller), smaller_accounts)
+        if larger_accounts >= evidence:
+            return clearly_above(sum(counts[1] for counts in larger), larger_accounts, missing, accounts)
+        return size > self.min_size
+
+    def _decide(self):
+        accounts = sum(observation[0] for observation in self.observations)
+        missing = sum(observation[1] for observation in self.observations)
+        seconds = sum(observation[2] for observation in self.observations)
+        completion_tokens = sum(observation[3] for observation in self.observations)
+        failures = sum(1 for observation in self.observations if observation[4])
+        resolved = accounts - missing
+        omission_rate = missing / accounts if accounts else 0.0
+        failure_rate = failures / len(self.observations)
+        throughput = resolved / seconds if seconds > 0 else 0.0
+        if resolved and completion_tokens:
+            observed = completion_tokens / resolved
+            self.tokens_per_account = observed if self.tokens_per_account is None else 0.7 * self.tokens_per_account + 0.3 * observed
+
+        previous_size = self.size
+        for counts in self.omissions_by_size.values():
+            counts[0] *= 0.95
+            counts[1] *= 0.95
+        counts = self.omissions_by_size.setdefault(previous_size, [0.0, 0.0])
+        counts[0] += accounts
+        counts[1] += missing
+        too_many_omissions = wilson_lower_bound(missing, accounts) > self.max_omission_rate
+        size_related = too_many_omissions and self._omissions_grow_with_size(previous_size)
+
+        if failure_rate > self.max_failure_rate or size_related:
+            reason = "failures" if failure_rate > self.max_failure_rate else "omissions"
+            self.ceiling = previous_size if self.ceiling is None else min(self.ceiling, previous_size)
+            self.healthy_windows = 0
+            self.direction = 1
+            self.previous_throughput = None
+            size = previous_size // 2
+        else:
+            self.healthy_windows += 1
+            if self.ceiling is not None and (self.healthy_windows >= self.window or too_many_omissions):
+                # Omissions that do not depend on the size no longer hold the size down
+                self.ceiling = None
+            if self.previous_throughput is not None and throughput < self.previous_throughput * (1 - self.tolerance):
+                self.direction = -self.direction
+                reason = "slower"
+            elif too_many_omissions:
+                reason = "omissions not size-related"
+            else:
+                reason = "faster" if self.previous_throughput is not None else "first window"
+            self.previous_throughput = throughput
+            size = previous_size + self.direction * max(1, round(previous_size * self.step))
+
+        if self.ceiling is not None:
+            size = min(size, self.ceiling - 1)
+        if self.tokens_per_account:
+            # Keep a margin so the JSON answer is never cut by max_tokens
+            size = min(size, int(0.8 * self.max_output_tokens / self.tokens_per_account))
+        self.size = min(self.max_size, max(self.min_size, size))
+        return {
+            "time": time.time(),
+            "previous_size": previous_size,
+            "size": self.size,
+            "reason": reason,
+            "batches": len(self.observations),
+            "throughput": throughput,
+            "omission_rate": omission_rate,
+            "failure_rate": failure_rate,
+            "tokens_per_account": self.tokens_per_account,
+        }
@@ -0,0 +1,210 @@
+"""
+Local stand-in for the OpenAI chat-completions endpoint, used by the offline benchmarks.
+
+The server answers every account line of the prompt with a schema-valid
+`account_matching_response` payload, picking a COA account among those listed in the prompt.
+Latency, rate-limit (429) errors and accounts silently dropped by the "model" are simulated
+so the retry and re-queue paths of the engine are exercised too. Like the real API, prompts
+starting with an already seen prefix of at least 1024 tokens report it in
+`usage.prompt_tokens_details.cached_tokens`.
+
+Usage:
+    server = MockOpenAIServer(latency=0.2, rate_limit_rate=0.02, drop_rate=0.01).start()
+    openai.api_base = server.url
+    ...
+    server.stop()
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+account_line_pattern = re.compile(r"^(.+?),(.*),(BS|P&L)$")
+# Start of the COA section, followed by the name of the chart
+coa_marker = "Existing accounts in "
+
+
+def approximate_tokens(text):
+    """Rough token count (4 characters per token) used when no tokenizer is given."""
+    return max(1, len(text) // 4)
+
+
+def parse_prompt(prompt):
+    """
+    Split a prompt built by transco.build_prompt() (either layout) into its account lines and COA accounts.
+
+    Returns:
+        accounts: List of (number, label, type) tuples.
+        coa: List of (GL account, account name) tuples listed in the prompt.
+    """
+    _, _, tail = prompt.partition(coa_marker)
+    accounts = []
+    for line in prompt.splitlines():
+        match = account_line_pattern.match(line.strip())
+        if match:
+            accounts.append(match.groups())
+    coa = []
+    for line in tail.splitlines():
+        parts = line.split(" - ")
+        if len(parts) >= 3 and not account_line_pattern.match(line.strip()):
+            coa.append((parts[0].strip(), " - ".join(parts[1:-1]).strip()))
+    return accounts, coa
+
+
+def static_prefix(prompt):
+    """Part of the prompt before its first account line (the whole cacheable prefix in the 'prefix_cache' layout)."""
+    position = 0
+    for line in prompt.splitlines(keepends=True):
+        if account_line_pattern.match(line.strip()):
+            break
+        position += len(line)
+    return prompt[:position]
+
+
+class MockOpenAIServer:
+    """
+    Threaded HTTP server mimicking POST /v1/chat/completions.
+    - latency: Fixed part of the simulated response time, in seconds.
+    - latency_per_account: Additional seconds per account line of the prompt.
+    - jitter: Relative random variation of the latency (0.2 = +/- 20%).
+    - rate_limit_rate: Probability of answering with a 429 rate-limit error.
+    - drop_rate: Probability of leaving out each account from the answer.
+    - count_tokens: Function counting the tokens of a text, for the `usage` block.
+    - seed: Seed of the random generator, for reproducible runs.
+    """
+    def __init__(self, latency=0.2, latency_per_account=0.005, jitter=0.2, rate_limit_rate=0.0, drop_rate=0.0,
+                 count_tokens=approximate_tokens, seed=0):
+        self.latency = latency
+        self.latency_per_account = latency_per_account
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.drop_rate = drop_rate
+        self.count_tokens = count_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.seen_prefixes = {}  # prefix -> tokens
+        self.httpd = None
+        self.thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the request and token counters."""
+        with self.lock:
+            self.stats = {"requests": 0, "rate_limited": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+                          "dropped_accounts": 0}
+
+    def _draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def _count(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    @property
+    def url(self):
+        """API base URL to give to the openai client."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def complete(self, body):
+        """Build the chat completion answering one request body (also usable without HTTP)."""
+        prompt = body["messages"][-1]["content"]
+        accounts, coa = parse_prompt(prompt)
+        answers = []
+        for number, label, _ in accounts:
+            if self._draw() < self.drop_rate:
+                self._count(dropped_accounts=1)
+                continue
+            gl_account, name = coa[int(self._draw() * len(coa))] if coa else ("000000", "Unknown")
+            answers.append({
+                "account_number": number,
+                "label": label,
+                "coa_account": gl_account,
+                "coa_label": f"**{name}**",
+                "justification": f"The label '{label}' matches the nature of the COA account {gl_account}."
+            })
+        content = json.dumps({"final_answer": answers}, ensure_ascii=False)
+        # Prompt cache: the messages before the user prompt plus its static prefix, by 128-token blocks
+        prompt_prefix = static_prefix(prompt)
+        prefix = json.dumps(body["messages"][:-1]) + prompt_prefix
+        with self.lock:
+            prefix_tokens = self.seen_prefixes.get(prefix)
+        cached_tokens = 0
+        if prefix_tokens is None:
+            prefix_tokens = sum(self.count_tokens(message["content"]) for message in body["messages"][:-1])
+            prefix_tokens += self.count_tokens(prompt_prefix)
+            with self.lock:
+                self.seen_prefixes[prefix] = prefix_tokens
+        elif prefix_tokens >= 1024:
+            cached_tokens = prefix_tokens - prefix_tokens % 128
+        prompt_tokens = prefix_tokens + self.count_tokens(prompt[len(prompt_prefix):])
+        completion_tokens = self.count_tokens(content)
+        self._count(input_tokens=prompt_tokens, cached_tokens=cached_tokens, output_tokens=completion_tokens)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                server._count(requests=1)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                    return
+                if server._draw() < server.rate_limit_rate:
+                    server._count(rate_limited=1)
+                    self._send(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                               "code": "rate_limit_exceeded"}}, {"Retry-After": "1"})
+                    return
+                accounts = sum(1 for line in body["messages"][-1]["content"].splitlines()
+                               if account_line_pattern.match(line.strip()))
+                delay = server.latency + server.latency_per_account * accounts
+                time.sleep(max(0.0, delay * (1 + server.jitter * (2 * server._draw() - 1))))
+                self._send(200, server.complete(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """Start serving in a background thread (port 0 picks a free port)."""
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
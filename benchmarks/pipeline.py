@@ -0,0 +1,163 @@
+"""
+End-to-end benchmark of the mapping pipeline against a local mock of the OpenAI API.
+
+For synthetic accounts files of increasing size, runs the real code path of the app
+(Excel reading, cost estimation, batching, concurrent GPT calls with retries, answer parsing,
+streamed Excel export) with the chat-completions endpoint served by benchmarks/mock_openai.py, and reports:
+- accounts/sec over the whole pipeline;
+- requests sent (including rate-limited ones), input/cached/output tokens and tokens per account,
+  next to the estimated input tokens and cost;
+- peak Python memory;
+- p50/p95 latency of one batch (including its backoff retries);
+- the adaptive batch size reached at the end of each run (it carries over to the next size).
+
+Nothing is sent to OpenAI and the mapping cache and job journal are disabled.
+
+Usage (from the repository root):
+    python -m benchmarks.pipeline --sizes 100,1000,10000,50000 --latency 0.2 --rate-limit-rate 0.02
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+import transco
+from benchmarks.mock_openai import MockOpenAIServer
+from export import ResultWriter
+from scheduler import BatchScheduler, RateLimiter
+from telemetry import percentile
+
+# Vocabulary of the synthetic foreign account labels
+bs_words = ["Cash", "Bank", "Accounts receivable", "Accounts payable", "Inventory", "Prepaid expenses",
+            "Accrued liabilities", "Fixed assets", "Accumulated depreciation", "Loan", "Deferred revenue",
+            "Retained earnings", "Share capital", "VAT receivable", "Payroll liabilities", "Intercompany"]
+pl_words = ["Sales", "Revenue", "Cost of goods sold", "Rent expense", "Salaries", "Social charges",
+            "Travel expenses", "Bank fees", "Interest income", "Depreciation expense", "Consulting fees",
+            "Insurance", "Utilities", "Marketing", "Income tax", "Foreign exchange loss"]
+qualifiers = ["", "USD", "EUR", "- Europe", "- US", "short term", "long term", "third parties", "related parties", "misc"]
+
+
+def synthetic_accounts(size, seed=0):
+    """DataFrame of `size` distinct foreign accounts (number, label, BS/P&L), about 60% BS."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(size):
+        acc_type = "BS" if rng.random() < 0.6 else "P&L"
+        words = bs_words if acc_type == "BS" else pl_words
+        label = " ".join(part for part in (rng.choice(words), rng.choice(qualifiers), str(rng.randint(1, 99))) if part)
+        number = (1 if acc_type == "BS" else 6) * 10 ** 7 + i
+        rows.append((str(number), label, acc_type))
+    return pd.DataFrame(rows, columns=["Account number", "Label", "BS or P&L"])
+
+
+def run_size(path, size, server, concurrency, rpm, tpm):
+    """Run the whole pipeline on one accounts file and return its measures."""
+    latencies = []
+    latencies_lock = threading.Lock()
+    call_gpt_batch = transco.call_gpt_batch
+
+    def timed_call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return call_gpt_batch(*args, **kwargs)
+        finally:
+            with latencies_lock:
+                latencies.append(time.perf_counter() - start)
+
+    server.reset_stats()
+    scheduler = BatchScheduler(concurrency, RateLimiter(rpm, tpm))
+    transco.call_gpt_batch = timed_call
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        lines_by_type = transco.read_accounts(path)
+        job = transco.MappingJob(lines_by_type, model=transco.model)
+        estimate = job.estimate()
+        with ResultWriter(os.path.splitext(path)[0] + "_transco.xlsx") as writer:
+            _, unresolved = job.run(scheduler=scheduler, writer=writer)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        transco.call_gpt_batch = call_gpt_batch
+        scheduler.shutdown()
+
+    latencies.sort()
+    stats = server.stats
+    return {
+        "lines": size,
+        "mapped": writer.rows,
+        "unresolved": sum(len(lines) for lines in unresolved.values()),
+        "seconds": elapsed,
+        "accounts/sec": size / elapsed,
+        "requests": stats["requests"],
+        "rate limited": stats["rate_limited"],
+        "input tokens": stats["input_tokens"],
+        "cached tokens": stats["cached_tokens"],
+        "estimated input": estimate["input_tokens"],
+        "estimated cost": estimate["total_cost"],
+        "output tokens": stats["output_tokens"],
+        "tokens/account": (stats["input_tokens"] + stats["output_tokens"]) / size,
+        "peak MB": peak / 2 ** 20,
+        "p50 batch s": percentile(latencies, 0.5),
+        "p95 batch s": percentile(latencies, 0.95),
+        "batch size BS/P&L": f"{transco.batch_size_for(transco.model, 'BS')}/{transco.batch_size_for(transco.model, 'P&L')}",
+    }
+
+
+def run(sizes, latency, latency_per_account, rate_limit_rate, drop_rate, concurrency, rpm, tpm, seed,
+        prompt_layout=None):
+    transco.cache_enabled = False
+    transco.prompt_layout = prompt_layout or transco.prompt_layout
+    transco.telemetry_sink = "none"
+    encoding = transco.get_encoding(transco.model)
+    server = MockOpenAIServer(
+        latency=latency, latency_per_account=latency_per_account, rate_limit_rate=rate_limit_rate,
+        drop_rate=drop_rate, count_tokens=lambda text: len(encoding.encode(text)), seed=seed
+    ).start()
+    openai = transco.get_openai()
+    previous_base, previous_key = openai.api_base, openai.api_key
+    openai.api_base, openai.api_key = server.url, "sk-mock"
+    report = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in sizes:
+                path = os.path.join(directory, f"accounts_{size}.xlsx")
+                synthetic_accounts(size, seed).to_excel(path, index=False)
+                report.append(run_size(path, size, server, concurrency, rpm, tpm))
+    finally:
+        openai.api_base, openai.api_key = previous_base, previous_key
+        server.stop()
+    return pd.DataFrame(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of the mapping pipeline.")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="Comma separated numbers of account lines.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fixed response time of the mock API, in seconds.")
+    parser.add_argument("--latency-per-account", type=float, default=0.005, help="Additional seconds per account of a batch.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="Share of requests answered with a 429.")
+    parser.add_argument("--drop-rate", type=float, default=0.01, help="Share of accounts left out of the answers.")
+    parser.add_argument("--concurrency", type=int, default=transco.max_concurrent_requests, help="Requests kept in flight.")
+    parser.add_argument("--rpm", type=int, default=100000, help="Requests per minute budget.")
+    parser.add_argument("--tpm", type=int, default=100000000, help="Tokens per minute budget.")
+    parser.add_argument("--prompt-layout", choices=["retrieval", "prefix_cache"], default=transco.prompt_layout,
+                        help="Prompt layout of the engine (see TRANSCO_PROMPT_LAYOUT).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and of the mock API.")
+    parser.add_argument("--output", help="Optional CSV file receiving the report.")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    report = run(sizes, args.latency, args.latency_per_account, args.rate_limit_rate, args.drop_rate,
+                 args.concurrency, args.rpm, args.tpm, args.seed, args.prompt_layout)
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
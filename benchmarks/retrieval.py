@@ -0,0 +1,103 @@
+"""
+Benchmark of the local COA retrieval stage.
+
+Reports, for a labelled sample of foreign accounts:
+- recall@k: how often the expected COA account is among the candidates sent to GPT,
+  both per line (top k of the line alone) and per batch (what the prompt actually contains);
+- the token reduction of the COA section compared with sending the whole chart.
+
+The defaults are those of the engine (TRANSCO_RETRIEVAL_K, TRANSCO_RETRIEVAL_MAX_CANDIDATES and
+TRANSCO_MAX_ACCOUNTS_PER_BATCH), so the report describes what the engine actually sends.
+With k = 0 (retrieval off, the default) every prompt lists the whole COA.
+
+Usage (from the repository root):
+    python -m benchmarks.retrieval --k 15 --max-candidates 80
+"""
+import argparse
+import os
+
+import pandas as pd
+import tiktoken
+
+from retrieval import CoaIndex
+from transco import max_accounts_per_batch, retrieval_k_per_line, retrieval_max_candidates
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_coa_path = os.path.join(base_dir, 'data', 'COA_simplifié_TC2.xlsx')
+default_sample_path = os.path.join(base_dir, 'benchmarks', 'retrieval_sample.csv')
+
+
+def load_coa(path):
+    coa = pd.read_excel(path)
+    coa['BS / P&L'] = coa['BS / P&L'].astype(str).str.lower().str[0].map({'b': 'BS', 'p': 'P&L'})
+    return coa
+
+
+def coa_lines(coa):
+    return (coa['GL account'].astype(str) + " - " + coa['Account Name'].astype(str) + " - " + coa['BS / P&L']).tolist()
+
+
+def run(coa_path, sample_path, k, max_candidates, batch_size, encoding_name):
+    encoding = tiktoken.get_encoding(encoding_name)
+    coa = load_coa(coa_path)
+    sample = pd.read_csv(sample_path, dtype=str)
+
+    report = []
+    for acc_type in ('BS', 'P&L'):
+        chart = coa[coa['BS / P&L'] == acc_type].reset_index(drop=True)
+        lines = coa_lines(chart)
+        accounts = chart['GL account'].astype(str).tolist()
+        index = CoaIndex(chart['Account Name'].astype(str).tolist())
+        full_tokens = len(encoding.encode("\n".join(lines)))
+
+        rows = sample[sample['BS / P&L'] == acc_type]
+        labels = rows['Label'].tolist()
+        expected = rows['GL account'].tolist()
+
+        # k = 0 sends the whole COA, as the engine does
+        line_hits = sum(
+            target in {accounts[row] for row in (index.top_k(label, k) if k > 0 else range(len(accounts)))}
+            for label, target in zip(labels, expected)
+        )
+        batch_hits = 0
+        retrieved_tokens = 0
+        batches = 0
+        for start in range(0, len(labels), batch_size):
+            batch_labels = labels[start:start + batch_size]
+            if k > 0:
+                selected = index.select_for_batch(batch_labels, k, max_candidates)
+            else:
+                selected = range(len(lines))
+            selected_accounts = {accounts[row] for row in selected}
+            batch_hits += sum(target in selected_accounts for target in expected[start:start + batch_size])
+            retrieved_tokens += len(encoding.encode("\n".join(lines[row] for row in selected)))
+            batches += 1
+
+        report.append({
+            'type': acc_type,
+            'sample lines': len(labels),
+            'COA accounts': len(lines),
+            f'line recall@{k}': line_hits / len(labels) if labels else float('nan'),
+            'batch recall': batch_hits / len(labels) if labels else float('nan'),
+            'COA tokens (full)': full_tokens * batches,
+            'COA tokens (retrieved)': retrieved_tokens,
+            'token reduction': 1 - retrieved_tokens / (full_tokens * batches) if batches else float('nan'),
+        })
+    return pd.DataFrame(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and token reduction of the COA retrieval stage.")
+    parser.add_argument("--coa", default=default_coa_path, help="COA Excel file.")
+    parser.add_argument("--sample", default=default_sample_path, help="Labelled CSV sample (Label, BS / P&L, GL account).")
+    parser.add_argument("--k", type=int, default=retrieval_k_per_line, help="Candidates kept per line (0: whole COA).")
+    parser.add_argument("--max-candidates", type=int, default=retrieval_max_candidates, help="Candidates kept per batch.")
+    parser.add_argument("--batch-size", type=int, default=max_accounts_per_batch, help="Lines per GPT batch.")
+    parser.add_argument("--encoding", default="o200k_base", help="tiktoken encoding used to count tokens.")
+    args = parser.parse_args()
+    report = run(args.coa, args.sample, args.k, args.max_candidates, args.batch_size, args.encoding)
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalize_label(label):
+    """
+    Normalize an account label for cache lookups: lowercase, strip and collapse whitespace.
+    """
+    if not isinstance(label, str):
+        label = str(label)
+    return re.sub(r"\s+", " ", label.strip().lower())
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MappingCache:
+    """
+    Persistent SQLite cache of GPT mappings.
+    Entries are keyed on (normalized label, BS/P&L type, model, COA file hash) so a change
+    of model or of chart of accounts never serves stale answers.
+    - path: Location of the SQLite database file.
+    - ttl_seconds: Entries older than this are ignored and purged.
+    - max_entries: When exceeded, the least recently used entries are evicted.
+    """
+    def __init__(self, path, ttl_seconds=30 * 24 * 3600, max_entries=100000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS mappings ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS mappings_last_used ON mappings (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(label, acc_type, model, coa_hash):
+        raw = "\x1f".join([normalize_label(label), acc_type, model, coa_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once.
+        Returns a dict {key: cached value} containing only the fresh hits.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, value FROM mappings WHERE key IN ({placeholders}) AND created_at >= ?",
+                    chunk + [now - self.ttl_seconds]
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+            if found:
+                self.connection.executemany(
+                    "UPDATE mappings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.connection.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Store several (key, value) pairs and apply TTL/size eviction.
+        """
+        now = time.time()
+        rows = [(key, json.dumps(value, ensure_ascii=False), now, now) for key, value in items]
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO mappings (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._evict(now)
+            self.connection.commit()
+
+    def _evict(self, now):
+        self.connection.execute("DELETE FROM mappings WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self.connection.execute("SELECT COUNT(*) FROM mappings").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM mappings WHERE key IN (SELECT key FROM mappings ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM mappings")
+            self.connection.commit()
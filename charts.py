@@ -0,0 +1,141 @@
+"""
+Registry of the charts of accounts (COA) the accounts can be mapped to.
+
+Each chart source (an Excel file: PCG, IFRS, a client chart...) is compiled once into a
+binary artifact holding everything the engine derives from it: prompt lines, COA line
+token counts, retrieval index, normalized-name index (pre-classifier) and content hash.
+Artifacts are pickled on disk under a key covering the content of the source and of the
+files it depends on, so a new process loads them instead of re-reading Excel, and a chart
+is compiled again as soon as its source file changes.
+"""
+import hashlib
+import os
+import pickle
+import threading
+
+from cache import file_hash
+
+# Bump when the content of a compiled Chart changes, so existing artifacts are rebuilt
+artifact_version = 3
+
+
+class Chart:
+    """
+    A chart of accounts ready to be used in prompts.
+    - lines: Dict {type: [prompt strings "GL account - Account Name - type"]}.
+    - indexes: Dict {type: CoaIndex over the account names, same row order as `lines`}.
+    - hash: Fingerprint of the source file, part of every cache key and job ID.
+    - preclassifiers: Dict {type: PreClassifier resolving the trivial accounts without GPT}.
+    - name: Name of the chart in the registry.
+    - accounts: Dict {type: {normalized GL account: (GL account, {normalized name: account name})}},
+      the hash index the GPT answers are validated against.
+    - token_counts: Dict {(model, type): [token count of every line of `lines`]}, filled on demand.
+    """
+    def __init__(self, lines, indexes, hash, preclassifiers=None, name=None, accounts=None, token_counts=None):
+        self.lines = lines
+        self.indexes = indexes
+        self.hash = hash
+        self.preclassifiers = preclassifiers or {}
+        self.name = name
+        self.accounts = accounts or {}
+        self.token_counts = token_counts or {}
+
+
+class ChartRegistry:
+    """
+    The charts of accounts kept in memory by name, reloaded when their source file changes.
+    - discover: Callable returning the dict {name: source path} of the available charts.
+    - compile: Callable(path, name) building a Chart from a source file.
+    - artifact_dir: Folder of the compiled artifacts (None keeps the charts in memory only).
+    - dependencies: Callable returning the other files and settings a compiled chart depends on
+      (e.g. the pre-classification rules); a change of one of them also triggers a reload.
+
+    Every get() only stats the source files, so a chart is reloaded by the next job after an
+    edit without restarting the process, while the running jobs keep the Chart they started with.
+    """
+    def __init__(self, discover, compile, artifact_dir=None, dependencies=None):
+        self.discover = discover
+        self.compile = compile
+        self.artifact_dir = artifact_dir
+        self.dependencies = dependencies or (lambda: ())
+        self.lock = threading.Lock()
+        self.loaded = {}  # name -> (signature, Chart)
+
+    def names(self):
+        """Names of the available charts."""
+        return list(self.discover())
+
+    def _inputs(self, path):
+        return (path,) + tuple(self.dependencies())
+
+    def _signature(self, path):
+        """Cheap change detection: size and modification time of the files, value of the settings."""
+        signature = []
+        for item in self._inputs(path):
+            if isinstance(item, str) and os.path.isfile(item):
+                stat = os.stat(item)
+                signature.append((item, stat.st_size, stat.st_mtime_ns))
+            else:
+                signature.append(item)
+        return tuple(signature)
+
+    def _artifact_key(self, path):
+        """Content key of an artifact: the version, the files content and the settings."""
+        digest = hashlib.sha256(f"v{artifact_version}".encode())
+        for item in self._inputs(path):
+            if isinstance(item, str) and os.path.isfile(item):
+                digest.update(file_hash(item).encode())
+            else:
+                digest.update(repr(item).encode())
+        return digest.hexdigest()[:32]
+
+    def _load(self, name, path):
+        if not self.artifact_dir:
+            return self.compile(path, name)
+        key = self._artifact_key(path)
+        artifact_path = os.path.join(self.artifact_dir, f"{name}-{key}.pkl")
+        if os.path.exists(artifact_path):
+            try:
+                with open(artifact_path, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:
+                print(f"Error loading the compiled chart {artifact_path}: {e}")
+        chart = self.compile(path, name)
+        try:
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            temporary_path = artifact_path + ".tmp"
+            with open(temporary_path, "wb") as f:
+                pickle.dump(chart, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, artifact_path)
+            # Artifacts of the previous versions of this chart are no longer needed
+            for file_name in os.listdir(self.artifact_dir):
+                if (file_name.startswith(f"{name}-") and file_name.endswith(".pkl")
+                        and len(file_name) == len(name) + len(key) + 5 and key not in file_name):
+                    os.remove(os.path.join(self.artifact_dir, file_name))
+        except OSError as e:
+            print(f"Error saving the compiled chart {artifact_path}: {e}")
+        return chart
+
+    def get(self, name):
+        """Return the Chart `name`, compiled or loaded on first use and reloaded if its source changed."""
+        sources = self.discover()
+        if name not in sources:
+            raise KeyError(f"Unknown chart of accounts '{name}', expected one of {', '.join(sources)}")
+        path = sources[name]
+        signature = self._signature(path)
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry is None or entry[0] != signature:
+                if entry is not None:
+                    print(f"Chart of accounts '{name}' changed, reloading {path}")
+                self.loaded[name] = (signature, self._load(name, path))
+            return self.loaded[name][1]
+
+    def preload(self):
+        """Load every available chart, so the first job does not pay for it."""
+        for name in self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Error loading the chart of accounts '{name}': {e}")
+        return self
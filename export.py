@@ -0,0 +1,115 @@
+import csv
+import os
+from collections import Counter
+
+# Columns of the output file, same as transco.extract_from_list()
+columns = ['n° de compte', 'Libelle', 'BS ou P&L', 'Compte COA', 'Libelle COA', 'Justification', 'Source']
+output_formats = {".xlsx": "Excel", ".csv": "CSV", ".parquet": "Parquet"}
+mime_types = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv",
+    ".parquet": "application/octet-stream",
+}
+
+
+def clean_value(value):
+    """Remove the '**' markdown markers GPT puts around some labels."""
+    return value.replace('**', '') if isinstance(value, str) else value
+
+
+class ResultWriter:
+    """
+    Output file written row by row as the batches complete, so the result is never held
+    in memory as a whole (xlsxwriter constant-memory mode, streamed CSV, chunked Parquet).
+    Asterisks are removed while writing, like remove_double_asterisks() on the DataFrame.
+    - path: Output file; the format is taken from its extension (.xlsx, .csv or .parquet).
+    - chunk_size: Rows buffered before a Parquet row group is written.
+    """
+    def __init__(self, path, chunk_size=10000):
+        self.path = path
+        self.format = os.path.splitext(path)[1].lower()
+        if self.format not in output_formats:
+            raise ValueError(f"Unsupported output format '{self.format}', expected one of {', '.join(output_formats)}")
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.sources = Counter()
+        self.types = Counter()
+        self.buffer = []
+        self.closed = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if self.format == ".xlsx":
+            import xlsxwriter
+
+            self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+            self.worksheet = self.workbook.add_worksheet()
+            self.worksheet.write_row(0, 0, columns)
+        elif self.format == ".csv":
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(columns)
+        else:
+            # Fail before any GPT call rather than at the first row group
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ValueError("Parquet output requires pyarrow (pip install pyarrow), choose .xlsx or .csv instead") from None
+            self.parquet_writer = None
+
+    def write(self, items, acc_type):
+        """Append mapped accounts (GPT answer format) of one account type."""
+        for item in items:
+            try:
+                row = [
+                    item['account_number'], item['label'], acc_type, item['coa_account'],
+                    item['coa_label'], item['justification'], item.get('resolved_by', 'gpt')
+                ]
+            except (KeyError, TypeError):
+                print("Error processing entry: ", item)
+                continue
+            row = [clean_value(value) for value in row]
+            self.sources[row[-1]] += 1
+            self.types[acc_type] += 1
+            self.rows += 1
+            if self.format == ".xlsx":
+                self.worksheet.write_row(self.rows, 0, row)
+            elif self.format == ".csv":
+                self.csv_writer.writerow(row)
+            else:
+                self.buffer.append(row)
+                if len(self.buffer) >= self.chunk_size:
+                    self._write_parquet_chunk()
+
+    def _write_parquet_chunk(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            column: pa.array([None if value is None else str(value) for value in values], type=pa.string())
+            for column, values in zip(columns, zip(*self.buffer))
+        } if self.buffer else {column: pa.array([], type=pa.string()) for column in columns})
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self.parquet_writer.write_table(table)
+        self.buffer = []
+
+    def close(self):
+        """Flush and close the file. Returns its path."""
+        if self.closed:
+            return self.path
+        self.closed = True
+        if self.format == ".xlsx":
+            self.workbook.close()
+        elif self.format == ".csv":
+            self.file.close()
+        else:
+            if self.buffer or self.parquet_writer is None:
+                self._write_parquet_chunk()
+            self.parquet_writer.close()
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
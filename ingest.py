@@ -0,0 +1,160 @@
+"""
+Streaming ingest of the uploaded accounts files (Excel, CSV or Parquet).
+
+Files are read chunk by chunk (read-only openpyxl for Excel, chunked CSV reader, Parquet
+record batches) and each chunk is normalized with vectorized string operations, so large
+general-ledger extracts never need a full DataFrame in memory: only the compact prompt
+lines "number,label,type" are kept.
+"""
+import os
+
+import pandas as pd
+
+from profiling import null_profiler
+
+supported_extensions = (".xlsx", ".xlsm", ".csv", ".parquet")
+type_prefixes = {"b": "BS", "p": "P&L"}
+
+
+def file_format(source, name=None):
+    """Extension of the file (from `name`, the path or the `name` attribute of an uploaded file)."""
+    name = name or (source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", "")) or ""
+    extension = os.path.splitext(str(name))[1].lower()
+    return extension or ".xlsx"
+
+
+def _excel_chunks(source, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        next(rows, None)  # header
+        chunk = []
+        for row in rows:
+            chunk.append(tuple(row[:3]) + (None,) * (3 - len(row[:3])))
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk)
+    finally:
+        workbook.close()
+
+
+def detect_encoding(sample):
+    """
+    Encoding of a CSV file from its first bytes: UTF-8 (with or without BOM) when they decode
+    as such, otherwise what chardet detects, cp1252 (the usual Excel export on Windows) by default.
+    """
+    try:
+        sample.decode("utf-8")
+        return "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut at the end of the sample is still UTF-8
+        if e.start >= len(sample) - 3 and e.reason == "unexpected end of data":
+            return "utf-8-sig"
+    try:
+        import chardet
+    except ImportError:
+        return "cp1252"
+    detected = chardet.detect(sample)
+    encoding = detected.get("encoding")
+    if not encoding or detected.get("confidence", 0) < 0.5 or encoding.lower() == "ascii":
+        return "cp1252"
+    return encoding
+
+
+def _csv_chunks(source, chunk_size):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            sample = f.read(65536)
+    else:
+        sample = source.read(65536)
+        source.seek(0)
+    encoding = detect_encoding(sample)
+    first_line = sample.decode(encoding, errors="ignore").splitlines()[0] if sample else ""
+    # European exports often use ";" as separator
+    separator = ";" if first_line.count(";") > first_line.count(",") else ","
+    reader = pd.read_csv(
+        source, sep=separator, usecols=[0, 1, 2], dtype=str, keep_default_na=False,
+        chunksize=chunk_size, encoding=encoding
+    )
+    for chunk in reader:
+        yield chunk
+
+
+def _parquet_chunks(source, chunk_size):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(source)
+    columns = parquet_file.schema_arrow.names[:3]
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def iter_chunks(source, name=None, chunk_size=50000):
+    """
+    Yield the first three columns (number, label, type) of an accounts file as DataFrames
+    of at most `chunk_size` rows.
+    - source: Path or file-like object (e.g. a Streamlit UploadedFile).
+    - name: File name, used to detect the format when `source` is a file-like object.
+    """
+    extension = file_format(source, name)
+    if extension == ".csv":
+        return _csv_chunks(source, chunk_size)
+    if extension == ".parquet":
+        return _parquet_chunks(source, chunk_size)
+    if extension in (".xlsx", ".xlsm"):
+        return _excel_chunks(source, chunk_size)
+    raise ValueError(f"Unsupported file format '{extension}', expected one of {', '.join(supported_extensions)}")
+
+
+def _as_text(column):
+    """Vectorized conversion of a column to text: integral floats lose their '.0', missing values become ''."""
+    if pd.api.types.is_float_dtype(column) and ((column.dropna() % 1) == 0).all():
+        column = column.astype("Int64")
+    return column.astype("string").fillna("").str.strip()
+
+
+def normalize_chunk(chunk):
+    """
+    Turn one chunk into prompt lines, with vectorized string operations only.
+    The type is normalized like transco.clean_text() ('b...' -> 'BS', 'p...' -> 'P&L');
+    rows of any other type are left out.
+
+    Returns:
+        types: Series of 'BS' / 'P&L'.
+        lines: Series of "number,label,type" strings, aligned with `types`.
+    """
+    numbers = _as_text(chunk.iloc[:, 0])
+    labels = _as_text(chunk.iloc[:, 1])
+    types = _as_text(chunk.iloc[:, 2]).str.lower().str[:1].map(type_prefixes)
+    keep = types.notna()
+    types = types[keep].astype(str)
+    lines = numbers[keep] + "," + labels[keep] + "," + types
+    return types, lines.astype(str)
+
+
+def iter_account_lines(source, name=None, chunk_size=50000, profiler=None):
+    """
+    Generator of (type, line) pairs read from an accounts file, chunk by chunk.
+    Identical rows are yielded once.
+    - profiler: Optional profiling.RunProfiler timing the 'parse_file' and 'normalize' stages.
+    """
+    profiler = profiler or null_profiler
+    seen = set()
+    chunks = iter_chunks(source, name, chunk_size)
+    while True:
+        with profiler.stage("parse_file"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        with profiler.stage("normalize"):
+            types, lines = normalize_chunk(chunk)
+            pairs = []
+            for acc_type, line in zip(types.tolist(), lines.tolist()):
+                if line not in seen:
+                    seen.add(line)
+                    pairs.append((acc_type, line))
+        yield from pairs
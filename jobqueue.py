@@ -0,0 +1,196 @@
+"""
+Background queue of mapping jobs shared by every session of the app.
+
+Each submitted file becomes a QueuedJob run by a small pool of job threads, so the Streamlit
+script thread only prepares the jobs and then polls their progress instead of blocking
+until the GPT answers are in. All the running jobs send their requests through the same
+BatchScheduler (workers and rate limiter), which serves the jobs in turn, so several
+consultants uploading client files at the same time share the OpenAI quota fairly.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import null_profiler
+
+
+class QueuedJob:
+    """
+    One file submitted to the queue, and its live progress.
+    - name: Name of the uploaded file.
+    - job: The transco.MappingJob of the file, already pre-classified and looked up in the cache.
+    - output_path: File the mapped rows are written to (.xlsx, .csv or .parquet).
+    - submission: ID shared by the files submitted together.
+    - profiler: Optional profiling.RunProfiler of the job, finished when the job ends.
+
+    The counters are only written by the job thread and read as a whole by progress(),
+    so the UI can poll them from any session.
+    """
+    def __init__(self, name, job, output_path, submission=None, profiler=None):
+        self.id = job.job_id or uuid.uuid4().hex
+        self.name = name
+        self.job = job
+        self.output_path = output_path
+        self.submission = submission
+        self.profiler = profiler or null_profiler
+        # The preparation ran in the script thread, the rest of the run happens in a job thread
+        self.profiler.suspend()
+        self.status = "queued"
+        self.total = job.total()
+        # Accounts already known before any GPT call (pre-classifier, cache, journal of a previous run)
+        self.known = job.count('preclassified') + job.count('cached') + job.count('resumed')
+        self.done = self.known
+        self.estimated_cost = job.estimate()['total_cost']
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.rows = 0
+        self.types = {}
+        self.sources = {}
+        self.unresolved = []
+        self.error = None
+        self.report = None
+
+    def _on_progress(self, mapped, total):
+        # `mapped` counts the journal accounts, already part of `known`
+        self.done = self.known + mapped - self.job.count('resumed')
+
+    def run(self, max_tokens=16000):
+        """Run the job in the calling thread and write its output file."""
+        from export import ResultWriter
+
+        self.started_at = time.time()
+        self.status = "running"
+        self.profiler.resume()
+        try:
+            with ResultWriter(self.output_path) as writer:
+                _, unresolved = self.job.run(on_progress=self._on_progress, max_tokens=max_tokens, writer=writer)
+                with self.profiler.stage('write_output'):
+                    writer.close()
+            self.rows = writer.rows
+            self.types = dict(writer.types)
+            self.sources = dict(writer.sources.most_common())
+            self.unresolved = [line for lines in unresolved.values() for line in lines]
+            self.done = self.total - len(self.unresolved)
+            self.status = "done"
+        except Exception as e:
+            print(f"Error running job {self.id} ({self.name}): {e}")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+            if self.profiler.enabled:
+                self.report = self.profiler.finish()
+
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def progress(self):
+        """
+        Snapshot of the job: status, accounts done out of the total, estimated seconds left
+        (from the GPT throughput of this job so far), cost spent so far and estimated cost.
+        """
+        done = self.done
+        eta_seconds = None
+        if self.status == "running" and done > self.known:
+            rate = (done - self.known) / max(time.time() - self.started_at, 1e-6)
+            eta_seconds = (self.total - done) / rate
+        elif self.finished():
+            eta_seconds = 0.0
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "name": self.name,
+            "submission": self.submission,
+            "status": self.status,
+            "done": done,
+            "total": self.total,
+            "eta_seconds": eta_seconds,
+            "elapsed_seconds": end - self.started_at if self.started_at else 0.0,
+            "requests": self.job.usage['requests'],
+            "cost": self.job.spent_cost(),
+            "estimated_cost": self.estimated_cost,
+            "rows": self.rows,
+            "unresolved": len(self.unresolved),
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Jobs waiting or running in the background, in submission order.
+    - max_running_jobs: Number of jobs running at the same time; the next ones wait their turn.
+    - max_finished_jobs: Number of finished jobs kept for the progress views (oldest dropped first,
+      with their output file).
+    - on_finished: Optional callback(QueuedJob) called from the job thread when a job ends.
+
+    The GPT requests of the running jobs go through the shared scheduler with the job ID as
+    fairness key (see scheduler.BatchScheduler), so running more jobs at once shares the
+    workers between them instead of adding requests beyond the rate limits.
+    """
+    def __init__(self, max_running_jobs=4, max_finished_jobs=200, on_finished=None):
+        self.max_finished_jobs = max_finished_jobs
+        self.on_finished = on_finished
+        self.executor = ThreadPoolExecutor(max_workers=max_running_jobs, thread_name_prefix="transco-job")
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()  # id -> QueuedJob
+
+    def submit(self, queued_jobs):
+        """
+        Queue the jobs of one submission.
+        A file whose job is already queued or running (same file, model and chart, e.g. uploaded
+        twice) is not started again: the job already in the queue is returned in its place.
+
+        Returns:
+            The list of the QueuedJob instances to follow, in the order of `queued_jobs`.
+        """
+        submission = uuid.uuid4().hex
+        accepted = []
+        with self.lock:
+            for queued in queued_jobs:
+                current = self.jobs.get(queued.id)
+                if current is not None and not current.finished():
+                    if queued.profiler.enabled:
+                        queued.profiler.finish()
+                    accepted.append(current)
+                    continue
+                queued.submission = submission
+                self.jobs.pop(queued.id, None)
+                self.jobs[queued.id] = queued
+                accepted.append(queued)
+                self.executor.submit(self._run, queued)
+            self._prune()
+        return accepted
+
+    def _run(self, queued):
+        queued.run()
+        if self.on_finished is not None:
+            try:
+                self.on_finished(queued)
+            except Exception as e:
+                print(f"Error after job {queued.id}: {e}")
+
+    def _prune(self):
+        finished = [job_id for job_id, queued in self.jobs.items() if queued.finished()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            queued = self.jobs.pop(job_id)
+            # Nobody can download the output of a job that is no longer listed
+            try:
+                if os.path.exists(queued.output_path):
+                    os.remove(queued.output_path)
+            except OSError as e:
+                print(f"Error removing the output of job {job_id}: {e}")
+
+    def get(self, job_id):
+        """The QueuedJob `job_id`, or None when it is not (or no longer) in the queue."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def counts(self):
+        """Number of jobs per status."""
+        with self.lock:
+            statuses = [queued.status for queued in self.jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
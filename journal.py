@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def job_id_for(file_bytes, *parts):
+    """
+    Identify a job by the content of the uploaded file and the settings that change its result
+    (model, COA fingerprint...), so re-uploading the same file resumes the same job.
+    """
+    digest = hashlib.sha256(file_bytes)
+    for part in parts:
+        digest.update(b"\x1f" + str(part).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class JobJournal:
+    """
+    Append-only JSONL journal of a mapping job.
+    Every completed batch is written (and flushed) as soon as it finishes, so a Streamlit rerun,
+    a browser refresh or a crash only loses the batches that were still in flight.
+    The file can be read at any time from another session to follow the progress.
+    - directory: Folder holding one <job_id>.jsonl file per job.
+    - job_id: Identifier of the job, see job_id_for().
+    """
+    def __init__(self, directory, job_id):
+        os.makedirs(directory, exist_ok=True)
+        self.job_id = job_id
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self.lock = threading.Lock()
+
+    def _append(self, record):
+        record["time"] = time.time()
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.lock:
+            with open(self.path, "a+b") as f:
+                # Start on a fresh line if a previous crash left a truncated record
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _records(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash in the middle of a write leaves a truncated last line
+                    continue
+
+    def record_start(self, total):
+        """Record the number of accounts the job has to map."""
+        self._append({"event": "start", "total": total})
+
+    def record_batch(self, type_compte, lines, items):
+        """Record a completed batch: the input lines it resolved and the matching GPT answers."""
+        self._append({"event": "batch", "type": type_compte, "lines": lines, "items": items})
+
+    def record_done(self, unresolved):
+        """Record the end of the job and the accounts left unresolved."""
+        self._append({"event": "done", "unresolved": unresolved})
+
+    def load(self):
+        """
+        Return what previous runs of this job already produced.
+
+        Returns:
+            lines: Dict {type: [lines already resolved]}.
+            items: Dict {type: [GPT answers for those lines]}.
+        """
+        lines = {}
+        items = {}
+        for record in self._records():
+            if record.get("event") == "batch":
+                lines.setdefault(record["type"], []).extend(record["lines"])
+                items.setdefault(record["type"], []).extend(record["items"])
+        return lines, items
+
+    def progress(self):
+        """
+        Summarize the job from its journal file.
+
+        Returns:
+            A dict with the total number of accounts, the number already mapped, whether the
+            job is finished and the time of the last update (None if the job never started).
+        """
+        total = None
+        done = 0
+        finished = False
+        updated_at = None
+        for record in self._records():
+            updated_at = record.get("time", updated_at)
+            event = record.get("event")
+            if event == "start":
+                total = record["total"]
+                finished = False
+            elif event == "batch":
+                done += len(record["lines"])
+            elif event == "done":
+                finished = True
+        return {"total": total, "done": done, "finished": finished, "updated_at": updated_at}
@@ -0,0 +1,175 @@
+import csv
+import os
+import time
+
+import numpy as np
+
+from cache import normalize_label
+
+# Justification given to the accounts resolved without GPT, per resolution path
+justifications = {
+    "rule:range": "rule: account number {number} is in a configured range mapped to {coa_account}",
+    "rule:exact": "rule: the label matches the COA account name exactly",
+    "rule:fuzzy": "rule: the label is a near match of the COA account name (similarity {score:.2f})",
+}
+
+
+def load_rules(path):
+    """
+    Read the account number rule table, a CSV file with the columns
+    `type` (BS, P&L or empty for both), `prefix`, `range_start`, `range_end` and `coa_account`.
+    A rule matches an account number starting with `prefix`, or whose numeric value lies
+    within [range_start, range_end]. Rules are applied in file order, the first match wins.
+
+    Returns:
+        A list of dicts (empty if the file does not exist).
+    """
+    if not path or not os.path.exists(path):
+        return []
+    rules = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+            if not row.get("coa_account") or not (row.get("prefix") or row.get("range_start")):
+                continue
+            rules.append({
+                "type": row.get("type") or None,
+                "prefix": row.get("prefix") or None,
+                "range_start": float(row["range_start"]) if row.get("range_start") else None,
+                "range_end": float(row.get("range_end") or row["range_start"]) if row.get("range_start") else None,
+                "coa_account": row["coa_account"],
+            })
+    return rules
+
+
+class PreClassifier:
+    """
+    Deterministic matching stage resolving the trivial accounts of one type before GPT.
+    Lines are tried, in order, against the account number rules, a hash index of the
+    normalized COA names and a vectorized fuzzy matcher (character n-gram TF-IDF of the
+    retrieval index); only the ambiguous residue is left for GPT.
+    - accounts: The GL accounts of the COA rows.
+    - names: The COA account names, same row order.
+    - index: CoaIndex over `names`, used for fuzzy matching.
+    - acc_type: The account type ('BS' or 'P&L') of the rows.
+    - rules: Rules from load_rules(); rules of the other type or pointing to unknown accounts are ignored.
+    - fuzzy_threshold: Minimum similarity of a fuzzy match (1 disables fuzzy matching).
+    - fuzzy_margin: Minimum gap between the best and the second best COA name.
+    - chunk_size: Labels scored at once by the fuzzy matcher, which bounds its score matrix
+      to chunk_size x COA rows whatever the number of lines.
+    """
+    def __init__(self, accounts, names, index, acc_type, rules=(), fuzzy_threshold=0.9, fuzzy_margin=0.05,
+                 chunk_size=2048):
+        self.accounts = [str(account) for account in accounts]
+        self.names = [str(name) for name in names]
+        self.index = index
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_margin = fuzzy_margin
+        self.chunk_size = chunk_size
+
+        # Names shared by several GL accounts are ambiguous and never matched exactly
+        self.by_name = {}
+        ambiguous = set()
+        for row, name in enumerate(self.names):
+            key = normalize_label(name)
+            if key in self.by_name and self.accounts[self.by_name[key]] != self.accounts[row]:
+                ambiguous.add(key)
+            self.by_name.setdefault(key, row)
+        for key in ambiguous:
+            del self.by_name[key]
+
+        first_row = {}
+        for row, account in enumerate(self.accounts):
+            first_row.setdefault(account, row)
+        self.rules = []
+        for rule in rules:
+            if rule["type"] not in (None, acc_type):
+                continue
+            if rule["coa_account"] not in first_row:
+                print(f"Ignored rule for unknown {acc_type} COA account {rule['coa_account']}")
+                continue
+            self.rules.append({**rule, "row": first_row[rule["coa_account"]]})
+
+    def _match_rules(self, numbers):
+        """Row of the first matching rule for every account number (-1 when none matches)."""
+        rows = np.full(len(numbers), -1, dtype=np.int64)
+        if not self.rules or not numbers:
+            return rows
+        strings = np.array(numbers, dtype=str)
+        values = np.array([_to_float(number) for number in numbers], dtype=np.float64)
+        for rule in self.rules:
+            unmatched = rows < 0
+            if rule["prefix"]:
+                matches = np.char.startswith(strings, rule["prefix"])
+            else:
+                matches = (values >= rule["range_start"]) & (values <= rule["range_end"])
+            rows[unmatched & matches] = rule["row"]
+        return rows
+
+    def _item(self, number, label, row, path, score=None):
+        return {
+            "account_number": number,
+            "label": label,
+            "coa_account": self.accounts[row],
+            "coa_label": self.names[row],
+            "justification": justifications[path].format(number=number, coa_account=self.accounts[row], score=score),
+            "resolved_by": path,
+        }
+
+    def classify(self, fields):
+        """
+        Resolve what can be resolved locally.
+        - fields: List of (number, label, type) tuples, see transco.split_line().
+
+        Returns:
+            items: Mapped accounts (same format as the GPT answers, plus a `resolved_by` key).
+            residue: Positions in `fields` left for GPT.
+            stats: Dict with the number of lines resolved by each path and the time spent.
+        """
+        start = time.perf_counter()
+        numbers = [number for number, _, _ in fields]
+        resolved = {}
+
+        for position, row in enumerate(self._match_rules(numbers)):
+            if row >= 0:
+                resolved[position] = self._item(fields[position][0], fields[position][1], row, "rule:range")
+
+        remaining = []
+        for position, (number, label, _) in enumerate(fields):
+            if position in resolved:
+                continue
+            row = self.by_name.get(normalize_label(label))
+            if row is not None:
+                resolved[position] = self._item(number, label, row, "rule:exact")
+            else:
+                remaining.append(position)
+
+        if remaining and self.fuzzy_threshold < 1 and self.index.size > 1:
+            for chunk_start in range(0, len(remaining), self.chunk_size):
+                chunk = remaining[chunk_start:chunk_start + self.chunk_size]
+                # Only the two best scores and the best row of each label are kept from the chunk
+                scores = self.index.score_matrix([fields[position][1] for position in chunk])
+                top2 = np.partition(scores, scores.shape[1] - 2, axis=1)[:, -2:]
+                best_rows = scores.argmax(axis=1)
+                del scores
+                best_scores = top2.max(axis=1)
+                confident = (best_scores >= self.fuzzy_threshold) & (best_scores - top2.min(axis=1) >= self.fuzzy_margin)
+                for i in np.flatnonzero(confident):
+                    position = chunk[i]
+                    number, label, _ = fields[position]
+                    resolved[position] = self._item(number, label, int(best_rows[i]), "rule:fuzzy", float(best_scores[i]))
+
+        residue = [position for position in range(len(fields)) if position not in resolved]
+        stats = {path: 0 for path in justifications}
+        for item in resolved.values():
+            stats[item["resolved_by"]] += 1
+        stats["lines"] = len(fields)
+        stats["seconds"] = time.perf_counter() - start
+        return [resolved[position] for position in sorted(resolved)], residue, stats
+
+
+def _to_float(number):
+    try:
+        return float(str(number).strip().lstrip("*"))
+    except ValueError:
+        return np.nan
@@ -0,0 +1,230 @@
+"""
+Per-stage profiling of a mapping run.
+
+The pipeline stages (file parsing, normalization, pre-classification, cache lookup, prompt
+building, tokenization, API wait, JSON parsing, validation, output writing...) are wrapped in
+named spans of a profiler passed down with the job. When profiling is disabled the null
+profiler is used: every span is the same shared no-op context manager, so the instrumentation
+costs a method call per batch or chunk. At the end of a run, RunProfiler.finish() returns the
+timing and memory breakdown, which can be shown, exported as JSON or sent as spans.
+"""
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class NullProfiler:
+    """Profiler used when profiling is disabled: every call is a no-op."""
+    enabled = False
+
+    def stage(self, name):
+        return _null_stage
+
+    def add(self, name, seconds, calls=1):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def suspend(self):
+        pass
+
+    def resume(self):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def max_rss_mb():
+    """Peak resident memory of the process, in MB (None where the platform does not report it)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class RunProfiler:
+    """
+    Stage timings and counters of one run, safe to use from the worker threads.
+    Stages running in the workers (API wait, JSON parsing) overlap, so their summed time
+    can exceed the wall time of the run.
+    - name: Name of the run (e.g. the job ID), part of the report.
+    - deep: Also capture a cProfile of the calling thread and the allocations (tracemalloc),
+      for deep dives only: both slow the run down noticeably.
+    """
+    enabled = True
+
+    def __init__(self, name=None, deep=False):
+        self.name = name
+        self.deep = deep
+        self.lock = threading.Lock()
+        self.stages = {}  # name -> [calls, seconds, max seconds]
+        self.counters = {}
+        self.report = None
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.profile = None
+        self.owns_tracemalloc = False
+        if deep:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.owns_tracemalloc = True
+            try:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+            except ValueError as e:
+                # Another profiler is already running in this process
+                print(f"Error starting cProfile: {e}")
+                self.profile = None
+
+    def stage(self, name):
+        """Context manager timing one execution of the stage `name`."""
+        return _Stage(self, name)
+
+    def add(self, name, seconds, calls=1):
+        """Add a duration measured elsewhere to the stage `name`."""
+        with self.lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [calls, seconds, seconds]
+            else:
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def count(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def suspend(self):
+        """
+        Stop the cProfile capture of the calling thread before the run continues in another thread
+        (cProfile only sees the thread it was enabled in); resume() it from that thread.
+        """
+        if self.profile is not None and self.report is None:
+            self.profile.disable()
+
+    def resume(self):
+        """Continue the cProfile capture in the calling thread."""
+        if self.profile is not None and self.report is None:
+            try:
+                self.profile.enable()
+            except ValueError as e:
+                print(f"Error resuming cProfile: {e}")
+
+    def finish(self, top=20):
+        """
+        Stop the capture (once) and return the report: wall time, stages sorted by time spent,
+        counters, peak memory and, in deep mode, the `top` functions and allocation sites.
+        """
+        if self.report is not None:
+            return self.report
+        wall_seconds = time.perf_counter() - self.start
+        with self.lock:
+            stages = [
+                {
+                    "stage": name,
+                    "calls": calls,
+                    "seconds": seconds,
+                    "mean_ms": seconds / calls * 1000 if calls else 0.0,
+                    "max_ms": longest * 1000,
+                    "share_of_wall": seconds / wall_seconds if wall_seconds else 0.0,
+                }
+                for name, (calls, seconds, longest) in self.stages.items()
+            ]
+            counters = dict(self.counters)
+        stages.sort(key=lambda stage: -stage["seconds"])
+        report = {
+            "name": self.name,
+            "started_at": self.started_at,
+            "wall_seconds": wall_seconds,
+            "stages": stages,
+            "counters": counters,
+            "max_rss_mb": max_rss_mb(),
+        }
+        if self.profile is not None:
+            self.profile.disable()
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(top)
+            report["cprofile"] = stream.getvalue()
+        if self.deep and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:top]
+            report["traced_peak_mb"] = peak / 2 ** 20
+            report["top_allocations"] = [
+                {"where": str(statistic.traceback[0]), "size_mb": statistic.size / 2 ** 20, "count": statistic.count}
+                for statistic in statistics
+            ]
+            if self.owns_tracemalloc:
+                tracemalloc.stop()
+        self.report = report
+        return report
+
+    def to_json(self):
+        """The report as a JSON document."""
+        return json.dumps(self.finish(), indent=2, default=str)
+
+    def send(self, telemetry, tags=None):
+        """Send the report through the telemetry pipeline: one span per stage and the stage durations as metrics."""
+        report = self.finish()
+        tags = dict(tags or {})
+        telemetry.span("run", report["started_at"], report["wall_seconds"], tags={**tags, "run": report["name"]})
+        metric_tags = [f"{key}:{value}" for key, value in tags.items()]
+        for stage in report["stages"]:
+            telemetry.span(
+                f"stage.{stage['stage']}", report["started_at"], stage["seconds"],
+                tags={**tags, "run": report["name"], "calls": stage["calls"]}
+            )
+            telemetry.histogram("transco.stage.duration", stage["seconds"], metric_tags + [f"stage:{stage['stage']}"])
+
+
+def format_report(report):
+    """Plain text table of a report, for the command line."""
+    lines = [f"Run {report['name'] or ''} took {report['wall_seconds']:.2f} s"
+             + (f", peak memory {report['max_rss_mb']:.0f} MB" if report.get('max_rss_mb') else "")]
+    lines.append(f"{'stage':<16}{'calls':>8}{'seconds':>10}{'mean ms':>10}{'max ms':>10}{'% wall':>8}")
+    for stage in report["stages"]:
+        lines.append(
+            f"{stage['stage']:<16}{stage['calls']:>8}{stage['seconds']:>10.3f}{stage['mean_ms']:>10.1f}"
+            f"{stage['max_ms']:>10.1f}{stage['share_of_wall']:>8.0%}"
+        )
+    if report["counters"]:
+        lines.append(", ".join(f"{name}: {value:,.0f}" for name, value in sorted(report["counters"].items())))
+    return "\n".join(lines)
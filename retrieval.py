@@ -0,0 +1,125 @@
+import re
+from collections import defaultdict
+
+import numpy as np
+
+
+def char_ngrams(text, n=3):
+    """
+    Split a label into its character n-grams, computed word by word with boundary markers
+    so that "cash" and "cashier" share n-grams but words never bleed into each other.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    grams = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        padded = f" {word} "
+        if len(padded) <= n:
+            grams.append(padded)
+        else:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return grams
+
+
+class CoaIndex:
+    """
+    Local TF-IDF index over character n-grams of COA account names, used to pick the
+    few COA accounts worth showing to GPT for a given batch of foreign accounts.
+    Stored as a sparse inverted index (n-gram -> postings arrays) so scoring a query
+    only touches the COA rows sharing at least one n-gram with it.
+    - names: The COA account names to index.
+    - n: The n-gram size.
+    """
+    def __init__(self, names, n=3):
+        self.n = n
+        self.size = len(names)
+        term_counts = [self._counts(name) for name in names]
+
+        document_frequency = defaultdict(int)
+        for counts in term_counts:
+            for gram in counts:
+                document_frequency[gram] += 1
+        self.idf = {gram: np.log((1 + self.size) / (1 + df)) + 1.0 for gram, df in document_frequency.items()}
+
+        postings = defaultdict(lambda: ([], []))
+        for row, counts in enumerate(term_counts):
+            weights = {gram: (1 + np.log(count)) * self.idf[gram] for gram, count in counts.items()}
+            norm = np.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                rows, values = postings[gram]
+                rows.append(row)
+                values.append(weight / norm)
+        self.postings = {
+            gram: (np.asarray(rows, dtype=np.int32), np.asarray(values, dtype=np.float32))
+            for gram, (rows, values) in postings.items()
+        }
+
+    def _counts(self, text):
+        counts = defaultdict(int)
+        for gram in char_ngrams(text, self.n):
+            counts[gram] += 1
+        return counts
+
+    def scores(self, query):
+        """Return the cosine similarity between `query` and every indexed name."""
+        result = np.zeros(self.size, dtype=np.float32)
+        weights = {
+            gram: (1 + np.log(count)) * self.idf[gram]
+            for gram, count in self._counts(query).items() if gram in self.idf
+        }
+        norm = np.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for gram, weight in weights.items():
+            rows, values = self.postings[gram]
+            result[rows] += values * (weight / norm)
+        return result
+
+    def score_matrix(self, queries):
+        """
+        Cosine similarity of many queries at once: a (len(queries), len(names)) array.
+        The query weights are grouped by n-gram so each postings list is applied to all
+        the queries containing it in one vectorized update.
+        """
+        result = np.zeros((len(queries), self.size), dtype=np.float32)
+        by_gram = defaultdict(lambda: ([], []))
+        for position, query in enumerate(queries):
+            weights = {
+                gram: (1 + np.log(count)) * self.idf[gram]
+                for gram, count in self._counts(query).items() if gram in self.idf
+            }
+            norm = np.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                positions, values = by_gram[gram]
+                positions.append(position)
+                values.append(weight / norm)
+        for gram, (positions, values) in by_gram.items():
+            rows, row_values = self.postings[gram]
+            result[np.ix_(positions, rows)] += np.outer(np.asarray(values, dtype=np.float32), row_values)
+        return result
+
+    @staticmethod
+    def _best_rows(scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        return best[np.argsort(-scores[best], kind="stable")].tolist()
+
+    def top_k(self, query, k):
+        """Return the indices of the `k` best matching names, best first."""
+        return self._best_rows(self.scores(query), k)
+
+    def select_for_batch(self, queries, k_per_query, max_candidates=None):
+        """
+        Candidate COA rows for a whole batch: the union of the top `k_per_query` rows of
+        every query, ordered by their best score and capped at `max_candidates`.
+        """
+        best_score = {}
+        for query in queries:
+            scores = self.scores(query)
+            for row in self._best_rows(scores, k_per_query):
+                best_score[row] = max(best_score.get(row, 0.0), float(scores[row]))
+        ranked = sorted(best_score, key=lambda row: (-best_score[row], row))
+        if max_candidates:
+            ranked = ranked[:max_candidates]
+        # Keep the COA order in the prompt, it groups related accounts together
+        return sorted(ranked)
@@ -0,0 +1,159 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+    - rate_per_minute: Number of units granted per minute (also the bucket capacity).
+
+    A request larger than the capacity is clamped to the capacity, so a single oversized
+    batch waits for a full bucket instead of blocking forever.
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate_per_second = self.capacity / 60.0
+        self.available = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.available = min(self.capacity, self.available + elapsed * self.rate_per_second)
+
+    def try_acquire(self, amount=1):
+        """
+        Take `amount` units if they are available right now.
+        Returns 0 on success, otherwise the number of seconds to wait before retrying.
+        """
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return 0
+            return (amount - self.available) / self.rate_per_second
+
+    def release(self, amount=1):
+        """Give back units that were acquired but not used."""
+        with self.lock:
+            self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """
+    Combined requests-per-minute and tokens-per-minute budget shared by every worker.
+    - requests_per_minute: Maximum number of API calls per minute.
+    - tokens_per_minute: Maximum number of tokens (prompt + expected completion) per minute.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """
+        Block until one request and `tokens` tokens fit in both budgets, then consume them.
+        Both buckets are checked under one lock so a request never holds a partial grant.
+        """
+        while True:
+            with self.lock:
+                wait_requests = self.requests.try_acquire(1)
+                if wait_requests == 0:
+                    wait_tokens = self.tokens.try_acquire(tokens)
+                    if wait_tokens == 0:
+                        return
+                    # Give the request slot back, we could not get the tokens
+                    self.requests.release(1)
+                    wait = wait_tokens
+                else:
+                    wait = wait_requests
+            time.sleep(wait)
+
+
+class BatchScheduler:
+    """
+    Shared execution engine keeping up to `max_workers` GPT requests in flight.
+    Every submitted call first waits for the rate limiter, so BS and P&L batches
+    submitted to the same scheduler compete fairly for one API budget.
+    - max_workers: Number of concurrent requests.
+    - rate_limiter: A RateLimiter instance (or None to disable throttling).
+
+    Waiting calls are grouped by the `key` given to submit() (e.g. one key per job) and a free
+    worker takes the oldest call of the next key in turn, so a large job cannot hold the
+    workers while a small one submitted later waits behind all of its batches.
+    Calls sharing the same key run in submission order.
+    """
+    def __init__(self, max_workers, rate_limiter=None):
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gpt-batch")
+        self.lock = threading.Lock()
+        self.waiting = OrderedDict()  # key -> deque of calls, in round-robin order
+
+    def _next_call(self):
+        with self.lock:
+            key, calls = next(iter(self.waiting.items()))
+            call = calls.popleft()
+            # The key goes to the back of the rotation
+            del self.waiting[key]
+            if calls:
+                self.waiting[key] = calls
+        return call
+
+    def _run_next(self):
+        future, fn, tokens, args, kwargs = self._next_call()
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(tokens)
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def submit(self, fn, *args, tokens=0, key=None, **kwargs):
+        """
+        Schedule `fn(*args, **kwargs)` once `tokens` tokens are available in the budget.
+        - key: Fairness group of the call (calls without a key share one group).
+        Returns a concurrent.futures.Future.
+        """
+        future = Future()
+        with self.lock:
+            self.waiting.setdefault(key, deque()).append((future, fn, tokens, args, kwargs))
+        # One pool task per call: each task runs whichever call is next in turn
+        self.executor.submit(self._run_next)
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def retry_with_backoff(fn, retry_on, max_retries=5, base_delay=1.0, max_delay=60.0, before_retry=None):
+    """
+    Call `fn()` and retry it on the exceptions listed in `retry_on`, sleeping with
+    exponential backoff and full jitter between attempts (random delay in [0, base * 2^n]).
+    - retry_on: Tuple of exception types considered transient (rate limits, timeouts...).
+    - max_retries: Number of retries after the first call before the error is re-raised.
+    - base_delay / max_delay: Bounds of the backoff, in seconds.
+    - before_retry: Optional callable run after the backoff, before each retry. A retry is a new
+      request for the API, so the callers pass the rate limiter here (see RateLimiter.acquire()).
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except retry_on:
+            if attempt >= max_retries:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+            if before_retry is not None:
+                before_retry()
+            attempt += 1
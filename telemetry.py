@@ -0,0 +1,216 @@
+import atexit
+import json
+import math
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = min(len(sorted_values), max(1, math.ceil(q * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class NullSink:
+    """Sink discarding everything, used when no telemetry backend is configured."""
+    def send(self, series, spans):
+        pass
+
+
+class LocalSink:
+    """
+    In-process sink for offline runs and tests: keeps the last flushed points and spans in memory
+    and optionally appends them to a JSONL file.
+    - path: Optional JSONL file receiving one record per point or span.
+    - max_records: Number of points and spans kept in memory.
+    """
+    def __init__(self, path=None, max_records=10000):
+        self.path = path
+        self.series = deque(maxlen=max_records)
+        self.spans = deque(maxlen=max_records)
+
+    def send(self, series, spans):
+        self.series.extend(series)
+        self.spans.extend(spans)
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for record in series:
+                    f.write(json.dumps({"kind": "metric", **record}) + "\n")
+                for record in spans:
+                    f.write(json.dumps({"kind": "span", **record}, default=str) + "\n")
+
+
+class DatadogSink:
+    """
+    Sink shipping the aggregated points to the Datadog metrics API in a single call per flush,
+    and the spans through the ddtrace tracer.
+    - api_key: Datadog API key.
+    - api_host: Datadog API host.
+    """
+    def __init__(self, api_key, api_host='https://api.datadoghq.eu'):
+        from datadog import initialize
+
+        initialize(api_key=api_key, api_host=api_host, dd_site='datadoghq.eu', disable_trace_agent=True)
+
+    def send(self, series, spans):
+        if series:
+            from datadog import api
+
+            api.Metric.send(series)
+        if spans:
+            from ddtrace import tracer
+
+            for record in spans:
+                span = tracer.trace(record["name"], service="transcogpt")
+                span.start = record["start"]
+                for key, value in record["tags"].items():
+                    span.set_tag(key, value)
+                if record.get("error"):
+                    span.error = 1
+                    span.set_tag("error.message", record["error"])
+                span.finish(finish_time=record["start"] + record["duration"])
+
+
+class Telemetry:
+    """
+    Buffered, non-blocking metrics and tracing pipeline.
+    Recording a point only puts it on a bounded queue (dropped if the queue is full, never blocking
+    the caller); a background thread aggregates counters and histograms and flushes them to the
+    sink every `flush_interval` seconds or as soon as `flush_size` points are waiting.
+    A slow or failing backend therefore only delays the background thread, never a GPT request.
+    - sink: Object with a send(series, spans) method (DatadogSink, LocalSink, NullSink).
+    - flush_interval: Maximum number of seconds between two flushes.
+    - flush_size: Number of aggregated points or spans triggering an early flush.
+    - max_queue: Capacity of the queue; points recorded while it is full are dropped and counted.
+    """
+    def __init__(self, sink, flush_interval=10.0, flush_size=1000, max_queue=10000):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)  # (name, tags) -> sum
+        self.histograms = defaultdict(list)  # (name, tags) -> values
+        self.spans = []
+        self.waiting = 0  # points and spans aggregated since the last flush
+        self.flush_requested = threading.Event()
+        self.flushed = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def increment(self, name, value=1, tags=None):
+        """Add `value` to a counter."""
+        self._put(("count", name, value, tuple(sorted(tags or ()))))
+
+    def histogram(self, name, value, tags=None):
+        """Record one sample of a distribution (latency, tokens...)."""
+        self._put(("histogram", name, value, tuple(sorted(tags or ()))))
+
+    def span(self, name, start, duration, tags=None, error=None):
+        """Record a finished operation, sent as a trace span by the sinks supporting it."""
+        self._put(("span", name, {"start": start, "duration": duration, "tags": dict(tags or {}),
+                                  "error": str(error) if error is not None else None}, None))
+
+    def _aggregate(self, record):
+        kind, name, value, tags = record
+        self.waiting += 1
+        if kind == "count":
+            self.counters[(name, tags)] += value
+        elif kind == "histogram":
+            self.histograms[(name, tags)].append(value)
+        else:
+            self.spans.append({"name": name, **value})
+
+    def _series(self, now):
+        timestamp = int(now)
+        series = [
+            {"metric": name, "points": [[timestamp, value]], "tags": list(tags), "type": "count"}
+            for (name, tags), value in self.counters.items()
+        ]
+        for (name, tags), values in self.histograms.items():
+            values.sort()
+            summary = {
+                "count": len(values),
+                "avg": sum(values) / len(values),
+                "max": values[-1],
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            series.extend(
+                {"metric": f"{name}.{stat}", "points": [[timestamp, value]], "tags": list(tags), "type": "gauge"}
+                for stat, value in summary.items()
+            )
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            series.append({"metric": "transco.telemetry.dropped", "points": [[timestamp, dropped]], "tags": [], "type": "count"})
+        return series
+
+    def _flush(self):
+        now = time.time()
+        series = self._series(now)
+        spans = self.spans
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(list)
+        self.spans = []
+        self.waiting = 0
+        if not series and not spans:
+            return
+        try:
+            self.sink.send(series, spans)
+        except Exception as e:
+            print(f"Erreur d'envoi de télémétrie: {str(e)}")
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval
+        while True:
+            try:
+                self._aggregate(self.queue.get(timeout=max(0.0, min(0.5, next_flush - time.time()))))
+                # Drain whatever is already waiting before deciding to flush
+                while self.waiting < self.flush_size:
+                    self._aggregate(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stopping = self.stopped.is_set()
+            if stopping or self.flush_requested.is_set() or time.time() >= next_flush or self.waiting >= self.flush_size:
+                if stopping or self.flush_requested.is_set():
+                    while True:
+                        try:
+                            self._aggregate(self.queue.get_nowait())
+                        except queue.Empty:
+                            break
+                self._flush()
+                next_flush = time.time() + self.flush_interval
+                if self.flush_requested.is_set():
+                    self.flush_requested.clear()
+                    self.flushed.set()
+            if stopping:
+                return
+
+    def flush(self, timeout=5.0):
+        """Ask the background thread to flush everything recorded so far and wait for it."""
+        if not self.thread.is_alive():
+            return
+        self.flushed.clear()
+        self.flush_requested.set()
+        self.flushed.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Flush the remaining points and stop the background thread."""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
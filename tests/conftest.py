@@ -0,0 +1,32 @@
+import os
+import re
+import sys
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class WordEncoding:
+    """Offline stand-in for a tiktoken encoding: one token per word or punctuation sign."""
+    def encode(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+    def encode_ordinary_batch(self, texts, **kwargs):
+        return [self.encode(text) for text in texts]
+
+
+@pytest.fixture
+def offline_engine(tmp_path, monkeypatch):
+    """The transco module with a local tokenizer and every file it writes under tmp_path."""
+    import transco
+
+    monkeypatch.setattr(transco, "get_encoding", lambda model_name: WordEncoding())
+    monkeypatch.setattr(transco, "chart_artifact_dir", str(tmp_path / "charts"))
+    monkeypatch.setattr(transco, "journal_dir", str(tmp_path / "jobs"))
+    monkeypatch.setattr(transco, "cache_enabled", False)
+    monkeypatch.setattr(transco, "adaptive_batch_size", False)
+    transco.get_chart_registry.cache_clear()
+    yield transco
+    transco.get_chart_registry.cache_clear()
@@ -0,0 +1,143 @@
+import json
+import os
+import re
+
+from batch_api import LocalBatchTransport, OpenAIBatchTransport, map_accounts_with_batch_api
+
+account_line = re.compile(r"^(\S+),(.+),(BS|P&L)$", re.MULTILINE)
+
+
+def responder_for(chart):
+    """Answer every account of a request with the first COA account of its type."""
+    def respond(body):
+        lines = account_line.findall(body["messages"][1]["content"])
+        answers = []
+        for number, label, acc_type in lines:
+            coa_account, names = next(iter(chart.accounts[acc_type].values()))
+            answers.append({
+                "account_number": number, "label": label, "coa_account": coa_account,
+                "coa_label": next(iter(names.values())), "justification": "test"
+            })
+        return {"choices": [{"message": {"content": json.dumps({"final_answer": answers})}}]}
+    return respond
+
+
+class ExpiringTransport(LocalBatchTransport):
+    """The first batch expires after answering its first request only."""
+    def __init__(self, directory, responder):
+        super().__init__(directory, responder)
+        self.submitted = []
+
+    def submit(self, requests_path):
+        batch_id = super().submit(requests_path)
+        self.submitted.append(batch_id)
+        return batch_id
+
+    def poll(self, batch_id):
+        status = super().poll(batch_id)
+        if batch_id == self.submitted[0]:
+            status["status"] = "expired"
+        return status
+
+    def results(self, batch_id):
+        records = list(super().results(batch_id))
+        return records[:1] if batch_id == self.submitted[0] else records
+
+
+class Response:
+    def __init__(self, payload=None, text=""):
+        self.payload = payload
+        self.text = text
+
+    def json(self):
+        return self.payload
+
+
+class FakeOpenAIBatchTransport(OpenAIBatchTransport):
+    """OpenAIBatchTransport against an in-memory files and batches API answering on creation."""
+    def __init__(self, responder):
+        super().__init__("test-key")
+        self.responder = responder
+        self.files = {}
+        self.batches = {}
+        self.deleted = []
+
+    def _request(self, method, path, **kwargs):
+        if method == "POST" and path == "/files":
+            file_id = f"file-{len(self.files) + len(self.deleted)}"
+            self.files[file_id] = kwargs["files"]["file"][1].read().decode("utf-8")
+            return Response({"id": file_id})
+        if method == "POST" and path == "/batches":
+            requests = [json.loads(line) for line in self.files[kwargs["json"]["input_file_id"]].splitlines()]
+            output_id = f"file-{len(self.files) + len(self.deleted)}"
+            self.files[output_id] = "\n".join(json.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": self.responder(request["body"])},
+            }) for request in requests)
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {
+                "id": batch_id, "status": "completed", "input_file_id": kwargs["json"]["input_file_id"],
+                "output_file_id": output_id, "error_file_id": None,
+                "request_counts": {"completed": len(requests), "failed": 0, "total": len(requests)},
+            }
+            return Response(self.batches[batch_id])
+        if method == "GET" and path.startswith("/batches/"):
+            return Response(self.batches[path.split("/")[2]])
+        if method == "GET" and path.endswith("/content"):
+            return Response(text=self.files[path.split("/")[2]])
+        if method == "DELETE":
+            file_id = path.split("/")[2]
+            del self.files[file_id]
+            self.deleted.append(file_id)
+            return Response({"id": file_id, "deleted": True})
+        raise AssertionError(f"Unexpected request {method} {path}")
+
+
+def lines_by_type(count):
+    return {
+        "BS": [f"{100000 + index},Balance sheet account {index},BS" for index in range(count)],
+        "P&L": [f"{600000 + index},Income statement account {index},P&L" for index in range(count)],
+    }
+
+
+def test_no_request_file_left_once_everything_is_resolved(offline_engine, tmp_path):
+    chart = offline_engine.get_chart()
+    transport = LocalBatchTransport(str(tmp_path / "outputs"), responder_for(chart))
+    work_dir = tmp_path / "requests"
+    extracted, pending = map_accounts_with_batch_api(
+        offline_engine.base_prompt, lines_by_type(5), offline_engine.model, transport, max_attempts=3,
+        poll_interval=0, work_dir=str(work_dir), chart=chart
+    )
+    assert len(extracted["BS"]) == 5 and len(extracted["P&L"]) == 5
+    assert pending == {"BS": [], "P&L": []}
+    assert os.listdir(work_dir) == []
+
+
+def test_expired_batch_keeps_its_completed_answers(offline_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(offline_engine, "max_accounts_per_batch", 10)
+    chart = offline_engine.get_chart()
+    transport = ExpiringTransport(str(tmp_path / "outputs"), responder_for(chart))
+    done = []
+    extracted, pending = map_accounts_with_batch_api(
+        offline_engine.base_prompt, lines_by_type(20), offline_engine.model, transport, max_attempts=3,
+        on_batch_done=lambda acc_type, lines, items: done.append(len(lines)),
+        poll_interval=0, work_dir=str(tmp_path / "requests"), chart=chart
+    )
+    # The first request of the expired batch is merged, the others are resubmitted once
+    assert len(transport.submitted) == 2
+    assert done[0] == 10
+    assert len(extracted["BS"]) == 20 and len(extracted["P&L"]) == 20
+    assert pending == {"BS": [], "P&L": []}
+
+
+def test_batch_api_files_are_deleted_once_read(offline_engine, tmp_path):
+    chart = offline_engine.get_chart()
+    transport = FakeOpenAIBatchTransport(responder_for(chart))
+    extracted, pending = map_accounts_with_batch_api(
+        offline_engine.base_prompt, lines_by_type(5), offline_engine.model, transport, max_attempts=3,
+        poll_interval=0, work_dir=str(tmp_path / "requests"), chart=chart
+    )
+    assert len(extracted["BS"]) == 5 and len(extracted["P&L"]) == 5
+    # Input and output file of the batch
+    assert len(transport.deleted) == 2
+    assert transport.files == {}
@@ -0,0 +1,36 @@
+import random
+import statistics
+
+from batch_sizing import BatchSizeController
+
+
+def simulate(omission_rate, initial_size=50, batches=2000, seed=1):
+    """Feed the controller batches whose accounts are each omitted with probability omission_rate(size)."""
+    rnd = random.Random(seed)
+    controller = BatchSizeController(initial_size)
+    sizes = []
+    for _ in range(batches):
+        size = controller.size
+        missing = sum(rnd.random() < omission_rate(size) for _ in range(size))
+        # Latency grows with the size, so larger batches resolve more accounts per second
+        controller.observe(size, missing, 0.5 + 0.02 * size * rnd.uniform(0.9, 1.1), 40 * (size - missing))
+        sizes.append(controller.size)
+    return sizes[300:]
+
+
+def test_size_independent_omissions_keep_the_size():
+    for rate in (0.015, 0.1):
+        sizes = simulate(lambda size: rate)
+        assert statistics.mean(sizes) > 80
+        assert min(sizes) >= 25
+
+
+def test_size_independent_omissions_from_a_small_size_do_not_collapse():
+    sizes = simulate(lambda size: 0.1, initial_size=10)
+    assert statistics.mean(sizes) > 80
+
+
+def test_size_related_omissions_shrink_the_size():
+    sizes = simulate(lambda size: 0.15 if size > 30 else 0.005)
+    assert max(sizes) < 40
+    assert statistics.mean(sizes) < 30
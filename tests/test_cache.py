@@ -0,0 +1,39 @@
+import cache
+from cache import MappingCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_expired_entries_are_ignored_and_purged(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    mappings = MappingCache(str(tmp_path / "mappings.sqlite"), ttl_seconds=100)
+    mappings.put_many([("old", {"coa_account": "401"})])
+    clock.now += 60
+    mappings.put_many([("new", {"coa_account": "512"})])
+    clock.now += 50
+    assert mappings.get_many(["old", "new"]) == {"new": {"coa_account": "512"}}
+    mappings.put_many([("newer", {"coa_account": "607"})])
+    keys = [key for key, in mappings.connection.execute("SELECT key FROM mappings ORDER BY key")]
+    assert keys == ["new", "newer"]
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    mappings = MappingCache(str(tmp_path / "mappings.sqlite"), max_entries=2)
+    mappings.put_many([("a", {"coa_account": "401"})])
+    clock.now += 1
+    mappings.put_many([("b", {"coa_account": "512"})])
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used entry
+    assert mappings.get_many(["a"]) == {"a": {"coa_account": "401"}}
+    clock.now += 1
+    mappings.put_many([("c", {"coa_account": "607"})])
+    assert mappings.get_many(["a", "b", "c"]) == {"a": {"coa_account": "401"}, "c": {"coa_account": "607"}}
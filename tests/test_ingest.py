@@ -0,0 +1,21 @@
+from ingest import detect_encoding, iter_account_lines
+
+
+def read_lines(path):
+    return [line for _, line in iter_account_lines(str(path))]
+
+
+def test_csv_exported_in_cp1252_keeps_its_accents(tmp_path):
+    path = tmp_path / "ledger.csv"
+    path.write_bytes("Compte;Libellé;Type\n401000;Fournisseurs étrangers;Bilan\n607000;Achats de marchandises – France;P&L\n".encode("cp1252"))
+    assert read_lines(path) == ["401000,Fournisseurs étrangers,BS", "607000,Achats de marchandises – France,P&L"]
+
+
+def test_csv_in_utf8_with_bom(tmp_path):
+    path = tmp_path / "ledger.csv"
+    path.write_bytes("Compte,Libellé,Type\n401000,Fournisseurs étrangers,BS\n".encode("utf-8-sig"))
+    assert read_lines(path) == ["401000,Fournisseurs étrangers,BS"]
+
+
+def test_utf8_character_cut_at_the_end_of_the_sample():
+    assert detect_encoding("Libellé".encode("utf-8")[:-1]) == "utf-8-sig"
@@ -0,0 +1,35 @@
+from jobqueue import JobQueue
+from profiling import null_profiler
+
+
+class FinishedJob:
+    """Stand-in for a QueuedJob whose run only writes its output file."""
+    def __init__(self, job_id, output_path):
+        self.id = job_id
+        self.output_path = output_path
+        self.profiler = null_profiler
+        self.submission = None
+        self.status = "queued"
+
+    def run(self):
+        with open(self.output_path, "w") as f:
+            f.write("mapped")
+        self.status = "done"
+
+    def finished(self):
+        return self.status in ("done", "failed")
+
+
+def test_pruned_jobs_take_their_output_file_with_them(tmp_path):
+    queue = JobQueue(max_running_jobs=1, max_finished_jobs=1)
+    jobs = [FinishedJob(f"job{index}", str(tmp_path / f"job{index}.csv")) for index in range(3)]
+    try:
+        for job in jobs:
+            queue.submit([job])
+            queue.executor.submit(lambda: None).result()
+        queue.submit([])
+    finally:
+        queue.executor.shutdown()
+    assert queue.get("job0") is None and queue.get("job1") is None
+    assert queue.get("job2") is jobs[2]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["job2.csv"]
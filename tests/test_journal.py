@@ -0,0 +1,30 @@
+from journal import JobJournal, job_id_for
+
+
+def item(number, coa_account):
+    return {"account_number": number, "coa_account": coa_account}
+
+
+def test_resume_after_a_write_cut_by_a_crash(tmp_path):
+    journal = JobJournal(str(tmp_path), job_id_for(b"accounts", "model", "coa-hash"))
+    journal.record_start(4)
+    journal.record_batch("BS", ["401,Suppliers,BS"], [item("401", "401")])
+    # The process died in the middle of the next record
+    with open(journal.path, "ab") as f:
+        f.write(b'{"event": "batch", "type": "BS", "lines": ["512,Ba')
+
+    resumed = JobJournal(str(tmp_path), journal.job_id)
+    lines, items = resumed.load()
+    assert lines == {"BS": ["401,Suppliers,BS"]}
+    assert items == {"BS": [item("401", "401")]}
+    progress = resumed.progress()
+    assert (progress["total"], progress["done"], progress["finished"]) == (4, 1, False)
+
+    # The next run appends after the truncated line instead of corrupting its first record
+    resumed.record_batch("BS", ["512,Bank,BS"], [item("512", "512")])
+    resumed.record_batch("P&L", ["607,Purchases,P&L"], [item("607", "607")])
+    resumed.record_done([])
+    lines, _ = resumed.load()
+    assert lines == {"BS": ["401,Suppliers,BS", "512,Bank,BS"], "P&L": ["607,Purchases,P&L"]}
+    progress = resumed.progress()
+    assert (progress["done"], progress["finished"]) == (3, True)
@@ -0,0 +1,18 @@
+from preclassify import PreClassifier
+from retrieval import CoaIndex
+
+
+def test_fuzzy_matching_in_chunks_matches_a_single_pass():
+    names = ["Trade receivables", "Trade payables", "Bank", "Share capital", "Retained earnings", "Inventories"]
+    accounts = ["411", "401", "512", "101", "106", "31"]
+    labels = ["Trade receivable", "Trade payable", "Banks", "Share capitals", "Retained earning", "Inventory", "Misc"]
+    fields = [(str(number), labels[number % len(labels)], "BS") for number in range(50)]
+
+    def classify(chunk_size):
+        classifier = PreClassifier(accounts, names, CoaIndex(names), "BS", fuzzy_threshold=0.7, chunk_size=chunk_size)
+        items, residue, stats = classifier.classify(fields)
+        return [(item["account_number"], item["coa_account"]) for item in items], residue, stats["rule:fuzzy"]
+
+    single_pass = classify(len(fields))
+    assert single_pass[2] > 0
+    assert classify(3) == single_pass
@@ -0,0 +1,44 @@
+import pytest
+
+from scheduler import BatchScheduler, retry_with_backoff
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = []
+
+    def acquire(self, tokens):
+        self.acquired.append(tokens)
+
+
+def test_every_retry_is_taken_from_the_rate_limiter():
+    limiter = CountingLimiter()
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError
+        return "ok"
+
+    def request():
+        return retry_with_backoff(flaky, (TimeoutError,), base_delay=0, before_retry=lambda: limiter.acquire(100))
+
+    scheduler = BatchScheduler(1, limiter)
+    try:
+        assert scheduler.submit(request, tokens=100).result() == "ok"
+    finally:
+        scheduler.shutdown()
+    # The first call by the scheduler, then one per retry
+    assert limiter.acquired == [100, 100, 100]
+
+
+def test_retries_stop_after_max_retries():
+    retries = []
+
+    def failing():
+        raise TimeoutError
+
+    with pytest.raises(TimeoutError):
+        retry_with_backoff(failing, (TimeoutError,), max_retries=2, base_delay=0, before_retry=lambda: retries.append(1))
+    assert len(retries) == 2
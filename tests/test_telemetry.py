@@ -0,0 +1,39 @@
+import threading
+
+from telemetry import Telemetry
+
+
+class BlockingSink:
+    """Sink whose first send waits for `release`, so the queue fills up behind it."""
+    def __init__(self):
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        self.series = []
+
+    def send(self, series, spans):
+        self.sending.set()
+        self.release.wait(5)
+        self.series.extend(series)
+
+
+def test_points_recorded_while_the_queue_is_full_are_dropped_and_counted():
+    sink = BlockingSink()
+    telemetry = Telemetry(sink, flush_interval=60, max_queue=5)
+    try:
+        telemetry.increment("transco.test.first")
+        telemetry.flush(timeout=0)
+        assert sink.sending.wait(5)
+        # The flush thread is busy in the sink: 5 points fit in the queue, the others are dropped
+        for _ in range(8):
+            telemetry.increment("transco.test.points")
+        assert telemetry.dropped == 3
+        sink.release.set()
+        telemetry.flush()
+    finally:
+        sink.release.set()
+        telemetry.close()
+    totals = {}
+    for record in sink.series:
+        totals[record["metric"]] = totals.get(record["metric"], 0) + record["points"][0][1]
+    assert totals == {"transco.test.first": 1, "transco.test.points": 5, "transco.telemetry.dropped": 3}
+    assert telemetry.dropped == 0
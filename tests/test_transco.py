@@ -0,0 +1,150 @@
+from transco import match_answers
+
+
+def answer(number, label, coa_account):
+    return {"account_number": number, "label": label, "coa_account": coa_account, "coa_label": "", "justification": ""}
+
+
+def test_match_answers_repeated_number_answered_out_of_order():
+    lines = ["401000,Suppliers Entity A,BS", "401000,Customer deposits,BS"]
+    answers = [answer("401000", "Customer deposits", "419"), answer("401000", "Suppliers Entity A", "401")]
+    resolved, missing = match_answers(lines, answers)
+    assert missing == []
+    assert sorted((index, item["coa_account"]) for index, item in resolved) == [(0, "401"), (1, "419")]
+
+
+def test_match_answers_falls_back_on_the_number_when_the_label_differs():
+    lines = ["401000,Suppliers Entity A,BS", "401000,Customer deposits,BS"]
+    answers = [answer("401000", "Suppliers (entity A)", "401"), answer("401000", "customer  DEPOSITS", "419")]
+    resolved, missing = match_answers(lines, answers)
+    assert missing == []
+    assert sorted((index, item["coa_account"]) for index, item in resolved) == [(0, "401"), (1, "419")]
+    assert all(item["account_number"] == "401000" for _, item in resolved)
+
+
+def test_match_answers_reports_omitted_lines():
+    lines = ["401000,Suppliers,BS", "512000,Bank,BS"]
+    resolved, missing = match_answers(lines, [answer("512000", "Bank", "512")])
+    assert [index for index, _ in resolved] == [1]
+    assert missing == [0]
+
+
+def test_store_in_cache_keys_repeated_numbers_on_their_own_label(tmp_path, monkeypatch):
+    import transco
+    from cache import MappingCache
+
+    cache = MappingCache(str(tmp_path / "mappings.sqlite"))
+    monkeypatch.setattr(transco, "cache_enabled", True)
+    monkeypatch.setattr(transco, "get_mapping_cache", lambda: cache)
+    chart = transco.Chart({}, {}, "coa-hash")
+    lines = ["401000,Suppliers Entity A,BS", "401000,Customer deposits,BS"]
+    items = [answer("401000", "Suppliers Entity A", "401"), answer("401000", "Customer deposits", "419")]
+    transco.store_in_cache(items, lines, "BS", "model", chart)
+    for label, coa_account in (("Suppliers Entity A", "401"), ("Customer deposits", "419")):
+        key = MappingCache.make_key(label, "BS", "model", "coa-hash")
+        assert cache.get_many([key])[key]["coa_account"] == coa_account
+
+
+def test_large_fixed_prompt_part_keeps_room_for_the_accounts(monkeypatch):
+    import transco
+
+    transco.prompt_token_budget.cache_clear()
+    monkeypatch.setattr(transco, "max_prompt_tokens", 12000)
+    # e.g. the whole COA of a 1,500-account chart in the 'prefix_cache' layout
+    fixed_tokens = 20000
+    budget = transco.prompt_token_budget("gpt-4o", fixed_tokens, 16000)
+    assert budget == fixed_tokens + 3000
+    lines = [f"{number},Account {number},BS" for number in range(200)]
+    batches = list(transco.pack_batches(lines, [10] * len(lines), fixed_tokens, 50, budget, 16000))
+    assert [len(batch) for batch, _ in batches] == [50, 50, 50, 50]
+
+
+def test_prompt_token_budget_is_unchanged_for_small_fixed_parts(monkeypatch):
+    import transco
+
+    transco.prompt_token_budget.cache_clear()
+    monkeypatch.setattr(transco, "max_prompt_tokens", 12000)
+    assert transco.prompt_token_budget("gpt-4o", 3000, 16000) == 12000
+    # Beyond the context window, every request carries a single account
+    assert transco.prompt_token_budget("gpt-4o", 120000, 16000) == 120000
+
+
+def test_validate_answers_reasks_a_label_naming_another_account():
+    import transco
+
+    chart = transco.Chart({}, {}, "coa-hash", accounts={"BS": {
+        "512": ("512", {"bank": "Bank"}),
+        "106": ("106", {"retained earnings": "Retained Earnings"}),
+    }})
+    resolved = [
+        (0, answer("512000", "Bank account", "512")),
+        (1, answer("512100", "Cash at bank", "512")),
+        (2, answer("512200", "Bank deposits", "512")),
+    ]
+    resolved[0][1]["coa_label"] = "Retained Earnings"
+    resolved[1][1]["coa_label"] = "bank"
+    resolved[2][1]["coa_label"] = "Banks and financial institutions"
+    valid, invalid = transco.validate_answers(resolved, "BS", chart)
+    assert [(index, reason) for index, _, reason in invalid] == [(0, "label mismatch")]
+    # The label is always the chart's name of the account
+    assert [(index, item["coa_label"]) for index, item in valid] == [(1, "Bank"), (2, "Bank")]
+
+
+def test_prompts_name_the_target_chart(offline_engine, monkeypatch):
+    chart = offline_engine.Chart({"BS": ["101 - Share capital - BS"]}, {}, "ifrs-hash", name="IFRS")
+    monkeypatch.setattr(offline_engine, "retrieval_k_per_line", 0)
+    for layout in ("retrieval", "prefix_cache"):
+        monkeypatch.setattr(offline_engine, "prompt_layout", layout)
+        prompt = offline_engine.build_prompt(offline_engine.base_prompt, ["1010,Capital,BS"], "BS", chart)
+        assert "PCG" not in prompt
+        assert "an appropriate IFRS account" in prompt
+        assert "Existing accounts in IFRS :\n101 - Share capital - BS" in prompt
+    pcg = offline_engine.Chart({"BS": []}, {}, "pcg-hash", name="PCG")
+    assert "French PCG (Plan Comptable Général) account" in offline_engine.chart_instructions(offline_engine.base_prompt, pcg)
+
+
+def test_validate_answers_keeps_the_closest_name_of_a_multi_name_account():
+    import transco
+
+    names = ["Common shares", "Member Contributions", "Partners Capital", "Preferred Stock", "Treasury shares"]
+    chart = transco.Chart({}, {}, "coa-hash", accounts={"BS": {
+        "101": ("101", {transco.normalize_label(name): name for name in names}),
+    }})
+    resolved = [
+        (0, answer("1010", "Preferred shares", "101")),
+        (1, answer("1020", "Partners capital account", "101")),
+        (2, answer("1030", "Equity", "101")),
+    ]
+    resolved[0][1]["coa_label"] = "Preferred stocks"
+    resolved[1][1]["coa_label"] = "Partner's capital"
+    resolved[2][1]["coa_label"] = "Equity"
+    valid, invalid = transco.validate_answers(resolved, "BS", chart)
+    assert invalid == []
+    assert [item["coa_label"] for _, item in valid] == ["Preferred Stock", "Partners Capital", "Equity"]
+
+
+def test_pack_batches_closes_a_batch_at_the_token_budget():
+    from transco import pack_batches
+
+    lines = [f"{number},Account {number},BS" for number in range(10)]
+    # 8 tokens + 2 separator tokens per line: 3 lines fit in the 30 tokens left by the fixed part
+    batches = list(pack_batches(lines, [8] * 10, 70, 50, 100, 16000))
+    assert [len(batch) for batch, _ in batches] == [3, 3, 3, 1]
+    assert [used for _, used in batches] == [30, 30, 30, 10]
+    assert [line for batch, _ in batches for line in batch] == lines
+
+
+def test_pack_batches_keeps_the_answer_within_the_completion_limit():
+    from transco import output_tokens_per_account, pack_batches
+
+    lines = [f"{number},Account {number},BS" for number in range(10)]
+    batches = list(pack_batches(lines, [1] * 10, 0, 50, 100000, 4 * output_tokens_per_account))
+    assert [len(batch) for batch, _ in batches] == [4, 4, 2]
+
+
+def test_pack_batches_gives_an_oversized_line_its_own_batch():
+    from transco import pack_batches
+
+    lines = ["1,Short,BS", "2,Very long label,BS", "3,Short,BS"]
+    batches = list(pack_batches(lines, [5, 500, 5], 50, 50, 100, 16000))
+    assert [batch for batch, _ in batches] == [["1,Short,BS"], ["2,Very long label,BS"], ["3,Short,BS"]]
@@ -0,0 +1,1614 @@
+"""
+TranscoGPT mapping engine, usable without Streamlit.
+
+Importing this module has no side effect: the COA, the tokenizer and the OpenAI/Datadog
+clients are only loaded on first use. The Streamlit interface (app.py) and the command line
+(`python -m transco --help`) are both thin layers over the functions below.
+"""
+import argparse
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from scheduler import BatchScheduler, RateLimiter, retry_with_backoff
+from cache import MappingCache, file_hash, normalize_label
+from charts import Chart, ChartRegistry
+from batch_sizing import BatchSizeController
+from profiling import null_profiler
+from journal import JobJournal, job_id_for
+
+
+# Set the OpenAI model name (ensure the model is supported by your OpenAI subscription)
+model = "gpt-4o-2024-11-20"
+
+# Concurrency and rate-limit budgets for the GPT calls (override through environment variables)
+max_concurrent_requests = int(os.environ.get("TRANSCO_MAX_CONCURRENT_REQUESTS", 8))
+requests_per_minute = int(os.environ.get("TRANSCO_REQUESTS_PER_MINUTE", 500))
+tokens_per_minute = int(os.environ.get("TRANSCO_TOKENS_PER_MINUTE", 800000))
+# Expected completion size per account, used to budget tokens before the call
+output_tokens_per_account = 120
+# Retry policy: backoff retries of one request on transient errors, and batches an account may be sent in
+request_timeout = int(os.environ.get("TRANSCO_REQUEST_TIMEOUT", 120))
+max_transient_retries = int(os.environ.get("TRANSCO_MAX_TRANSIENT_RETRIES", 5))
+max_attempts_per_account = int(os.environ.get("TRANSCO_MAX_ATTEMPTS", 3))
+# Background jobs (app uploads) running at the same time; they share the scheduler above
+max_running_jobs = int(os.environ.get("TRANSCO_MAX_RUNNING_JOBS", 4))
+# Batch packing limits: accounts and input tokens per request
+max_accounts_per_batch = int(os.environ.get("TRANSCO_MAX_ACCOUNTS_PER_BATCH", 50))
+max_prompt_tokens = int(os.environ.get("TRANSCO_MAX_PROMPT_TOKENS", 12000))
+# Answers naming a COA account that does not exist for the type are asked again in small batches,
+# with the TRANSCO_REASK_K closest COA accounts of each label as the only candidates
+reask_batch_size = int(os.environ.get("TRANSCO_REASK_BATCH_SIZE", 10))
+reask_k_per_line = int(os.environ.get("TRANSCO_REASK_K", 8))
+# Adaptive batch size (see batch_sizing.py): starts at max_accounts_per_batch and moves within these bounds
+adaptive_batch_size = os.environ.get("TRANSCO_ADAPTIVE_BATCH_SIZE", "1") != "0"
+min_adaptive_batch_size = int(os.environ.get("TRANSCO_MIN_ACCOUNTS_PER_BATCH", 5))
+max_adaptive_batch_size = int(os.environ.get("TRANSCO_MAX_ADAPTIVE_ACCOUNTS_PER_BATCH", 100))
+
+# Define paths to data files relative to the current script’s directory
+base_dir = os.path.dirname(os.path.abspath(__file__))
+coa_file_path = os.path.join(base_dir, 'data', 'COA_simplifié_TC2.xlsx')
+# Other charts of accounts (IFRS, client charts...): every Excel file of this folder, named after the file
+charts_dir = os.environ.get("TRANSCO_CHARTS_DIR", os.path.join(base_dir, 'data', 'charts'))
+default_chart = os.environ.get("TRANSCO_DEFAULT_CHART", "PCG")
+# Compiled charts (see charts.py)
+chart_artifact_dir = os.environ.get("TRANSCO_CHART_ARTIFACT_DIR", os.path.join(base_dir, '.cache', 'charts'))
+
+# Persistent cache of previous mappings (override through environment variables)
+cache_enabled = os.environ.get("TRANSCO_CACHE_ENABLED", "1") != "0"
+cache_path = os.environ.get("TRANSCO_CACHE_PATH", os.path.join(base_dir, '.cache', 'mappings.sqlite'))
+cache_ttl_days = float(os.environ.get("TRANSCO_CACHE_TTL_DAYS", 30))
+cache_max_entries = int(os.environ.get("TRANSCO_CACHE_MAX_ENTRIES", 200000))
+
+# Folder of the job journals used to resume interrupted jobs
+journal_dir = os.environ.get("TRANSCO_JOURNAL_DIR", os.path.join(base_dir, '.cache', 'jobs'))
+# Folder of the output files written by the interface
+output_dir = os.environ.get("TRANSCO_OUTPUT_DIR", os.path.join(base_dir, '.cache', 'outputs'))
+
+# Local COA retrieval: number of candidates kept per account line and per batch (0 sends the whole COA).
+# Off by default: on the labelled sample, no setting keeps the expected account in every BS prompt
+# (see benchmarks/retrieval.py), and a missing account cannot be chosen by GPT.
+retrieval_k_per_line = int(os.environ.get("TRANSCO_RETRIEVAL_K", 0))
+retrieval_max_candidates = int(os.environ.get("TRANSCO_RETRIEVAL_MAX_CANDIDATES", 80))
+
+# Prompt layout: 'retrieval' lists only the COA accounts retrieved for each batch, 'prefix_cache' sends the
+# whole COA in a byte-stable prefix (accounts last) so the provider can reuse its cached prefix across batches.
+# Without retrieval both send the whole COA, so the default is the layout that can be cached.
+prompt_layout = os.environ.get("TRANSCO_PROMPT_LAYOUT", "retrieval" if retrieval_k_per_line > 0 else "prefix_cache")
+# Smallest prompt prefix the provider caches, and the granularity of the cached part
+prompt_cache_min_tokens = 1024
+prompt_cache_increment = 128
+
+# Local pre-classification before GPT: account number rule table and minimum fuzzy similarity (1 disables fuzzy matching)
+preclassifier_enabled = os.environ.get("TRANSCO_PRECLASSIFIER", "1") != "0"
+rules_file_path = os.environ.get("TRANSCO_RULES_PATH", os.path.join(base_dir, 'data', 'preclassification_rules.csv'))
+fuzzy_threshold = float(os.environ.get("TRANSCO_FUZZY_THRESHOLD", 0.9))
+fuzzy_margin = float(os.environ.get("TRANSCO_FUZZY_MARGIN", 0.05))
+
+# OpenAI Batch API mode: price ratio compared with synchronous calls, and seconds between two status checks
+batch_api_discount = 0.5
+batch_poll_interval = int(os.environ.get("TRANSCO_BATCH_POLL_INTERVAL", 30))
+
+# API keys, set through configure() or read from the environment on first use
+openai_api_key = os.environ.get("OPENAI_API_KEY")
+datadog_api_key = os.environ.get("DATADOG_API_KEY")
+
+# Telemetry: sink ('auto', 'datadog', 'local' or 'none'), flush period in seconds and buffer size
+telemetry_sink = os.environ.get("TRANSCO_TELEMETRY_SINK", "auto")
+telemetry_path = os.environ.get("TRANSCO_TELEMETRY_PATH")
+telemetry_flush_interval = float(os.environ.get("TRANSCO_TELEMETRY_FLUSH_INTERVAL", 10))
+telemetry_max_queue = int(os.environ.get("TRANSCO_TELEMETRY_MAX_QUEUE", 10000))
+
+
+def configure(openai_key=None, datadog_key=None):
+    """
+    Set the API keys used by the engine (the Streamlit app passes its secrets here).
+    Clients already created are rebuilt on next use.
+    """
+    global openai_api_key, datadog_api_key
+    if openai_key is not None and openai_key != openai_api_key:
+        openai_api_key = openai_key
+        get_openai.cache_clear()
+    if datadog_key is not None and datadog_key != datadog_api_key:
+        datadog_api_key = datadog_key
+        if get_telemetry.cache_info().currsize:
+            get_telemetry().close()
+        get_telemetry.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def get_telemetry():
+    """
+    Return the process-wide buffered telemetry pipeline (see telemetry.py).
+    The sink is chosen by `telemetry_sink`: 'datadog', 'local' (JSONL file at `telemetry_path`
+    if set, memory otherwise), 'none', or 'auto' (Datadog when an API key is configured).
+    """
+    from telemetry import DatadogSink, LocalSink, NullSink, Telemetry
+
+    sink = NullSink()
+    if telemetry_sink == "local":
+        sink = LocalSink(telemetry_path)
+    elif telemetry_sink in ("datadog", "auto") and datadog_api_key:
+        try:
+            sink = DatadogSink(datadog_api_key)
+        except Exception as e:
+            print(f"Erreur d'initialisation Datadog: {str(e)}")
+    return Telemetry(sink, flush_interval=telemetry_flush_interval, max_queue=telemetry_max_queue)
+
+@functools.lru_cache(maxsize=None)
+def get_openai():
+    """Return the openai module configured with the API key, imported on first use."""
+    import openai
+    if openai_api_key:
+        openai.api_key = openai_api_key
+    return openai
+
+def get_transient_errors():
+    """OpenAI errors worth retrying the same request for."""
+    openai = get_openai()
+    return (
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name):
+    """Return the tiktoken encoding for a model, loaded once per process."""
+    import tiktoken
+    return tiktoken.encoding_for_model(model_name)
+
+@functools.lru_cache(maxsize=None)
+def get_scheduler():
+    """
+    Return the process-wide BatchScheduler shared by the BS and P&L passes (and by every
+    Streamlit session and rerun), so the requests/tokens per minute budgets are enforced globally.
+    """
+    return BatchScheduler(
+        max_concurrent_requests,
+        RateLimiter(requests_per_minute, tokens_per_minute)
+    )
+
+@functools.lru_cache(maxsize=None)
+def get_job_queue():
+    """Return the process-wide background job queue shared by every Streamlit session."""
+    from jobqueue import JobQueue
+
+    def on_finished(queued):
+        telemetry = get_telemetry()
+        tags = [f'model:{queued.job.model}', f'chart:{queued.job.chart.name}', f'status:{queued.status}']
+        telemetry.histogram('transco.job.duration', queued.finished_at - queued.started_at, tags)
+        telemetry.histogram('transco.job.queue_wait', queued.started_at - queued.submitted_at, tags)
+        telemetry.histogram('transco.job.cost', queued.job.spent_cost(), tags)
+        if queued.report is not None:
+            queued.profiler.send(telemetry, {"model": queued.job.model, "chart": queued.job.chart.name})
+
+    return JobQueue(max_running_jobs, on_finished=on_finished)
+
+@functools.lru_cache(maxsize=None)
+def get_batch_size_controller(model_name, type_compte):
+    """Return the process-wide batch size controller of a model and account type."""
+    tags = [f'model:{model_name}', f'type:{type_compte}']
+
+    def on_decision(decision):
+        telemetry = get_telemetry()
+        telemetry.histogram('transco.batch_size', decision['size'], tags)
+        telemetry.histogram('transco.batch_size.throughput', decision['throughput'], tags)
+        telemetry.histogram('transco.batch_size.omission_rate', decision['omission_rate'], tags)
+        telemetry.increment('transco.batch_size.decisions', 1, tags + [f"reason:{decision['reason']}"])
+        if decision['size'] != decision['previous_size']:
+            print(
+                f"Batch size {model_name} {type_compte}: {decision['previous_size']} -> {decision['size']} "
+                f"({decision['reason']}, {decision['throughput']:.1f} accounts/s, "
+                f"{decision['omission_rate']:.0%} omitted, {decision['failure_rate']:.0%} failed)"
+            )
+
+    return BatchSizeController(
+        max_accounts_per_batch, min_adaptive_batch_size, max_adaptive_batch_size, on_decision=on_decision
+    )
+
+def batch_size_for(model_name, type_compte):
+    """Current maximum number of accounts per request for a model and account type."""
+    if not adaptive_batch_size:
+        return max_accounts_per_batch
+    return get_batch_size_controller(model_name, type_compte).size
+
+@functools.lru_cache(maxsize=None)
+def get_mapping_cache():
+    """Return the process-wide persistent mapping cache."""
+    return MappingCache(cache_path, ttl_seconds=cache_ttl_days * 24 * 3600, max_entries=cache_max_entries)
+
+
+def clean_text(text):
+    """
+    Normalize the account type textual values into a standardized format.
+    - Convert non-string values to string.
+    - Convert the text to lowercase.
+    - If the text starts with 'b', classify as 'BS'.
+    - If the text starts with 'p', classify as 'P&L'.
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    text_cleaned = text.lower()
+    if text_cleaned.startswith('b'):
+        text_cleaned = 'BS'
+    elif text_cleaned.startswith('p'):
+        text_cleaned = 'P&L'
+    return text_cleaned
+
+
+def load_chart(path, name=None):
+    """Read a COA Excel file and compile its prompt lists, token counts, retrieval indexes and pre-classifiers."""
+    import pandas as pd
+    from ingest import type_prefixes
+    from preclassify import PreClassifier, load_rules
+    from retrieval import CoaIndex
+
+    # Load the COA (Chart of Accounts) file into a DataFrame
+    coa = pd.read_excel(path)
+
+    # Normalize the 'BS / P&L' column like clean_text(), on the whole column at once
+    coa['BS / P&L'] = coa['BS / P&L'].astype(str).str.lower().str[:1].map(type_prefixes)
+
+    lines = {}
+    indexes = {}
+    preclassifiers = {}
+    accounts = {}
+    rules = load_rules(rules_file_path)
+    # Split the COA into one list per account type
+    for acc_type in ('BS', 'P&L'):
+        rows = coa[coa['BS / P&L'] == acc_type]
+        names = rows['Account Name'].astype(str)
+        # Build the local retrieval index on the COA account names (same row order as the prompt list)
+        indexes[acc_type] = CoaIndex(names.tolist())
+        # Convert COA rows into readable strings for the GPT prompt
+        lines[acc_type] = (rows['GL account'].astype(str) + " - " + names + " - " + acc_type).tolist()
+        preclassifiers[acc_type] = PreClassifier(
+            rows['GL account'].tolist(), names.tolist(), indexes[acc_type], acc_type, rules, fuzzy_threshold, fuzzy_margin
+        )
+        # Hash index of the GL accounts of the type (a GL account may have several names)
+        accounts[acc_type] = {}
+        for account, account_name in zip(rows['GL account'].astype(str).tolist(), names.tolist()):
+            entry = accounts[acc_type].setdefault(coa_key(account), (account, {}))
+            entry[1].setdefault(normalize_label(account_name), account_name)
+    chart = Chart(
+        lines, indexes, file_hash(path), preclassifiers, name or os.path.splitext(os.path.basename(path))[0], accounts
+    )
+    # Count the tokens of the COA lines once for the default model, they are part of the artifact
+    try:
+        for acc_type in lines:
+            coa_line_tokens(chart, acc_type, model)
+    except Exception as e:
+        print(f"Error counting the tokens of the chart of accounts: {e}")
+    return chart
+
+def chart_sources():
+    """The available charts of accounts: {name: Excel file}, the default chart first."""
+    sources = {default_chart: coa_file_path}
+    if os.path.isdir(charts_dir):
+        for file_name in sorted(os.listdir(charts_dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension.lower() in ('.xlsx', '.xlsm') and not file_name.startswith('~$'):
+                sources[name] = os.path.join(charts_dir, file_name)
+    return sources
+
+@functools.lru_cache(maxsize=None)
+def get_chart_registry():
+    """Return the process-wide registry of the compiled charts of accounts."""
+    return ChartRegistry(
+        chart_sources, load_chart, chart_artifact_dir,
+        dependencies=lambda: (rules_file_path, fuzzy_threshold, fuzzy_margin)
+    )
+
+def get_chart(name=None):
+    """
+    Return a chart of accounts by name (the default chart when None), loaded on first use
+    and reloaded when its source file changes. A Chart given as `name` is returned as is.
+    """
+    if isinstance(name, Chart):
+        return name
+    return get_chart_registry().get(name or default_chart)
+
+def coa_line_tokens(chart, type_compte, model):
+    """Token count of every COA line of a type, computed once per chart and model."""
+    key = (model, type_compte)
+    if key not in chart.token_counts:
+        chart.token_counts[key] = tokenize_lines(chart.lines[type_compte], model)
+    return chart.token_counts[key]
+
+
+# How the instructions name a chart; other charts are named as in the registry
+chart_descriptions = {"PCG": "French PCG (Plan Comptable Général)"}
+
+def chart_instructions(base_prompt, chart):
+    """The instructions `base_prompt` with the {chart} placeholder replaced by the name of the target chart."""
+    return base_prompt.replace("{chart}", chart_descriptions.get(chart.name, chart.name or default_chart))
+
+def coa_header(chart):
+    """First line of the COA section of a prompt, naming the target chart."""
+    return f"Existing accounts in {chart.name or default_chart} :\n"
+
+def coa_section_for_batch(batch_lines, type_compte, chart=None):
+    """
+    Build the "Existing accounts in <chart>" section of a prompt.
+    With retrieval enabled (TRANSCO_RETRIEVAL_K > 0), only the COA accounts retrieved locally for
+    the labels of `batch_lines` are listed, so the prompt size no longer grows with the size of
+    the chart of accounts; otherwise the whole COA of the type is listed.
+    - chart: Chart or chart name (default chart when None).
+    """
+    chart = get_chart(chart)
+    coa_lines = chart.lines[type_compte]
+    if retrieval_k_per_line > 0:
+        labels = [split_line(line)[1] for line in batch_lines]
+        rows = chart.indexes[type_compte].select_for_batch(labels, retrieval_k_per_line, retrieval_max_candidates)
+        coa_lines = [coa_lines[row] for row in rows]
+    return coa_header(chart) + "\n".join(coa_lines)
+
+# Prices per model, in USD per 1000 tokens: (input, output, cached input)
+model_prices = {
+    "gpt-4o": (0.00250, 0.01, 0.00125),
+    "gpt-4o-2024-11-20": (0.00250, 0.01, 0.00125),
+    "gpt-4o-2024-08-06": (0.00250, 0.01, 0.00125),
+    "gpt-4o-mini": (0.00015, 0.0006, 0.000075),
+    "gpt-4.1": (0.00200, 0.008, 0.0005),
+    "gpt-4.1-mini": (0.00040, 0.0016, 0.0001),
+}
+
+# Context window of the models, in tokens (prompt and completion)
+model_context_tokens = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.1-mini": 1047576,
+}
+
+# Prompt and cached tokens reported by the API, per (model, type, layout): used to estimate the cache hit rate
+_usage_lock = threading.Lock()
+_prompt_cache_usage = {}
+
+def record_prompt_cache_usage(model_name, type_compte, prompt_tokens, cached_tokens):
+    """Accumulate the prompt and cached token counts returned by a GPT call."""
+    with _usage_lock:
+        usage = _prompt_cache_usage.setdefault((model_name, type_compte, prompt_layout), [0, 0])
+        usage[0] += prompt_tokens
+        usage[1] += cached_tokens
+
+def observed_cache_ratio(model_name, type_compte):
+    """Share of the prompt tokens served from the provider cache so far (None before any call)."""
+    with _usage_lock:
+        prompt_tokens, cached_tokens = _prompt_cache_usage.get((model_name, type_compte, prompt_layout), (0, 0))
+    return cached_tokens / prompt_tokens if prompt_tokens else None
+
+def get_model_prices(model_name):
+    """
+    Return the (input, output, cached input) prices per 1000 tokens of a model.
+    Dated snapshots without their own entry fall back on the longest matching model prefix.
+    """
+    if model_name in model_prices:
+        return model_prices[model_name]
+    prefixes = [name for name in model_prices if model_name.startswith(name)]
+    if not prefixes:
+        raise KeyError(f"No price defined for model '{model_name}'")
+    return model_prices[max(prefixes, key=len)]
+
+def get_model_context_tokens(model_name):
+    """Context window of a model, matched on the longest model prefix (128k tokens when unknown)."""
+    prefixes = [name for name in model_context_tokens if model_name.startswith(name)]
+    return model_context_tokens[max(prefixes, key=len)] if prefixes else 128000
+
+def usage_cost(model_name, prompt_tokens, cached_tokens, completion_tokens):
+    """Cost in dollars of tokens actually consumed (cached prompt tokens at the cached price)."""
+    input_price, output_price, cached_price = get_model_prices(model_name)
+    return (
+        (prompt_tokens - cached_tokens) / 1000 * input_price + cached_tokens / 1000 * cached_price
+        + completion_tokens / 1000 * output_price
+    )
+
+def estimate_prompt_cost(base_prompt, lines, model, acc_type, max_tokens=16000, line_tokens=None, chart=None):
+    """
+    Estimate the cost of processing a set of lines through the GPT model, without building any prompt.
+    - base_prompt: The common introductory prompt text.
+    - lines: The accounts data lines to process.
+    - model: The GPT model name.
+    - acc_type: The type of accounts being processed ('BS' or 'P&L').
+    - max_tokens: The maximum number of completion tokens allowed per request.
+    - line_tokens: Token counts of `lines` if already computed.
+    - chart: Chart or chart name (default chart when None).
+
+    The lines are tokenized in bulk once and packed with the dispatcher's own batch plan.
+    Every request costs the cached fixed part (instructions, schema, COA section upper bound)
+    plus its account lines, so the input tokens are summed in closed form.
+    The input tokens expected to be served from the provider prompt cache are billed at the
+    cached price: the share observed on previous calls when there is one, otherwise, in the
+    'prefix_cache' layout, the static prefix of every request after the first.
+
+    Returns:
+        A dict with the number of requests, the input/output/cached token counts and their costs.
+    """
+    chart = get_chart(chart)
+    if line_tokens is None:
+        line_tokens = tokenize_lines(lines, model)
+    fixed_tokens = fixed_prompt_tokens(base_prompt, acc_type, model, chart)
+    plan = plan_batches(base_prompt, lines, model, acc_type, max_tokens, line_tokens, chart)
+    input_tokens = len(plan) * fixed_tokens + sum(batch_tokens for _, batch_tokens in plan)
+    output_tokens = len(lines) * output_tokens_per_account
+    ratio = observed_cache_ratio(model, acc_type)
+    if ratio is not None:
+        cached_tokens = int(input_tokens * ratio)
+    else:
+        cached_tokens = max(0, len(plan) - 1) * cacheable_prefix_tokens(base_prompt, acc_type, model, chart)
+    input_price, output_price, cached_price = get_model_prices(model)
+    input_cost = ((input_tokens - cached_tokens) / 1000) * input_price + (cached_tokens / 1000) * cached_price
+    output_cost = (output_tokens / 1000) * output_price
+    return {
+        "requests": len(plan),
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_tokens,
+        "output_tokens": output_tokens,
+        "input_cost": input_cost,
+        "output_cost": output_cost,
+        "total_cost": input_cost + output_cost
+    }
+
+# Closing instruction appended after the COA section of every prompt
+closing_prompt = "Please provide the corresponding COA account for all the americain accounts above\n"
+# Same instruction in the 'prefix_cache' layout, where the accounts come after it
+prefix_closing_prompt = "Please provide the corresponding COA account for all the americain accounts below\n"
+
+def static_prompt_prefix(base_prompt, type_compte, chart=None):
+    """
+    Byte-stable start of every prompt of a type in the 'prefix_cache' layout:
+    instructions, the whole COA of the type and the closing instruction.
+    """
+    return _static_prompt_prefix(base_prompt, type_compte, get_chart(chart))
+
+@functools.lru_cache(maxsize=64)
+def _static_prompt_prefix(base_prompt, type_compte, chart):
+    return (
+        chart_instructions(base_prompt, chart)
+        + "\n" + coa_header(chart) + "\n".join(chart.lines[type_compte]) + "\n"
+        + prefix_closing_prompt
+    )
+
+def build_prompt(base_prompt, batch_lines, type_compte, chart=None):
+    """
+    Assemble the user prompt of one batch: instructions, account lines, COA section and closing instruction.
+    In the 'prefix_cache' layout the static prefix comes first and the account lines last.
+    - chart: Chart or chart name (default chart when None).
+    """
+    if prompt_layout == "prefix_cache":
+        parts = [static_prompt_prefix(base_prompt, type_compte, chart)]
+        for line in batch_lines:
+            parts.append("\n" + line + "\n ")
+        return "".join(parts)
+    chart = get_chart(chart)
+    parts = [chart_instructions(base_prompt, chart)]
+    for line in batch_lines:
+        parts.append("\n" + line + "\n ")
+    parts.append("\n" + coa_section_for_batch(batch_lines, type_compte, chart) + "\n")
+    parts.append(closing_prompt)
+    return "".join(parts)
+
+def tokenize_lines(lines, model):
+    """Return the token count of every account line, encoded in bulk."""
+    return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(lines)]
+
+def fixed_prompt_tokens(base_prompt, type_compte, model, chart=None):
+    """
+    Upper bound of the tokens spent in a prompt outside of the account lines:
+    system message, instructions, closing instruction and the largest possible COA section.
+    """
+    return _fixed_prompt_tokens(base_prompt, type_compte, model, prompt_layout, get_chart(chart))
+
+def cacheable_prefix_tokens(base_prompt, type_compte, model, chart=None):
+    """
+    Tokens of every request the provider can serve from its prompt cache once warm:
+    the system message and static prefix of the 'prefix_cache' layout, rounded down to the
+    cache granularity (0 in the 'retrieval' layout or below the minimum cached prefix).
+    """
+    if prompt_layout != "prefix_cache":
+        return 0
+    tokens = _fixed_prompt_tokens(base_prompt, type_compte, model, prompt_layout, get_chart(chart))
+    if tokens < prompt_cache_min_tokens:
+        return 0
+    return tokens - tokens % prompt_cache_increment
+
+@functools.lru_cache(maxsize=256)
+def _fixed_prompt_tokens(base_prompt, type_compte, model, layout, chart):
+    encoding = get_encoding(model)
+    if layout == "prefix_cache":
+        return len(encoding.encode(system_prompt)) + len(encoding.encode(_static_prompt_prefix(base_prompt, type_compte, chart))) + 16
+    # Each COA line is followed by a newline
+    section_tokens = sorted((tokens + 1 for tokens in coa_line_tokens(chart, type_compte, model)), reverse=True)
+    if retrieval_k_per_line > 0 and retrieval_max_candidates:
+        section_tokens = section_tokens[:retrieval_max_candidates]
+    return (
+        len(encoding.encode(system_prompt))
+        + len(encoding.encode(chart_instructions(base_prompt, chart)))
+        + len(encoding.encode(coa_header(chart)))
+        + sum(section_tokens)
+        + len(encoding.encode(closing_prompt))
+        # Message framing and separators
+        + 16
+    )
+
+def pack_batches(lines, line_tokens, fixed_tokens, max_accounts, max_prompt_tokens, max_output_tokens):
+    """
+    Split the account lines into batches in a single pass, filling each request up to its budgets.
+    - lines: The account lines, in order.
+    - line_tokens: The pre-computed token count of each line.
+    - fixed_tokens: Tokens spent in every prompt outside of the account lines.
+    - max_accounts: Maximum number of accounts per request.
+    - max_prompt_tokens: Maximum input tokens per request.
+    - max_output_tokens: Completion tokens available per request (max_tokens of the call).
+
+    A batch is closed as soon as the next line would exceed the account cap, the input budget or
+    the expected output size, so the JSON answer always fits in max_tokens and is never truncated.
+    A single line that does not fit on its own still gets its own batch.
+
+    Yields:
+        One (lines, line tokens) pair per request.
+    """
+    # Each line is wrapped in "\n" ... "\n " in the prompt
+    separator_tokens = 2
+    max_accounts = max(1, min(max_accounts, max_output_tokens // output_tokens_per_account))
+    line_budget = max_prompt_tokens - fixed_tokens
+    start = 0
+    used = 0
+    for index, tokens in enumerate(line_tokens):
+        cost = tokens + separator_tokens
+        count = index - start
+        if count and (count >= max_accounts or used + cost > line_budget):
+            yield lines[start:index], used
+            start = index
+            used = 0
+        used += cost
+    if start < len(lines):
+        yield lines[start:], used
+
+@functools.lru_cache(maxsize=256)
+def prompt_token_budget(model_name, fixed_tokens, max_output_tokens):
+    """
+    Input tokens available to one request, account lines included: TRANSCO_MAX_PROMPT_TOKENS,
+    unless the part every prompt repeats (the whole COA in the 'prefix_cache' layout, or without
+    retrieval, on a large chart) leaves the account lines less than a quarter of it. The lines then
+    keep that quarter on top of the fixed part, within the context window of the model, instead of
+    every request falling to a single account. The budget change is reported once.
+    """
+    min_line_tokens = max_prompt_tokens // 4
+    if max_prompt_tokens - fixed_tokens >= min_line_tokens:
+        return max_prompt_tokens
+    line_tokens = min(min_line_tokens, get_model_context_tokens(model_name) - max_output_tokens - fixed_tokens)
+    if line_tokens <= 0:
+        print(
+            f"Error: the fixed part of the prompts ({fixed_tokens} tokens) leaves no room for the accounts "
+            f"in the context window of {model_name}; each request will carry a single account"
+        )
+        return fixed_tokens
+    print(
+        f"The fixed part of the prompts ({fixed_tokens} tokens) exceeds TRANSCO_MAX_PROMPT_TOKENS "
+        f"({max_prompt_tokens}): requests of {model_name} will use up to {fixed_tokens + line_tokens} input tokens"
+    )
+    return fixed_tokens + line_tokens
+
+def plan_batches(base_prompt, lines, model, type_compte, max_tokens=16000, line_tokens=None, chart=None):
+    """
+    Return the batches that will be sent to GPT for `lines`, as (lines, line tokens) pairs.
+    - line_tokens: Token counts of `lines` if already computed.
+    - chart: Chart or chart name (default chart when None).
+    """
+    if line_tokens is None:
+        line_tokens = tokenize_lines(lines, model)
+    fixed_tokens = fixed_prompt_tokens(base_prompt, type_compte, model, chart)
+    return list(pack_batches(
+        lines,
+        line_tokens,
+        fixed_tokens,
+        batch_size_for(model, type_compte),
+        prompt_token_budget(model, fixed_tokens, max_tokens),
+        max_tokens
+    ))
+
+# System message sent with every batch
+system_prompt = "You are an assistant that provides structured JSON responses based on the schema."
+
+# JSON schema enforced on every GPT answer
+response_format = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "account_matching_response",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "final_answer": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "account_number": {"type": "string"},
+                            "label": {"type": "string"},
+                            "coa_account": {"type": "string"},
+                            "coa_label": {"type": "string"},
+                            "justification": {"type": "string"}
+                        },
+                        "required": ["account_number", "label", "coa_account", "coa_label", "justification"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["final_answer"],  # Seul "final_answer" est obligatoire
+            "additionalProperties": False  # Aucun autre champ non spécifié n'est autorisé
+        },
+        "strict": True  # Active un contrôle strict du schéma
+    }
+}
+
+def split_line(line):
+    """
+    Split a prompt line "number,label,type" back into its fields.
+    The label may itself contain commas, so only the first and last separators are used.
+    """
+    number, rest = line.split(',', 1)
+    label, acc_type = rest.rsplit(',', 1)
+    return number.strip(), label.strip(), acc_type.strip()
+
+def preclassify_lines(lines, type_compte, chart=None):
+    """
+    Resolve the trivial lines locally (account number rules, exact and near matches of the
+    COA account names) so that only the ambiguous ones are sent to GPT.
+
+    Returns:
+        items: Mapped accounts, with a "rule" justification and the path that resolved them.
+        remaining_lines: The lines left for GPT.
+        stats: Number of lines resolved per path and time spent (see PreClassifier.classify()).
+    """
+    preclassifier = get_chart(chart).preclassifiers.get(type_compte)
+    if not preclassifier_enabled or preclassifier is None:
+        return [], list(lines), {"lines": len(lines), "seconds": 0.0}
+    items, residue, stats = preclassifier.classify([split_line(line) for line in lines])
+    return items, [lines[position] for position in residue], stats
+
+def lookup_cached_lines(lines, type_compte, model, chart=None):
+    """
+    Serve the lines already mapped in a previous run from the persistent cache.
+    Cached answers failing the COA validation (see validate_answers()) are sent to GPT again.
+
+    Returns:
+        cached_data: Mapped accounts rebuilt from the cache (same format as the GPT answers).
+        missing_lines: The lines that still have to be sent to GPT.
+    """
+    if not cache_enabled:
+        return [], list(lines)
+    mapping_cache = get_mapping_cache()
+    chart = get_chart(chart)
+    fields = [split_line(line) for line in lines]
+    keys = [MappingCache.make_key(label, type_compte, model, chart.hash) for _, label, _ in fields]
+    found = mapping_cache.get_many(keys)
+    candidates = [
+        (position, {"account_number": number, "label": label, **found[key], "resolved_by": "cache"})
+        for position, ((number, label, _), key) in enumerate(zip(fields, keys)) if key in found
+    ]
+    valid, _ = validate_answers(candidates, type_compte, chart)
+    served = {position for position, _ in valid}
+    cached_data = [item for _, item in valid]
+    missing_lines = [line for position, line in enumerate(lines) if position not in served]
+    return cached_data, missing_lines
+
+def store_in_cache(extracted_data, lines, type_compte, model, chart=None):
+    """
+    Save the GPT answers for `lines` in the persistent cache, keyed on the input label.
+    `extracted_data` and `lines` are aligned (one answer per line, same order): an account number
+    can be repeated with different labels, so the label is never looked up by account number.
+    """
+    if not cache_enabled:
+        return
+    coa_hash = get_chart(chart).hash
+    items = []
+    for line, item in zip(lines, extracted_data):
+        _, label, _ = split_line(line)
+        value = {
+            "coa_account": item['coa_account'],
+            "coa_label": item['coa_label'],
+            "justification": item['justification']
+        }
+        items.append((MappingCache.make_key(label, type_compte, model, coa_hash), value))
+    get_mapping_cache().put_many(items)
+
+def without_lines(lines, done_lines):
+    """Return `lines` minus `done_lines`, counting duplicates (multiset difference, order kept)."""
+    done = Counter(done_lines)
+    remaining = []
+    for line in lines:
+        if done[line] > 0:
+            done[line] -= 1
+        else:
+            remaining.append(line)
+    return remaining
+
+def group_duplicate_lines(lines):
+    """
+    Collapse the lines sharing the same normalized label (same account type), such as the
+    "Accrued expenses" account of every subsidiary of a multi-entity upload.
+
+    Returns:
+        representatives: The first line of every group, the only ones sent to GPT.
+        duplicates: Dict {representative: [other lines of its group]} (groups of one are left out).
+    """
+    representatives = {}
+    duplicates = {}
+    for line in lines:
+        key = normalize_label(split_line(line)[1])
+        if key in representatives:
+            duplicates.setdefault(representatives[key], []).append(line)
+        else:
+            representatives[key] = line
+    return list(representatives.values()), duplicates
+
+def fan_out(lines, items, duplicates):
+    """
+    Copy the answers of representative lines to the other lines of their group,
+    with the account number and label of each original line.
+
+    Returns:
+        The lines and their answers, duplicates included (same order in both lists).
+    """
+    all_lines = []
+    all_items = []
+    for line, item in zip(lines, items):
+        all_lines.append(line)
+        all_items.append(item)
+        for duplicate in duplicates.get(line, []):
+            number, label, _ = split_line(duplicate)
+            all_lines.append(duplicate)
+            all_items.append(dict(item, account_number=number, label=label))
+    return all_lines, all_items
+
+def parse_answer(content):
+    """
+    Parse the JSON content of a GPT answer into the list of mapped accounts.
+    Raises ValueError (or json.JSONDecodeError) when the answer does not follow the schema.
+    """
+    parsed_response = json.loads(content)
+
+        # Vérifier si "final_answer" contient une liste ou un seul objet
+    final_answer = parsed_response["final_answer"]
+
+    if isinstance(final_answer, list):
+        return final_answer
+    elif isinstance(final_answer, dict):
+        # Si c'est un seul objet JSON, l'ajouter directement
+        return [final_answer]
+    raise ValueError("Unexpected format for 'final_answer'. Must be a list or dict.")
+
+def match_answers(batch_lines, answers):
+    """
+    Match the GPT answers of a batch to its lines on the normalized account number and label.
+    A file may repeat an account number with different labels (multi-entity uploads), so an
+    answer first goes to the line with the same number and label; only the answers whose label
+    matches none of the lines left fall back to the first line left with the same number.
+
+    Returns:
+        resolved: List of (line index, answer) pairs; each answer carries the account number of the input.
+        missing: Indexes of the lines the answers did not cover.
+    """
+    numbers = []
+    by_label = {}   # (number, label) -> indexes of the lines waiting for an answer
+    by_number = {}  # number -> indexes of the lines waiting for an answer
+    for index, line in enumerate(batch_lines):
+        number, label, _ = split_line(line)
+        numbers.append(number)
+        by_label.setdefault((normalize_number(number), normalize_label(label)), []).append(index)
+        by_number.setdefault(normalize_number(number), []).append(index)
+    keys = []
+    for item in answers:
+        try:
+            keys.append((normalize_number(str(item['account_number'])), normalize_label(str(item.get('label', '')))))
+        except (KeyError, TypeError):
+            keys.append(None)
+    matched = [None] * len(answers)
+    for position, key in enumerate(keys):
+        if key is not None and by_label.get(key):
+            index = by_label[key].pop(0)
+            by_number[key[0]].remove(index)
+            matched[position] = index
+    for position, key in enumerate(keys):
+        if key is not None and matched[position] is None and by_number.get(key[0]):
+            index = by_number[key[0]].pop(0)
+            matched[position] = index
+    resolved = [
+        (index, dict(item, account_number=numbers[index], resolved_by="gpt"))
+        for item, index in zip(answers, matched) if index is not None
+    ]
+    missing = sorted(index for indexes in by_number.values() for index in indexes)
+    return resolved, missing
+
+# Why an answer was rejected, as told to GPT in the re-ask prompt
+rejection_reasons = {
+    "unknown account": "this account does not exist in the list of {type} accounts",
+    "wrong type": "this account is not a {type} account",
+    "label mismatch": "the label you gave is the name of another {type} account",
+}
+
+@functools.lru_cache(maxsize=64)
+def _accounts_by_name(chart, type_compte):
+    """Normalized COA account name -> keys of the accounts of a type bearing that name."""
+    by_name = {}
+    for key, (_, names) in chart.accounts.get(type_compte, {}).items():
+        for name in names:
+            by_name.setdefault(name, set()).add(key)
+    return by_name
+
+def validate_answers(resolved, type_compte, chart=None):
+    """
+    Check the matched answers of a batch against the hash index of the COA, in O(1) per answer:
+    the COA account must exist among the accounts of the same type (BS or P&L), and the answered
+    label must not be the name of another account (the answer contradicts itself, e.g. 512 /
+    "Retained Earnings"). Valid answers get the COA account spelled as in the chart and its label
+    as named in the chart; a label naming no account at all is a paraphrase and is replaced by the
+    chart's name of the account (the closest one when the account has several names, GPT's label
+    when it shares nothing with any of them).
+    - resolved: List of (line index, answer) pairs, see match_answers().
+
+    Returns:
+        valid: List of (line index, answer) pairs.
+        invalid: List of (line index, answer, reason) triples, reason being a key of rejection_reasons.
+    """
+    chart = get_chart(chart)
+    index = chart.accounts.get(type_compte, {})
+    valid = []
+    invalid = []
+    for line_index, item in resolved:
+        entry = index.get(coa_key(item.get('coa_account')))
+        if entry is None:
+            key = coa_key(item.get('coa_account'))
+            other_type = any(key in accounts for acc_type, accounts in chart.accounts.items() if acc_type != type_compte)
+            invalid.append((line_index, item, "wrong type" if other_type else "unknown account"))
+            continue
+        account, names = entry
+        answered_label = normalize_label(str(item.get('coa_label', '')))
+        if answered_label not in names and answered_label in _accounts_by_name(chart, type_compte):
+            invalid.append((line_index, item, "label mismatch"))
+            continue
+        label = names.get(answered_label) or _closest_name(item.get('coa_label'), names)
+        valid.append((line_index, dict(item, coa_account=account, coa_label=label)))
+    return valid, invalid
+
+def _closest_name(label, names):
+    """
+    Name of `names` (dict {normalized name: name} of one account) closest to a paraphrased label,
+    by character n-gram overlap. The only name of a single-name account is always returned.
+    """
+    if len(names) == 1:
+        return next(iter(names.values()))
+    from retrieval import char_ngrams
+
+    grams = Counter(char_ngrams(label))
+    best, best_score = label, 0.0
+    for name in names.values():
+        name_grams = Counter(char_ngrams(name))
+        common = sum((grams & name_grams).values())
+        score = 2 * common / max(1, sum(grams.values()) + sum(name_grams.values()))
+        if score > best_score:
+            best, best_score = name, score
+    return best
+
+def build_reask_prompt(base_prompt, batch_lines, type_compte, rejected, chart=None):
+    """
+    Prompt of a focused re-ask: the accounts whose answer was rejected, why, and only the
+    COA accounts closest to their labels as candidates.
+    - rejected: List of (answered COA account, reason) for each line of `batch_lines`.
+    """
+    chart = get_chart(chart)
+    labels = [split_line(line)[1] for line in batch_lines]
+    rows = chart.indexes[type_compte].select_for_batch(labels, reask_k_per_line, reask_k_per_line * len(batch_lines))
+    parts = [chart_instructions(base_prompt, chart)]
+    for line in batch_lines:
+        parts.append("\n" + line + "\n ")
+    parts.append("\nYour previous answer was rejected for these accounts:\n")
+    for line, (coa_account, reason) in zip(batch_lines, rejected):
+        parts.append(f"- {split_line(line)[0]}: {coa_account}, {rejection_reasons[reason].format(type=type_compte)}\n")
+    parts.append("\n" + coa_header(chart) + "\n".join(chart.lines[type_compte][row] for row in rows) + "\n")
+    parts.append(f"Please provide the corresponding COA account for all the americain accounts above, chosen among the {type_compte} accounts listed\n")
+    return "".join(parts)
+
+def call_gpt_batch(prompt, model, type_compte, batch_size, max_tokens=16000, stats=None, profiler=None, before_retry=None):
+    """
+    Send one prepared prompt to GPT and return the list of mapped accounts.
+    Rate-limit, timeout and connection errors are retried with exponential backoff and jitter.
+    Other errors are traced and reported, and an empty list is returned so that the accounts
+    of this batch are re-queued by map_accounts().
+    - stats: Optional dict receiving the duration, completion tokens, whether the answer was
+      invalid or truncated and the error type, used to adapt the batch size.
+    - profiler: Optional profiling.RunProfiler timing the 'api_wait' and 'parse_json' stages.
+    - before_retry: Optional callable run before each retry, to take the retry from the rate limits.
+    """
+    stats = {} if stats is None else stats
+    profiler = profiler or null_profiler
+    openai = get_openai()
+    telemetry = get_telemetry()
+    request_start_time = time.time()
+    messages = [{"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}]
+    tags = [f'model:{model}', f'type:{type_compte}']
+    try:
+        api_start = time.perf_counter()
+        response = retry_with_backoff(
+            lambda: openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                response_format = response_format,
+                temperature=0.5,
+                max_tokens=max_tokens,
+                request_timeout=request_timeout
+            ),
+            retry_on=get_transient_errors(),
+            max_retries=max_transient_retries,
+            before_retry=before_retry
+        )
+        profiler.add('api_wait', time.perf_counter() - api_start)
+        stats['completion_tokens'] = (response.get('usage') or {}).get('completion_tokens', 0)
+        stats['truncated'] = response['choices'][0].get('finish_reason') == 'length'
+        # An answer that does not parse is a failure of the batch, not of the API
+        stats['invalid'] = True
+        with profiler.stage('parse_json'):
+            extracted_data = parse_answer(response['choices'][0]['message']['content'])
+        stats['invalid'] = False
+        # Tracer le succès (mis en mémoire tampon, envoyé par le thread de télémétrie)
+        duration = time.time() - request_start_time
+        telemetry.span(
+            "gpt_request", request_start_time, duration,
+            tags={"model": model, "type": type_compte, "batch_size": len(extracted_data), "status": "success"}
+        )
+        telemetry.histogram('gpt.request.duration', duration, tags + ['status:success'])
+        usage = response.get('usage') or {}
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+        record_prompt_cache_usage(model, type_compte, usage.get('prompt_tokens', 0), cached_tokens)
+        telemetry.histogram('gpt.request.prompt_tokens', usage.get('prompt_tokens', 0), tags)
+        telemetry.histogram('gpt.request.cached_tokens', cached_tokens, tags + [f'layout:{prompt_layout}'])
+        telemetry.histogram('gpt.request.completion_tokens', usage.get('completion_tokens', 0), tags)
+        telemetry.histogram('gpt.request.accounts', len(extracted_data), tags)
+        stats['prompt_tokens'] = usage.get('prompt_tokens', 0)
+        stats['cached_tokens'] = cached_tokens
+        profiler.count('gpt_requests')
+        profiler.count('prompt_tokens', usage.get('prompt_tokens', 0))
+        profiler.count('completion_tokens', usage.get('completion_tokens', 0))
+        stats['duration'] = duration
+        return extracted_data
+    except Exception as e:
+        duration = time.time() - request_start_time
+        stats['duration'] = duration
+        stats['error'] = type(e).__name__
+        profiler.count('gpt_errors')
+        # Tracer l'erreur
+        telemetry.span(
+            "gpt_request", request_start_time, duration,
+            tags={"model": model, "type": type_compte, "batch_size": batch_size, "status": "error"},
+            error=e
+        )
+        telemetry.histogram('gpt.request.duration', duration, tags + ['status:error'])
+        telemetry.increment('gpt.request.error', 1, tags + [f'error:{type(e).__name__}'])
+        print(f"Error calling the API: {e}")
+        return []
+
+def map_accounts(base_prompt, lines_by_type, model, max_tokens=16000, scheduler=None, max_attempts=None,
+                 on_batch_done=None, chart=None, profiler=None, usage=None, key=None):
+    """
+    Work-queue engine mapping every account line through GPT.
+    - lines_by_type: Dict {'BS': [lines], 'P&L': [lines]}; all types share the same scheduler.
+    - max_attempts: Number of batches an account may be sent in before it is reported as unresolved.
+    - on_batch_done: Optional callback(type, resolved lines, answers) called from the calling
+      thread each time a batch completes (used to checkpoint the job).
+    - chart: Chart or chart name the accounts are mapped to (default chart when None).
+    - profiler: Optional profiling.RunProfiler timing the engine stages.
+    - usage: Optional dict of counters ('requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens')
+      incremented after each completed request, to follow the cost of a running job.
+    - key: Fairness key of the requests in the scheduler (e.g. the job ID), so concurrent jobs
+      take the workers in turn.
+
+    Each line gets an ID and every answer is matched back to the IDs of its own batch
+    (on the normalized account number) and validated against the COA (see validate_answers()).
+    Only the accounts a batch failed or omitted are re-queued, into fresh batches, so a model
+    that keeps dropping an account can no longer make the job loop forever. Accounts whose
+    answer was rejected are re-asked in small batches listing only their closest COA accounts
+    (see build_reask_prompt()). Both count as an attempt of the account.
+    Batches are cut from the queue just before they are submitted, keeping a few more in flight
+    than the scheduler has workers, so each new batch uses the current adaptive batch size
+    (see batch_size_for()) and every completed batch is reported to the batch size controller.
+
+    Returns:
+        extracted_data: Dict {type: [mapped accounts]}, using the account numbers of the input.
+        unresolved: Dict {type: [lines that were still missing after max_attempts]}.
+    """
+    scheduler = scheduler or get_scheduler()
+    max_attempts = max_attempts or max_attempts_per_account
+    chart = get_chart(chart)
+    profiler = profiler or null_profiler
+    start_time = time.time()
+    max_in_flight = 2 * getattr(scheduler, 'max_workers', max_concurrent_requests)
+
+    accounts = {}     # id -> (type, line)
+    line_tokens = {}  # id -> tokens of the line
+    queued = {}       # type -> ids waiting for a batch
+    reasks = {}       # type -> ids waiting for a re-ask batch
+    rejected = {}     # id -> (answered COA account, reason) of the last rejected answer
+    fixed_tokens = {}
+    for type_compte, lines in lines_by_type.items():
+        queued[type_compte] = deque()
+        reasks[type_compte] = deque()
+        with profiler.stage('tokenize'):
+            fixed_tokens[type_compte] = fixed_prompt_tokens(base_prompt, type_compte, model, chart) if lines else 0
+            tokens_of_lines = tokenize_lines(lines, model) if lines else []
+        for line, tokens in zip(lines, tokens_of_lines):
+            account_id = len(accounts)
+            accounts[account_id] = (type_compte, line)
+            line_tokens[account_id] = tokens
+            queued[type_compte].append(account_id)
+    attempts = dict.fromkeys(accounts, 0)
+    extracted_data = {type_compte: [] for type_compte in lines_by_type}
+    unresolved = {type_compte: [] for type_compte in lines_by_type}
+    in_flight = {}  # future -> (type, ids of the batch, call stats, re-ask)
+    telemetry = get_telemetry()
+    rate_limiter = getattr(scheduler, 'rate_limiter', None)
+
+    def rate_limited(request_tokens):
+        # The scheduler only budgets the first call: every retry takes its request and tokens again
+        if rate_limiter is None:
+            return None
+        return functools.partial(rate_limiter.acquire, request_tokens)
+
+    def submit_next(type_compte):
+        queue = queued[type_compte]
+        size = batch_size_for(model, type_compte)
+        head = [queue.popleft() for _ in range(min(size, len(queue)))]
+        batch_lines, batch_tokens = next(pack_batches(
+            [accounts[account_id][1] for account_id in head], [line_tokens[account_id] for account_id in head],
+            fixed_tokens[type_compte], size, prompt_token_budget(model, fixed_tokens[type_compte], max_tokens), max_tokens
+        ))
+        batch_ids = head[:len(batch_lines)]
+        # Lines beyond the token budget go back to the front of the queue
+        queue.extendleft(reversed(head[len(batch_ids):]))
+        with profiler.stage('build_prompt'):
+            prompt = build_prompt(base_prompt, batch_lines, type_compte, chart)
+        # Budget the prompt plus the expected completion against the tokens-per-minute limit
+        request_tokens = fixed_tokens[type_compte] + batch_tokens + len(batch_lines) * output_tokens_per_account
+        stats = {}
+        future = scheduler.submit(
+            call_gpt_batch, prompt, model, type_compte, len(batch_lines), max_tokens, stats=stats, profiler=profiler,
+            before_retry=rate_limited(request_tokens), tokens=request_tokens, key=key
+        )
+        in_flight[future] = (type_compte, batch_ids, stats, False)
+
+    def submit_reask(type_compte):
+        queue = reasks[type_compte]
+        batch_ids = [queue.popleft() for _ in range(min(reask_batch_size, len(queue)))]
+        batch_lines = [accounts[account_id][1] for account_id in batch_ids]
+        with profiler.stage('build_prompt'):
+            prompt = build_reask_prompt(
+                base_prompt, batch_lines, type_compte, [rejected[account_id] for account_id in batch_ids], chart
+            )
+            request_tokens = len(get_encoding(model).encode(prompt)) + len(batch_lines) * output_tokens_per_account
+        profiler.count('reask_batches')
+        stats = {}
+        future = scheduler.submit(
+            call_gpt_batch, prompt, model, type_compte, len(batch_lines), max_tokens, stats=stats, profiler=profiler,
+            before_retry=rate_limited(request_tokens), tokens=request_tokens, key=key
+        )
+        in_flight[future] = (type_compte, batch_ids, stats, True)
+        telemetry.increment('transco.validation.reasks', 1, [f'model:{model}', f'type:{type_compte}'])
+
+    def ready(type_compte, queue, full_size):
+        # New accounts are sent right away; retried ones wait for a full batch or the last batch of their type
+        if not queue:
+            return False
+        if attempts[queue[0]] == 0 or len(queue) >= full_size:
+            return True
+        return not any(running_type == type_compte for running_type, _, _, _ in in_flight.values())
+
+    def fill():
+        # Round robin over the account types so BS and P&L share the workers
+        while len(in_flight) < max_in_flight:
+            submitted = False
+            for type_compte in queued:
+                if len(in_flight) < max_in_flight and ready(type_compte, reasks[type_compte], reask_batch_size):
+                    submit_reask(type_compte)
+                    submitted = True
+                if len(in_flight) < max_in_flight and ready(type_compte, queued[type_compte], batch_size_for(model, type_compte)):
+                    submit_next(type_compte)
+                    submitted = True
+            if not submitted:
+                return
+
+    fill()
+    while in_flight:
+        done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            type_compte, batch_ids, stats, reask = in_flight.pop(future)
+            if usage is not None and 'prompt_tokens' in stats:
+                usage['requests'] += 1
+                for counter in ('prompt_tokens', 'cached_tokens', 'completion_tokens'):
+                    usage[counter] += stats[counter]
+            batch_lines = [accounts[account_id][1] for account_id in batch_ids]
+            with profiler.stage('validate'):
+                resolved, missing = match_answers(batch_lines, future.result())
+                resolved, invalid = validate_answers(resolved, type_compte, chart)
+            profiler.count('omitted_accounts', len(missing))
+            profiler.count('rejected_answers', len(invalid))
+            resolved_items = [item for _, item in resolved]
+            extracted_data[type_compte].extend(resolved_items)
+            if on_batch_done is not None and resolved:
+                on_batch_done(type_compte, [batch_lines[index] for index, _ in resolved], resolved_items)
+            for index in missing:
+                account_id = batch_ids[index]
+                attempts[account_id] += 1
+                if attempts[account_id] < max_attempts:
+                    queued[type_compte].append(account_id)
+                else:
+                    unresolved[type_compte].append(accounts[account_id][1])
+            for index, item, reason in invalid:
+                account_id = batch_ids[index]
+                attempts[account_id] += 1
+                telemetry.increment('transco.validation.rejected', 1, [f'model:{model}', f'type:{type_compte}', f'reason:{reason}'])
+                if attempts[account_id] < max_attempts:
+                    rejected[account_id] = (item.get('coa_account'), reason)
+                    reasks[type_compte].append(account_id)
+                else:
+                    unresolved[type_compte].append(accounts[account_id][1])
+            # API errors (rate limits, outages) say nothing about the batch size and are not reported
+            failed = stats.get('invalid', False) or stats.get('truncated', False)
+            if adaptive_batch_size and not reask and 'duration' in stats and (failed or 'error' not in stats):
+                get_batch_size_controller(model, type_compte).observe(
+                    len(batch_lines), len(missing) + len(invalid), stats['duration'], stats.get('completion_tokens', 0), failed
+                )
+        fill()
+
+    for type_compte in lines_by_type:
+        telemetry.span(
+            "process_batch", start_time, time.time() - start_time,
+            tags={
+                "model": model,
+                "type": type_compte,
+                "total_processed": len(extracted_data[type_compte]),
+                "unresolved": len(unresolved[type_compte])
+            }
+        )
+        tags = [f'model:{model}', f'type:{type_compte}']
+        telemetry.increment('transco.accounts.mapped', len(extracted_data[type_compte]), tags)
+        telemetry.increment('transco.accounts.unresolved', len(unresolved[type_compte]), tags)
+    return extracted_data, unresolved
+
+def process_with_gpt_in_batches(base_prompt, lines, model, type_compte, max_tokens=16000, scheduler=None):
+    """
+    Map `lines` of a single account type through GPT, keeping up to `max_concurrent_requests`
+    batches in flight and retrying missing accounts.
+    Returns the list of mapped accounts (accounts still unresolved after the last attempt are missing).
+    """
+    extracted_data, _ = map_accounts(base_prompt, {type_compte: lines}, model, max_tokens, scheduler)
+    return extracted_data[type_compte]
+
+# Base prompt template to guide GPT toward mapping a foreign account to the accounts of the target chart
+# ({chart} is replaced by the name of the chart, see chart_instructions())
+base_prompt = """Act as an expert in international accounting. Your objective is to establish a correspondence between each provided foreign accounting account (account number, label, and type) and an appropriate {chart} account, based on a predefined list of accounts.
+The list contains either of two types of accounts:
+BS (Balance Sheet): accounts related to the balance sheet.
+P&L (Profit & Loss): accounts related to the income statement.
+For each foreign account provided, carefully analyze the following information:
+Account Number: {account_number},Label: {label}, Type: {account_type}
+Then, identify the corresponding {chart} account. Make sure to consider and fully process every account provided, without omitting any.
+"""
+def extract_from_list(response_input, acc_type):
+    """
+    Convert a JSON string or a list of dictionaries into a DataFrame. Each dictionary should contain keys:
+    ['account_number', 'label', 'coa_account', 'coa_label', 'justification'].
+
+    The returned DataFrame will have the following columns:
+    ['n° de compte', 'Libelle', 'BS ou P&L', 'Compte COA', 'Libelle COA', 'Justification', 'Source']
+    where 'Source' is the path that resolved the account ('gpt', 'cache', 'rule:exact', 'rule:fuzzy' or 'rule:range').
+
+    Parameters:
+    - response_input: A list of dictionaries extracted from the GPT responses.
+    - acc_type: The account type ('BS' or 'P&L'), added as a column in the final DataFrame.
+
+    Returns:
+    A pandas DataFrame containing the structured mapping results.
+    """
+    import pandas as pd
+
+    data = []
+    for item in response_input:
+        try:
+                # Extracting data from the dictionary
+            numero = item['account_number']
+            label = item['label']
+            coa_account = item['coa_account']
+            coa_label = item['coa_label']
+            justification = item['justification']
+            source = item.get('resolved_by', 'gpt')
+
+                # Append the extracted information to the data list
+            data.append([numero, label, acc_type, coa_account, coa_label, justification, source])
+        except AttributeError:
+            print("Error processing entry: ", item)
+
+    # Create the DataFrame
+    df = pd.DataFrame(
+        data,
+        columns=['n° de compte', 'Libelle', 'BS ou P&L', 'Compte COA', 'Libelle COA', 'Justification', 'Source']
+    )
+
+    print(f"Finished processing {len(data)} {acc_type} accounts")
+    return df
+def remove_double_asterisks(df):
+    # Pour chaque colonne du DataFrame
+    for col in df.columns:
+        # Vérifier si la colonne contient des données de type object (généralement des chaînes)
+        if df[col].dtype == 'object':
+            # Remplacer toutes les occurrences de '**' par '' (une chaîne vide)
+            df[col] = df[col].str.replace('**', '', regex=False)
+    return df
+def normalize_number(num_str: str) -> str:
+    """
+    Normalize a numeric-like string by removing leading asterisks and spaces, and converting to an integer-like string if possible.
+
+    Parameters:
+    - num_str: The input string to normalize.
+
+    Returns:
+    - A normalized string representing the number, or the original string if not convertible.
+    """
+    try:
+        # Strip leading and trailing spaces and remove leading '*'
+        num_str = num_str.strip().lstrip('*').strip()
+
+        # Attempt to convert the cleaned string to a number and back to string
+        num = float(num_str)
+        return str(int(num)) if num.is_integer() else str(num)
+    except (ValueError, AttributeError):
+        # Return the original string if conversion fails
+        return num_str
+
+
+def coa_key(account):
+    """Normalized key of a GL account, as written in the COA or in a GPT answer ('401 000', '*401000'...)."""
+    return normalize_number(str(account).replace(' ', '')) if account is not None else ''
+
+
+def read_accounts(source, name=None, profiler=None):
+    """
+    Read an uploaded accounts file (path or file-like Excel, CSV or Parquet file) into prompt lines.
+    The first three columns are the account number, the label and the BS/P&L type.
+    The file is streamed chunk by chunk and normalized with vectorized operations (see ingest.py).
+    - name: File name, used to detect the format of a file-like `source`.
+    - profiler: Optional profiling.RunProfiler.
+
+    Returns:
+        A dict {'BS': [lines], 'P&L': [lines]} of "number,label,type" strings.
+    """
+    from ingest import iter_account_lines
+
+    lines_by_type = {'BS': [], 'P&L': []}
+    for acc_type, line in iter_account_lines(source, name, profiler=profiler):
+        lines_by_type[acc_type].append(line)
+    return lines_by_type
+
+
+class MappingJob:
+    """
+    The mapping of one uploaded file: what is already known and what is left to send to GPT.
+    - lines_by_type: Dict {'BS': [lines], 'P&L': [lines]} as returned by read_accounts().
+    - file_bytes: Content of the uploaded file; when given, the job is checkpointed in a journal
+      and resumed if the same file is processed again.
+    - model: The GPT model name.
+    - chart: Name of the target chart of accounts (default chart when None). The compiled chart is
+      taken once, so a reload of its source file does not affect a job already created.
+    - profiler: Optional profiling.RunProfiler timing every stage of the job (see profiling.py).
+
+    Accounts come, in order, from the job journal (previous interrupted runs of the same file),
+    from the local pre-classifier (rules, exact and near matches of the COA names), from the
+    persistent mapping cache, and finally from GPT for whatever is left in `pending`.
+    Pending lines sharing the same normalized label are sent once: `pending` only holds one
+    representative per label and `duplicates` the lines that receive a copy of its answer.
+    """
+    def __init__(self, lines_by_type, file_bytes=None, model=model, chart=None, profiler=None):
+        self.model = model
+        self.profiler = profiler = profiler or null_profiler
+        with profiler.stage('load_chart'):
+            self.chart = get_chart(chart)
+        self.lines_by_type = lines_by_type
+        self.journal = None
+        self.resumed = {acc_type: [] for acc_type in lines_by_type}
+        journal_lines = {}
+        if file_bytes is not None:
+            self.journal = JobJournal(journal_dir, job_id_for(file_bytes, model, self.chart.hash))
+            with profiler.stage('journal'):
+                journal_lines, journal_items = self.journal.load()
+            for acc_type in lines_by_type:
+                self.resumed[acc_type] = journal_items.get(acc_type, [])
+        self.resumed_lines = journal_lines
+        # Tokens consumed by the GPT requests of run(), updated as the batches complete
+        self.usage = dict.fromkeys(('requests', 'prompt_tokens', 'cached_tokens', 'completion_tokens'), 0)
+
+        self.preclassified = {}
+        self.preclassification_stats = {}
+        self.cached = {}
+        self.pending = {}
+        self.duplicates = {}
+        for acc_type, lines in lines_by_type.items():
+            lines = without_lines(lines, journal_lines.get(acc_type, []))
+            with profiler.stage('preclassify'):
+                self.preclassified[acc_type], lines, self.preclassification_stats[acc_type] = preclassify_lines(lines, acc_type, self.chart)
+            with profiler.stage('cache_lookup'):
+                self.cached[acc_type], lines = lookup_cached_lines(lines, acc_type, model, self.chart)
+            with profiler.stage('dedup'):
+                self.pending[acc_type], self.duplicates[acc_type] = group_duplicate_lines(lines)
+        for acc_type in lines_by_type:
+            tags = [f'model:{model}', f'type:{acc_type}', f'chart:{self.chart.name}']
+            stats = self.preclassification_stats[acc_type]
+            for path in ('rule:range', 'rule:exact', 'rule:fuzzy'):
+                get_telemetry().increment('transco.preclassifier.hits', stats.get(path, 0), tags + [f'path:{path}'])
+            get_telemetry().histogram('transco.preclassifier.duration', stats['seconds'], tags)
+            get_telemetry().increment('transco.cache.hits', len(self.cached[acc_type]), tags)
+            get_telemetry().increment('transco.cache.misses', len(self.pending[acc_type]) + self.duplicate_count(acc_type), tags)
+            get_telemetry().increment('transco.dedup.collapsed', self.duplicate_count(acc_type), tags)
+
+    @property
+    def job_id(self):
+        return self.journal.job_id if self.journal is not None else None
+
+    def count(self, attribute):
+        """Total number of accounts in one of the per-type dicts ('resumed', 'preclassified', 'cached', 'pending')."""
+        return sum(len(items) for items in getattr(self, attribute).values())
+
+    def duplicate_count(self, acc_type=None):
+        """Number of pending lines served by the answer of another line with the same label."""
+        types = [acc_type] if acc_type is not None else list(self.duplicates)
+        return sum(len(lines) for t in types for lines in self.duplicates[t].values())
+
+    def total(self):
+        """Number of accounts in the file."""
+        return sum(len(lines) for lines in self.lines_by_type.values())
+
+    def spent_cost(self):
+        """Cost of the GPT requests sent so far by run()."""
+        return usage_cost(
+            self.model, self.usage['prompt_tokens'], self.usage['cached_tokens'], self.usage['completion_tokens']
+        )
+
+    def preclassification_summary(self):
+        """
+        Pre-classifier statistics summed over the account types: lines examined, lines resolved
+        by each path, hit rate and time spent.
+        """
+        summary = {"lines": 0, "rule:range": 0, "rule:exact": 0, "rule:fuzzy": 0, "seconds": 0.0}
+        for stats in self.preclassification_stats.values():
+            for key in summary:
+                summary[key] += stats.get(key, 0)
+        summary["resolved"] = summary["rule:range"] + summary["rule:exact"] + summary["rule:fuzzy"]
+        summary["hit_rate"] = summary["resolved"] / summary["lines"] if summary["lines"] else 0.0
+        return summary
+
+    def estimate(self, max_tokens=16000, batch_api=False):
+        """
+        Estimated cost of the pending accounts (one per distinct label), summed over the account types.
+        With `batch_api`, the costs are those of the discounted OpenAI Batch API.
+        """
+        estimate = {
+            "requests": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0,
+            "input_cost": 0, "output_cost": 0, "total_cost": 0
+        }
+        with self.profiler.stage('estimate'):
+            for acc_type, lines in self.pending.items():
+                if lines:
+                    for key, value in estimate_prompt_cost(base_prompt, lines, self.model, acc_type, max_tokens, chart=self.chart).items():
+                        estimate[key] += value
+        if batch_api:
+            for key in ("input_cost", "output_cost", "total_cost"):
+                estimate[key] *= batch_api_discount
+        return estimate
+
+    def run(self, on_progress=None, max_tokens=16000, scheduler=None, transport=None, on_status=None, writer=None):
+        """
+        Send the pending accounts to GPT and merge every source of results.
+        - on_progress: Optional callback(mapped, total) called after each completed batch.
+        - transport: When given, the accounts are submitted through the OpenAI Batch API
+          (see batch_api.py) instead of synchronous calls.
+        - on_status: Optional callback(status dict) called at every Batch API poll.
+        - writer: Optional export.ResultWriter. The accounts are then written to it as the
+          batches complete instead of being kept in memory, and `results` comes back empty.
+
+        Returns:
+            results: Dict {type: [mapped accounts]} (pre-classifier, cache, journal and GPT answers).
+            unresolved: Dict {type: [lines GPT could not map]}.
+        """
+        profiler = self.profiler
+        resumed = self.count('resumed')
+        total = resumed + self.count('pending') + self.duplicate_count()
+        mapped = [resumed]
+        mapped_items = {acc_type: [] for acc_type in self.lines_by_type}
+        if self.journal is not None:
+            self.journal.record_start(total)
+        for acc_type in self.lines_by_type:
+            with profiler.stage('checkpoint'):
+                store_in_cache(self.resumed[acc_type], self.resumed_lines.get(acc_type, []), acc_type, self.model, self.chart)
+            if writer is not None:
+                with profiler.stage('write_output'):
+                    writer.write(self.preclassified[acc_type] + self.cached[acc_type] + self.resumed[acc_type], acc_type)
+
+        # Every completed batch is fanned out to the duplicate labels, checkpointed in the job journal,
+        # saved in the cache and written out (or kept for the results)
+        def checkpoint(type_compte, resolved_lines, items):
+            with profiler.stage('checkpoint'):
+                resolved_lines, items = fan_out(resolved_lines, items, self.duplicates[type_compte])
+                if self.journal is not None:
+                    self.journal.record_batch(type_compte, resolved_lines, items)
+                store_in_cache(items, resolved_lines, type_compte, self.model, self.chart)
+            if writer is not None:
+                with profiler.stage('write_output'):
+                    writer.write(items, type_compte)
+            else:
+                mapped_items[type_compte].extend(items)
+            mapped[0] += len(resolved_lines)
+            if on_progress is not None:
+                on_progress(mapped[0], total)
+
+        if transport is not None:
+            from batch_api import map_accounts_with_batch_api
+
+            with profiler.stage('batch_api'):
+                _, unresolved = map_accounts_with_batch_api(
+                    base_prompt, self.pending, self.model, transport, max_tokens=max_tokens, on_batch_done=checkpoint,
+                    poll_interval=batch_poll_interval, on_status=on_status, chart=self.chart
+                )
+        else:
+            # BS and P&L accounts go through the same work queue, workers and rate-limit budget
+            _, unresolved = map_accounts(
+                base_prompt, self.pending, self.model, max_tokens=max_tokens, scheduler=scheduler, on_batch_done=checkpoint,
+                chart=self.chart, profiler=profiler, usage=self.usage, key=self.job_id
+            )
+        for acc_type, lines in unresolved.items():
+            unresolved[acc_type] = [
+                duplicate for line in lines for duplicate in [line] + self.duplicates[acc_type].get(line, [])
+            ]
+        if self.journal is not None:
+            self.journal.record_done([line for lines in unresolved.values() for line in lines])
+
+        results = {}
+        for acc_type in self.lines_by_type:
+            if writer is not None:
+                results[acc_type] = []
+            else:
+                results[acc_type] = (
+                    self.preclassified[acc_type] + self.cached[acc_type] + self.resumed[acc_type] + mapped_items[acc_type]
+                )
+        return results, unresolved
+
+
+def results_to_dataframe(results):
+    """Build the output DataFrame from the results of MappingJob.run()."""
+    import pandas as pd
+
+    frames = [extract_from_list(items, acc_type) for acc_type, items in results.items() if items]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return remove_double_asterisks(df)
+
+
+def main(argv=None):
+    """
+    Command line entry point: map an accounts file without the Streamlit interface.
+    Example: python -m transco accounts.xlsx -o mapped.xlsx --concurrency 16
+    """
+    global model, max_concurrent_requests, requests_per_minute, tokens_per_minute, cache_enabled, batch_poll_interval
+    parser = argparse.ArgumentParser(prog="transco", description="Map foreign accounts to the COA with GPT.")
+    parser.add_argument("input", nargs="?", help="Excel, CSV or Parquet file with the account number, label and BS/P&L columns.")
+    parser.add_argument("-o", "--output", help="Output file (.xlsx, .csv or .parquet). Defaults to <input>_transco.xlsx.")
+    parser.add_argument("--model", default=model, help=f"GPT model (default: {model}).")
+    parser.add_argument("--chart", default=default_chart, help=f"Target chart of accounts (default: {default_chart}), see --list-charts.")
+    parser.add_argument("--list-charts", action="store_true", help="Print the available charts of accounts and exit.")
+    parser.add_argument("--concurrency", type=int, default=max_concurrent_requests, help="Requests kept in flight.")
+    parser.add_argument("--rpm", type=int, default=requests_per_minute, help="Requests per minute budget.")
+    parser.add_argument("--tpm", type=int, default=tokens_per_minute, help="Tokens per minute budget.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the mapping cache.")
+    parser.add_argument("--no-resume", action="store_true", help="Do not checkpoint or resume the job.")
+    parser.add_argument("--estimate-only", action="store_true", help="Print the estimated cost and exit.")
+    parser.add_argument("--batch-api", action="store_true", help="Submit the job through the OpenAI Batch API (slower, cheaper).")
+    parser.add_argument("--poll-interval", type=int, default=batch_poll_interval, help="Seconds between Batch API status checks.")
+    parser.add_argument("--profile", nargs="?", const="", metavar="JSON", help="Print the time spent in each stage, and save the report to JSON if given.")
+    parser.add_argument("--profile-deep", action="store_true", help="With --profile, also capture cProfile and tracemalloc statistics (slower).")
+    args = parser.parse_args(argv)
+    if args.list_charts:
+        for name, path in chart_sources().items():
+            print(f"{name}: {path}")
+        return 0
+    if args.input is None:
+        parser.error("the input file is required")
+
+    model = args.model
+    max_concurrent_requests = args.concurrency
+    requests_per_minute = args.rpm
+    tokens_per_minute = args.tpm
+    cache_enabled = cache_enabled and not args.no_cache
+    batch_poll_interval = args.poll_interval
+
+    profiler = null_profiler
+    if args.profile is not None:
+        from profiling import RunProfiler
+
+        profiler = RunProfiler(os.path.basename(args.input), deep=args.profile_deep)
+    with open(args.input, "rb") as f:
+        file_bytes = f.read()
+    lines_by_type = read_accounts(args.input, profiler=profiler)
+    job = MappingJob(
+        lines_by_type, file_bytes=None if args.no_resume else file_bytes, model=model, chart=args.chart, profiler=profiler
+    )
+    print(
+        f"{sum(len(lines) for lines in lines_by_type.values())} accounts: "
+        f"{job.count('resumed')} resumed, {job.count('preclassified')} resolved locally, "
+        f"{job.count('cached')} from cache, {job.count('pending')} distinct labels to send to GPT "
+        f"({job.duplicate_count()} duplicates mapped with them)."
+    )
+    summary = job.preclassification_summary()
+    print(
+        f"Pre-classifier: {summary['rule:exact']} exact, {summary['rule:fuzzy']} fuzzy, {summary['rule:range']} rule matches "
+        f"({summary['hit_rate']:.0%} of {summary['lines']} lines) in {summary['seconds'] * 1000:.0f} ms"
+    )
+    estimate = job.estimate(batch_api=args.batch_api)
+    print(
+        f"Estimated cost: ${estimate['total_cost']:.2f} ({estimate['requests']} requests, "
+        f"{estimate['input_tokens']:,} input tokens of which {estimate['cached_input_tokens']:,} cached, "
+        f"{estimate['output_tokens']:,} output tokens)"
+    )
+    if args.estimate_only:
+        return 0
+    if job.job_id:
+        print(f"Job ID: {job.job_id}")
+
+    def report(mapped, total):
+        print(f"\r{mapped}/{total} accounts mapped", end="", file=sys.stderr, flush=True)
+
+    transport = None
+    on_status = None
+    if args.batch_api:
+        from batch_api import OpenAIBatchTransport
+
+        transport = OpenAIBatchTransport(openai_api_key, timeout=request_timeout)
+
+        def on_status(status):
+            print(f"\rBatch {status['status']}: {status['completed']}/{status['total']} requests", end="", file=sys.stderr, flush=True)
+
+    from export import ResultWriter
+
+    output = args.output or os.path.splitext(args.input)[0] + "_transco.xlsx"
+    with ResultWriter(output) as writer:
+        _, unresolved = job.run(on_progress=report, transport=transport, on_status=on_status, writer=writer)
+        with profiler.stage('write_output'):
+            writer.close()
+    print(file=sys.stderr)
+    print(f"Wrote {writer.rows} mapped accounts to {output}")
+    if profiler.enabled:
+        from profiling import format_report
+
+        print(format_report(profiler.finish()))
+        profiler.send(get_telemetry(), {"model": model, "chart": job.chart.name})
+        if args.profile:
+            with open(args.profile, "w", encoding="utf-8") as f:
+                f.write(profiler.to_json())
+            print(f"Wrote the profile to {args.profile}")
+    unresolved_lines = [line for lines in unresolved.values() for line in lines]
+    if unresolved_lines:
+        print(f"{len(unresolved_lines)} accounts could not be mapped after {max_attempts_per_account} attempts:")
+        for line in unresolved_lines:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Modules importing transco (batch_api...) must share this instance and the command line settings
+    sys.modules.setdefault("transco", sys.modules[__name__])
+    sys.exit(main())